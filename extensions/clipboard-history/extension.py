@@ -1,26 +1,95 @@
+import asyncio
+import bisect
+import codecs
+import ctypes
+import ctypes.util
+import hashlib
+import heapq
+import itertools
+import math
+import re
 import threading
 import time
 import json
 import logging
 import platform
+import os
+import select
 import subprocess
 import shutil
+import tempfile
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from pathlib import Path
-from fastapi import APIRouter, Body
-from typing import List, Dict, Optional
+from fastapi import APIRouter, Body, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Callable, Deque, Iterable, Iterator, List, Dict, Optional, Set, Tuple
 from pclink.core.extension_base import ExtensionBase
 
 OS_NAME = platform.system().lower()
 if OS_NAME == "windows":
-    import ctypes
     from ctypes import wintypes
 
+# Retention defaults: at most this many entries and bytes of payload, kept however old
+HISTORY_LIMIT = 50
+RETENTION_MAX_BYTES = 256 * 1024 * 1024
+EVICTION_POLICIES = ("oldest", "largest")
+# How often an age limit is applied while the clipboard is idle (seconds)
+EXPIRE_INTERVAL = 60.0
+# The writer waits this long after a change so a burst of copies becomes one append
+FLUSH_INTERVAL = 0.5
+# The snapshot is rewritten once the log has more lines than this (or twice the history)
+COMPACT_MIN_LINES = 500
+
+# Search: only the start of very large clips is indexed, and a prefix expands to at most
+# this many tokens. Ranking halves an entry's weight for every RANK_HALF_LIFE seconds of age
+# and scores at most RANK_WINDOW of the newest matches.
+INDEX_MAX_CHARS = 64 * 1024
+MAX_TOKEN_LENGTH = 64
+PREFIX_EXPANSION_LIMIT = 256
+RANK_HALF_LIFE = 7 * 24 * 3600
+RANK_WINDOW = 1000
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE = 200
+# Sync: evicted ids remembered for delta clients, long-poll and SSE timing (seconds)
+MAX_TOMBSTONES = 1024
+MAX_LONG_POLL = 60.0
+EVENT_KEEPALIVE = 15.0
+# X11: a selection owner that never answers a conversion is given up on after this many
+# seconds; a lost X connection is retried after X11_RECONNECT_DELAY
+X11_CONVERT_TIMEOUT = 2.0
+X11_RECONNECT_DELAY = 5.0
+# Blobs: payloads over INLINE_MAX_BYTES (and every non-text payload) live in content-addressed
+# files under blobs/, compressed when the type compresses well. Their entries keep only a
+# PREVIEW_CHARS text preview; the full payload is streamed from disk when asked for.
+INLINE_MAX_BYTES = 4 * 1024
+PREVIEW_CHARS = 1024
+BLOB_CHUNK = 256 * 1024
+BLOB_COMPRESS_LEVEL = 6
+# Wayland watch: the helper's pipe is read this much at a time, and the helper spools at most
+# WATCH_SPOOL_CHUNK (a multiple of 64 KiB) of a payload at once. A payload's type comes from
+# the types its clip offered, and is only sniffed from its first SNIFF_BYTES when none were listed
+WATCH_READ_BUFFER = 1024 * 1024
+WATCH_SPOOL_CHUNK = 4 * 1024 * 1024
+SNIFF_BYTES = 512
+COMPRESSIBLE_TYPES = {"application/json", "application/xml", "application/javascript",
+                      "application/x-sh", "image/svg+xml", "image/bmp", "image/x-bmp", "image/tiff"}
+
+# Clipboard I/O: a copy tool that has not finished after this many seconds is given up on,
+# and what we put on the clipboard is recognised as our own for SELF_WRITE_TTL seconds
+CLIPBOARD_IO_TIMEOUT = 5.0
+SELF_WRITE_TTL = 10.0
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
 # --- Cross-Platform Clipboard Wrapper ---
 class Clipboard:
     def __init__(self):
         self.os_name = OS_NAME
         self.copy_cmd = None
         self.paste_cmd = None
+        self.typed_copy_cmd = None  # copy command that takes the MIME type as its last argument
         self.has_wl_paste_watch = False
         
         if self.os_name == "windows":
@@ -60,10 +129,12 @@ class Clipboard:
         if shutil.which("wl-copy") and shutil.which("wl-paste"):
             self.copy_cmd = ["wl-copy"]
             self.paste_cmd =["wl-paste", "-n"]
+            self.typed_copy_cmd = ["wl-copy", "--type"]
             self.has_wl_paste_watch = True
         elif shutil.which("xclip"):
             self.copy_cmd =["xclip", "-selection", "clipboard"]
             self.paste_cmd =["xclip", "-selection", "clipboard", "-o"]
+            self.typed_copy_cmd = ["xclip", "-selection", "clipboard", "-i", "-t"]
         elif shutil.which("xsel"):
             self.copy_cmd = ["xsel", "-b", "-i"]
             self.paste_cmd =["xsel", "-b", "-o"]
@@ -148,55 +219,1701 @@ class Clipboard:
             return self._set_text_windows(text)
         elif self.copy_cmd:
             try:
-                subprocess.run(self.copy_cmd, input=text.encode('utf-8'), check=True, stderr=subprocess.DEVNULL)
+                subprocess.run(self.copy_cmd, input=text.encode('utf-8'), check=True, stderr=subprocess.DEVNULL,
+                               timeout=CLIPBOARD_IO_TIMEOUT)
                 return True
             except Exception:
                 return False
         return False
 
+    def set_stream(self, chunks: Iterable[bytes], mime: str) -> bool:
+        """Puts a payload of any type on the clipboard, piping it through without buffering when possible."""
+        if self.typed_copy_cmd:
+            try:
+                proc = subprocess.Popen(self.typed_copy_cmd + [mime], stdin=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+            except Exception:
+                return False
+            try:
+                try:
+                    for chunk in chunks:
+                        proc.stdin.write(chunk)
+                finally:
+                    proc.stdin.close()
+                return proc.wait(timeout=CLIPBOARD_IO_TIMEOUT) == 0
+            except Exception:
+                proc.kill()
+                return False
+        if mime.startswith("text/"):
+            return self.set_text(b"".join(chunks).decode("utf-8", errors="replace"))
+        return False
+
+# --- Clipboard I/O Worker ---
+class ClipboardOp:
+    def __init__(self, call: Callable[[], object], digest: Optional[str], future: Future):
+        self.call = call
+        self.digest = digest  # set only for writes
+        self.futures = [future]
+
+
+class ClipboardWorker:
+    """Runs every clipboard read and write on one thread, in the order they were asked for.
+
+    Callers get a ``concurrent.futures.Future``; routes await it through
+    ``asyncio.wrap_future`` instead of blocking the event loop on a copy
+    tool. A write still waiting in the queue when another arrives is replaced
+    by it, and both callers get the later write's outcome. The hash of each
+    payload we put on the clipboard is remembered, so the monitor can tell
+    the echo of our own write from a copy made on the PC.
+    """
+
+    def __init__(self, clipboard: Clipboard):
+        self.clipboard = clipboard
+        self.coalesced = 0
+        self._queue: Deque[ClipboardOp] = deque()
+        self._cond = threading.Condition()
+        self._own: Dict[str, float] = {}  # digest -> monotonic expiry
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=CLIPBOARD_IO_TIMEOUT)
+            self._thread = None
+
+    def get_text(self) -> Future:
+        return self._submit(self.clipboard.get_text)
+
+    def set_text(self, text: str) -> Future:
+        digest = hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+        return self._submit(lambda: self.clipboard.set_text(text), digest)
+
+    def set_stream(self, chunks: Iterable[bytes], mime: str, digest: str) -> Future:
+        return self._submit(lambda: self.clipboard.set_stream(chunks, mime), digest)
+
+    def is_own(self, digest: str) -> bool:
+        """True (once) when ``digest`` is a payload we put on the clipboard ourselves."""
+        now = time.monotonic()
+        with self._cond:
+            for stale in [d for d, expiry in self._own.items() if expiry < now]:
+                del self._own[stale]
+            return self._own.pop(digest, None) is not None
+
+    def _submit(self, call: Callable[[], object], digest: Optional[str] = None) -> Future:
+        future = Future()
+        with self._cond:
+            if not self._running:
+                future.cancel()
+                return future
+            tail = self._queue[-1] if self._queue else None
+            if digest is not None and tail is not None and tail.digest is not None:
+                tail.call, tail.digest = call, digest
+                tail.futures.append(future)
+                self.coalesced += 1
+            else:
+                self._queue.append(ClipboardOp(call, digest, future))
+                self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    for op in self._queue:
+                        for future in op.futures:
+                            future.cancel()
+                    self._queue.clear()
+                    return
+                op = self._queue.popleft()
+                # Callers that gave up in the meantime drop out; nobody left means no I/O
+                futures = [f for f in op.futures if f.set_running_or_notify_cancel()]
+                if not futures:
+                    continue
+                if op.digest is not None:
+                    # Before the write: the monitor may see the change before the copy tool returns
+                    self._own[op.digest] = time.monotonic() + SELF_WRITE_TTL
+            try:
+                result = op.call()
+            except Exception as e:
+                result, error = None, e
+            else:
+                error = None
+            if op.digest is not None and not result:
+                with self._cond:
+                    self._own.pop(op.digest, None)
+            for future in futures:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+# --- X11 Selection Watcher ---
+# Event codes and masks from X.h and Xfixes.h
+X_PROPERTY_NOTIFY = 28
+X_SELECTION_NOTIFY = 31
+X_PROPERTY_NEW_VALUE = 0
+X_PROPERTY_CHANGE_MASK = 1 << 22
+XFIXES_SELECTION_NOTIFY = 0
+XFIXES_SET_SELECTION_OWNER_NOTIFY_MASK = 1
+
+
+class XSelectionEvent(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_int), ("serial", ctypes.c_ulong), ("send_event", ctypes.c_int),
+                ("display", ctypes.c_void_p), ("requestor", ctypes.c_ulong), ("selection", ctypes.c_ulong),
+                ("target", ctypes.c_ulong), ("property", ctypes.c_ulong), ("time", ctypes.c_ulong)]
+
+
+class XPropertyEvent(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_int), ("serial", ctypes.c_ulong), ("send_event", ctypes.c_int),
+                ("display", ctypes.c_void_p), ("window", ctypes.c_ulong), ("atom", ctypes.c_ulong),
+                ("time", ctypes.c_ulong), ("state", ctypes.c_int)]
+
+
+class XFixesSelectionNotifyEvent(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_int), ("serial", ctypes.c_ulong), ("send_event", ctypes.c_int),
+                ("display", ctypes.c_void_p), ("window", ctypes.c_ulong), ("subtype", ctypes.c_int),
+                ("owner", ctypes.c_ulong), ("selection", ctypes.c_ulong), ("timestamp", ctypes.c_ulong),
+                ("selection_timestamp", ctypes.c_ulong)]
+
+
+class XEvent(ctypes.Union):
+    _fields_ = [("type", ctypes.c_int), ("xselection", XSelectionEvent), ("xproperty", XPropertyEvent),
+                ("xfixes", XFixesSelectionNotifyEvent), ("pad", ctypes.c_long * 24)]
+
+
+_X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+_X_IO_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)
+_X_IO_ERROR_EXIT_HANDLER = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p)
+
+_X11_SIGNATURES = {
+    "XOpenDisplay": ([ctypes.c_char_p], ctypes.c_void_p),
+    "XCloseDisplay": ([ctypes.c_void_p], ctypes.c_int),
+    "XConnectionNumber": ([ctypes.c_void_p], ctypes.c_int),
+    "XDefaultRootWindow": ([ctypes.c_void_p], ctypes.c_ulong),
+    "XCreateSimpleWindow": ([ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int, ctypes.c_uint,
+                             ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong, ctypes.c_ulong], ctypes.c_ulong),
+    "XDestroyWindow": ([ctypes.c_void_p, ctypes.c_ulong], ctypes.c_int),
+    "XSelectInput": ([ctypes.c_void_p, ctypes.c_ulong, ctypes.c_long], ctypes.c_int),
+    "XInternAtom": ([ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int], ctypes.c_ulong),
+    "XConvertSelection": ([ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong,
+                           ctypes.c_ulong], ctypes.c_int),
+    "XGetWindowProperty": ([ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_long, ctypes.c_long,
+                            ctypes.c_int, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong),
+                            ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_ulong),
+                            ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.POINTER(ctypes.c_ubyte))],
+                           ctypes.c_int),
+    "XFree": ([ctypes.c_void_p], ctypes.c_int),
+    "XGetAtomName": ([ctypes.c_void_p, ctypes.c_ulong], ctypes.c_void_p),
+    "XFlush": ([ctypes.c_void_p], ctypes.c_int),
+    "XPending": ([ctypes.c_void_p], ctypes.c_int),
+    "XNextEvent": ([ctypes.c_void_p, ctypes.POINTER(XEvent)], ctypes.c_int),
+    "XSetErrorHandler": ([_X_ERROR_HANDLER], ctypes.c_void_p),
+    "XSetIOErrorHandler": ([_X_IO_ERROR_HANDLER], ctypes.c_void_p),
+    "XSetIOErrorExitHandler": ([ctypes.c_void_p, _X_IO_ERROR_EXIT_HANDLER, ctypes.c_void_p], None),
+}
+_XFIXES_SIGNATURES = {
+    "XFixesQueryExtension": ([ctypes.c_void_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)],
+                             ctypes.c_int),
+    "XFixesSelectSelectionInput": ([ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong], None),
+}
+
+
+def _load_x_library(name: str, soname: str, signatures: Dict):
+    lib = ctypes.cdll.LoadLibrary(ctypes.util.find_library(name) or soname)
+    for func, (argtypes, restype) in signatures.items():
+        getattr(lib, func).argtypes = argtypes
+        getattr(lib, func).restype = restype
+    return lib
+
+
+class X11SelectionWatcher:
+    """Reports CLIPBOARD changes over a single Xlib connection.
+
+    XFixes delivers an event whenever the selection changes owner, so the watcher
+    sleeps in select() until someone copies. It then asks the owner for its
+    TARGETS, picks text when offered (else an image, else any MIME type) and
+    converts the selection into a sink from ``open_sink``, INCR chunk by INCR
+    chunk, handing the sink to ``on_payload`` when the transfer completes.
+    """
+
+    def __init__(self, open_sink: Callable[[str], "BlobWriter"], on_payload: Callable[["BlobWriter"], None]):
+        self.open_sink = open_sink
+        self.on_payload = on_payload
+        self.x11 = None
+        self.display = None
+        self.window = 0
+        self.lost = False
+        self._stopped = False
+        self._wake_r, self._wake_w = os.pipe()
+        self._converting_since: Optional[float] = None
+        self._target = 0  # TARGETS while negotiating, then the atom being transferred
+        self._sink: Optional["BlobWriter"] = None
+        self._incr = False
+        self._again = False
+        # Xlib calls these from C; they must stay referenced for as long as the connection lives
+        self._handlers = []
+
+    def open(self) -> bool:
+        """Connects to $DISPLAY; False when Xlib, XFixes or the X server is unavailable."""
+        if not os.environ.get("DISPLAY"):
+            return False
+        try:
+            x11 = _load_x_library("X11", "libX11.so.6", _X11_SIGNATURES)
+            xfixes = _load_x_library("Xfixes", "libXfixes.so.3", _XFIXES_SIGNATURES)
+        except (OSError, AttributeError):
+            # AttributeError: libX11 older than 1.7 has no XSetIOErrorExitHandler, and without
+            # it a dropped X connection would exit the whole server process
+            return False
+
+        display = x11.XOpenDisplay(None)
+        if not display:
+            return False
+        event_base, error_base = ctypes.c_int(), ctypes.c_int()
+        if not xfixes.XFixesQueryExtension(display, ctypes.byref(event_base), ctypes.byref(error_base)):
+            x11.XCloseDisplay(display)
+            return False
+
+        self._handlers = [_X_ERROR_HANDLER(self._on_error), _X_IO_ERROR_HANDLER(self._on_io_error),
+                          _X_IO_ERROR_EXIT_HANDLER(self._on_io_error_exit)]
+        x11.XSetErrorHandler(self._handlers[0])
+        x11.XSetIOErrorHandler(self._handlers[1])
+        x11.XSetIOErrorExitHandler(display, self._handlers[2], None)
+
+        self.x11, self.display = x11, display
+        self.event_base = event_base.value
+        self.window = x11.XCreateSimpleWindow(display, x11.XDefaultRootWindow(display), 0, 0, 1, 1, 0, 0, 0)
+        x11.XSelectInput(display, self.window, X_PROPERTY_CHANGE_MASK)
+        self.clipboard_atom = self._atom(b"CLIPBOARD")
+        self.utf8_atom = self._atom(b"UTF8_STRING")
+        self.string_atom = self._atom(b"STRING")
+        self.incr_atom = self._atom(b"INCR")
+        self.targets_atom = self._atom(b"TARGETS")
+        self.property_atom = self._atom(b"PCLINK_CLIPBOARD")
+        xfixes.XFixesSelectSelectionInput(display, self.window, self.clipboard_atom,
+                                          XFIXES_SET_SELECTION_OWNER_NOTIFY_MASK)
+        x11.XFlush(display)
+        return True
+
+    def run(self):
+        """Dispatches X events until stop() is called or the connection is lost."""
+        fd = self.x11.XConnectionNumber(self.display)
+        event = XEvent()
+        try:
+            while not self._stopped and not self.lost:
+                if not self.x11.XPending(self.display):
+                    timeout = X11_CONVERT_TIMEOUT if self._converting_since is not None else None
+                    readable, _, _ = select.select([fd, self._wake_r], [], [], timeout)
+                    if self._wake_r in readable:
+                        break
+                while not self.lost and self.x11.XPending(self.display):
+                    self.x11.XNextEvent(self.display, ctypes.byref(event))
+                    self._dispatch(event)
+                if (self._converting_since is not None
+                        and time.monotonic() - self._converting_since > X11_CONVERT_TIMEOUT):
+                    self._finish_conversion(None)
+        finally:
+            if self._sink is not None:
+                self._sink.discard()
+                self._sink = None
+            self.close()
+
+    def stop(self):
+        self._stopped = True
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b"x")
+            except OSError:
+                pass
+
+    def close(self):
+        if self.display:
+            if not self.lost:
+                self.x11.XDestroyWindow(self.display, self.window)
+            self.x11.XCloseDisplay(self.display)
+            self.display = None
+        wake_fds, self._wake_r, self._wake_w = (self._wake_r, self._wake_w), None, None
+        for fd in wake_fds:
+            if fd is not None:
+                os.close(fd)
+
+    def _atom(self, name: bytes) -> int:
+        return self.x11.XInternAtom(self.display, name, False)
+
+    def _atom_name(self, atom: int) -> str:
+        name = self.x11.XGetAtomName(self.display, atom)
+        if not name:
+            return ""
+        try:
+            return ctypes.string_at(name).decode("latin-1")
+        finally:
+            self.x11.XFree(name)
+
+    def _dispatch(self, event: XEvent):
+        if event.type == self.event_base + XFIXES_SELECTION_NOTIFY:
+            if event.xfixes.owner == 0:
+                return  # the owner exited and took the clipboard with it
+            if self._converting_since is not None:
+                self._again = True
+            else:
+                self._convert(self.targets_atom)
+        elif event.type == X_SELECTION_NOTIFY and event.xselection.requestor == self.window:
+            if self._target == self.targets_atom:
+                # Owners that cannot list their targets almost always still speak UTF8_STRING
+                targets = self._read_atoms() if event.xselection.property else []
+                target, mime = self._pick_target(targets)
+                self._sink = self.open_sink(mime)
+                self._convert(target)
+                return
+            if event.xselection.property == 0:
+                self._finish_conversion(None)  # refused
+                return
+            kind, data = self._read_property()
+            if kind == self.incr_atom:
+                # Deleting the property (done by the read) asks the owner for the first chunk
+                self._incr = True
+            else:
+                self._write(data)
+                self._finish_conversion(self._sink)
+        elif (event.type == X_PROPERTY_NOTIFY and self._incr
+              and event.xproperty.window == self.window and event.xproperty.atom == self.property_atom
+              and event.xproperty.state == X_PROPERTY_NEW_VALUE):
+            _, chunk = self._read_property()
+            if chunk:
+                self._write(chunk)
+                self._converting_since = time.monotonic()
+            else:
+                self._finish_conversion(self._sink)
+
+    def _pick_target(self, targets: List[int]) -> Tuple[int, str]:
+        if not targets or self.utf8_atom in targets:
+            return self.utf8_atom, "text/plain"
+        names = [(self._atom_name(atom), atom) for atom in targets]
+        for prefix in ("text/plain", "image/", ""):
+            for name, atom in names:
+                if "/" in name and name.startswith(prefix):
+                    return atom, name.split(";")[0]
+        if self.string_atom in targets:
+            return self.string_atom, "text/plain"
+        return self.utf8_atom, "text/plain"
+
+    def _convert(self, target: int):
+        self._target = target
+        self._converting_since = time.monotonic()
+        self.x11.XConvertSelection(self.display, self.clipboard_atom, target, self.property_atom,
+                                   self.window, 0)
+        self.x11.XFlush(self.display)
+
+    def _read_property(self) -> Tuple[int, bytes]:
+        """Reads and deletes the transfer property; returns (type atom, format-8 bytes)."""
+        kind, fmt = ctypes.c_ulong(), ctypes.c_int()
+        count, remaining = ctypes.c_ulong(), ctypes.c_ulong()
+        data = ctypes.POINTER(ctypes.c_ubyte)()
+        status = self.x11.XGetWindowProperty(
+            self.display, self.window, self.property_atom, 0, 0x1FFFFFFF, True, 0,
+            ctypes.byref(kind), ctypes.byref(fmt), ctypes.byref(count), ctypes.byref(remaining),
+            ctypes.byref(data)
+        )
+        if status != 0:
+            return 0, b""
+        try:
+            if not data:
+                return kind.value, b""
+            # Format-32 items are longs in Xlib's client-side representation
+            width = ctypes.sizeof(ctypes.c_long) if fmt.value == 32 else fmt.value // 8
+            return kind.value, ctypes.string_at(data, count.value * width)
+        finally:
+            if data:
+                self.x11.XFree(data)
+
+    def _read_atoms(self) -> List[int]:
+        _, data = self._read_property()
+        width = ctypes.sizeof(ctypes.c_ulong)
+        return list((ctypes.c_ulong * (len(data) // width)).from_buffer_copy(data))
+
+    def _write(self, data: bytes):
+        if self._target == self.string_atom:
+            data = data.decode("latin-1").encode("utf-8")  # one byte per character, so chunk-safe
+        self._sink.write(data)
+
+    def _finish_conversion(self, sink: Optional["BlobWriter"]):
+        self._converting_since = None
+        self._incr = False
+        self._target = 0
+        if self._sink is not None and sink is None:
+            self._sink.discard()
+        self._sink = None
+        if sink is not None:
+            self.on_payload(sink)
+        if self._again:
+            self._again = False
+            self._convert(self.targets_atom)
+
+    def _on_error(self, display, error) -> int:
+        # BadWindow and friends when an owner disappears mid-transfer; not fatal here
+        return 0
+
+    def _on_io_error(self, display) -> int:
+        self.lost = True
+        return 0
+
+    def _on_io_error_exit(self, display, data):
+        # Returning instead of exiting leaves the dead connection for run() to notice
+        self.lost = True
+
+# --- Search Index ---
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text[:INDEX_MAX_CHARS].lower()) if len(t) <= MAX_TOKEN_LENGTH]
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    """Incremental inverted index over clip text.
+
+    ``postings`` maps each token to the ids of the entries containing it and
+    ``vocabulary`` keeps the tokens sorted, so a prefix is one bisect away
+    from its matching range. Entries are added and removed as the history
+    changes; nothing is ever rebuilt from scratch.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Set[int]] = {}
+        self.vocabulary: List[str] = []
+        self.entries: Dict[int, Dict] = {}
+        self._terms: Dict[int, Dict[str, int]] = {}  # entry id -> token counts
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, entry: Dict, text: Optional[str] = None):
+        """Indexes ``text``, or the entry's inline content when no fuller text is at hand."""
+        counts: Dict[str, int] = {}
+        for token in tokenize((entry.get("content") or "") if text is None else text):
+            counts[token] = counts.get(token, 0) + 1
+        entry_id = entry["id"]
+        self.entries[entry_id] = entry
+        self._terms[entry_id] = counts
+        for token in counts:
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = set()
+                bisect.insort(self.vocabulary, token)
+            ids.add(entry_id)
+
+    def remove(self, entry: Dict):
+        entry_id = entry["id"]
+        self.entries.pop(entry_id, None)
+        for token in self._terms.pop(entry_id, {}):
+            ids = self.postings[token]
+            ids.discard(entry_id)
+            if not ids:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def clear(self):
+        self.postings.clear()
+        self.vocabulary.clear()
+        self.entries.clear()
+        self._terms.clear()
+
+    def search(self, query: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE, fuzzy: bool = False,
+               sort: str = "relevance") -> Tuple[int, List[Dict]]:
+        """Returns the number of matches and one page of them.
+
+        Every query term must match, exactly, as a prefix or (with ``fuzzy``)
+        within one edit; exact hits weigh most. Relevance multiplies that
+        text score by the entry's copy count and an exponential age decay.
+        When more than ``RANK_WINDOW`` entries match, only the newest of them
+        are scored: at that point the age decay decides the order anyway.
+        """
+        terms = [dict(self._expand(term, fuzzy)) for term in dict.fromkeys(tokenize(query))]
+        if not terms or not all(terms):
+            return 0, []
+
+        # Set algebra runs in C; narrowest term first keeps the intermediate sets small
+        matches = sorted((self._matching(tokens) for tokens in terms), key=len)
+        candidates = matches[0].intersection(*matches[1:]) if len(matches) > 1 else matches[0]
+        total = len(candidates)
+
+        if sort == "recent" or total > RANK_WINDOW:
+            wanted = offset + limit if sort == "recent" else RANK_WINDOW
+            if total * 4 >= len(self.entries):
+                # Dense match: entries are kept in insertion order, so walk back from the newest
+                picked = list(itertools.islice((i for i in reversed(self.entries) if i in candidates), wanted))
+            else:
+                picked = heapq.nlargest(wanted, candidates)  # ids grow with insertion order
+        else:
+            picked = list(candidates)
+        if sort == "recent":
+            return total, [self.entries[entry_id] for entry_id in picked[offset:]]
+
+        now = time.time()
+
+        def rank(entry_id: int) -> float:
+            counts = self._terms[entry_id]
+            score = 0.0
+            for tokens in terms:
+                # Best-weighted token of this term present in the entry; walk whichever side is smaller
+                best = 0.0
+                if len(tokens) < len(counts):
+                    for token, weight in tokens.items():
+                        n = counts.get(token)
+                        if n and weight * (1.0 + math.log(n)) > best:
+                            best = weight * (1.0 + math.log(n))
+                else:
+                    for token, n in counts.items():
+                        weight = tokens.get(token)
+                        if weight and weight * (1.0 + math.log(n)) > best:
+                            best = weight * (1.0 + math.log(n))
+                score += best
+            entry = self.entries[entry_id]
+            age = max(0.0, now - entry.get("timestamp", now))
+            return score * (1.0 + math.log(entry.get("count", 1))) * 0.5 ** (age / RANK_HALF_LIFE)
+
+        ranked = heapq.nlargest(offset + limit, picked, key=rank)
+        return total, [self.entries[entry_id] for entry_id in ranked[offset:]]
+
+    def _matching(self, tokens: Dict[str, float]) -> Set[int]:
+        """Ids containing any of ``tokens``; a single token's posting set is returned as is, not copied."""
+        if len(tokens) == 1:
+            return self.postings[next(iter(tokens))]
+        return set().union(*(self.postings[token] for token in tokens))
+
+    def _expand(self, term: str, fuzzy: bool) -> Iterable[Tuple[str, float]]:
+        """Yields (token, weight) for every indexed token the term matches."""
+        if term in self.postings:
+            yield term, 1.0
+        start = bisect.bisect_right(self.vocabulary, term)
+        for token in self.vocabulary[start:start + PREFIX_EXPANSION_LIMIT]:
+            if not token.startswith(term):
+                break
+            yield token, 0.5
+        if fuzzy and len(term) >= 3:
+            # Candidates share the first character, which keeps the scan to one vocabulary range
+            start = bisect.bisect_left(self.vocabulary, term[0])
+            end = bisect.bisect_left(self.vocabulary, chr(ord(term[0]) + 1))
+            for token in self.vocabulary[start:end]:
+                if token != term and not token.startswith(term) and within_one_edit(term, token):
+                    yield token, 0.3
+
+
+# --- Blob Storage ---
+def is_compressible(mime: str) -> bool:
+    return mime.startswith("text/") or mime in COMPRESSIBLE_TYPES
+
+
+def entry_type(mime: str) -> str:
+    if mime.startswith("text/"):
+        return "text"
+    if mime.startswith("image/"):
+        return "image"
+    return "file"
+
+
+class BlobStore:
+    """Content-addressed payload files, ``blobs/<aa>/<sha256>`` (``.z`` when zlib-compressed).
+
+    A payload is stored once however often it is copied. The history tells
+    the store when the last entry referencing a hash is gone. A writer that
+    has just produced (or found) a blob holds a claim on it until its entry
+    is in the history, so deleting dead hashes can never race a new copy.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.max_payload = RETENTION_MAX_BYTES  # writers give up on anything bigger
+        self._lock = threading.Lock()
+        self._claims: Dict[str, int] = {}
+
+    def writer(self, mime: str) -> "BlobWriter":
+        return BlobWriter(self, mime)
+
+    def path(self, digest: str) -> Optional[Path]:
+        folder = self.root / digest[:2]
+        for candidate in (folder / (digest + ".z"), folder / digest):
+            if candidate.exists():
+                return candidate
+        return None
+
+    def iter_chunks(self, digest: str) -> Iterator[bytes]:
+        """Yields the payload in chunks of at most BLOB_CHUNK bytes, decompressing as it goes."""
+        path = self.path(digest)
+        if path is None:
+            return
+        decompressor = zlib.decompressobj() if path.suffix == ".z" else None
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(BLOB_CHUNK)
+                if not chunk:
+                    break
+                if decompressor is None:
+                    yield chunk
+                    continue
+                data = decompressor.decompress(chunk, BLOB_CHUNK)
+                while data:
+                    yield data
+                    data = decompressor.decompress(decompressor.unconsumed_tail, BLOB_CHUNK)
+        if decompressor is not None:
+            tail = decompressor.flush()
+            if tail:
+                yield tail
+
+    def read_text(self, digest: str, limit: int) -> str:
+        """Decodes up to ``limit`` bytes from the start of a text payload."""
+        head = bytearray()
+        for chunk in self.iter_chunks(digest):
+            head += chunk[:limit - len(head)]
+            if len(head) >= limit:
+                break
+        return head.decode("utf-8", errors="ignore")
+
+    def commit(self, tmp_path: Path, digest: str, compressed: bool):
+        with self._lock:
+            if self.path(digest) is None:
+                target = self.root / digest[:2] / (digest + (".z" if compressed else ""))
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, target)
+            else:
+                os.unlink(tmp_path)  # already stored
+            self._claims[digest] = self._claims.get(digest, 0) + 1
+
+    def release(self, digest: str):
+        with self._lock:
+            claims = self._claims.get(digest, 0) - 1
+            if claims > 0:
+                self._claims[digest] = claims
+            else:
+                self._claims.pop(digest, None)
+
+    def delete(self, digests: Iterable[str], in_use: Callable[[str], bool]):
+        """Removes the blobs of ``digests`` that are neither claimed nor ``in_use`` any more."""
+        with self._lock:
+            for digest in digests:
+                if self._claims.get(digest) or in_use(digest):
+                    continue
+                path = self.path(digest)
+                if path is not None:
+                    try:
+                        path.unlink()
+                    except OSError as e:
+                        logging.warning(f"Failed to delete clipboard blob {digest}: {e}")
+
+    def sweep(self, live: Set[str]):
+        """Deletes temporary files and unreferenced blobs; only safe before any writer runs."""
+        if not self.root.exists():
+            return
+        for path in self.root.glob(".tmp-*"):
+            path.unlink()
+        for path in self.root.glob("*/*"):
+            if path.name.split(".")[0] not in live:
+                path.unlink()
+
+
+class BlobWriter:
+    """Streams one captured payload toward the blob store without holding it in memory.
+
+    Bytes are hashed as they arrive. Text up to INLINE_MAX_BYTES stays in
+    memory and goes inline into its entry; anything larger, and any
+    non-text payload, is spilled to a temporary file (compressed on the way
+    when the type compresses well) that ``finish`` moves to its content
+    address. Only the first INDEX_MAX_CHARS bytes of text are kept, for the
+    preview and the search index. A payload over the store's ``max_payload``
+    is dropped as soon as it gets there and ends up ``oversized``.
+    """
+
+    def __init__(self, blobs: BlobStore, mime: str):
+        self.blobs = blobs
+        self.mime = mime
+        self.size = 0
+        self.digest: Optional[str] = None
+        self.stored = False
+        self.oversized = False
+        self._hash = hashlib.sha256()
+        self._head = bytearray()
+        self._head_limit = INDEX_MAX_CHARS if self.is_text else INLINE_MAX_BYTES
+        self._file = None
+        self._tmp_path: Optional[Path] = None
+        self._compressor = None
+
+    @property
+    def is_text(self) -> bool:
+        return self.mime.startswith("text/")
+
+    def write(self, data: bytes):
+        if not data or self.oversized:
+            return
+        if self.size + len(data) > self.blobs.max_payload:
+            self.discard()
+            self.oversized = True
+            self._head = bytearray()
+            self.size += len(data)
+            return
+        if self._file is None and self.size + len(data) > INLINE_MAX_BYTES:
+            self._spill()
+        if self._file is not None:
+            self._file.write(self._compressor.compress(data) if self._compressor else data)
+        if len(self._head) < self._head_limit:
+            self._head += data[:self._head_limit - len(self._head)]
+        self._hash.update(data)
+        self.size += len(data)
+
+    def text(self) -> str:
+        """The text payload, or the start of it once it went to a blob; empty for other types."""
+        if not self.is_text:
+            return ""
+        # A truncated head may end inside a multi-byte character
+        return self._head.decode("utf-8", errors="ignore" if self._file or self.stored else "replace")
+
+    def finish(self) -> "BlobWriter":
+        if self.oversized:
+            return self
+        self.digest = self._hash.hexdigest()
+        if self._file is None and self.size and not self.is_text:
+            self._spill()
+        if self._file is not None:
+            if self._compressor:
+                self._file.write(self._compressor.flush())
+            self._file.close()
+            self._file = None
+            self.blobs.commit(self._tmp_path, self.digest, self._compressor is not None)
+            self.stored = True
+        return self
+
+    def discard(self):
+        """Drops a payload that will not become an entry."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.unlink(self._tmp_path)
+        elif self.stored:
+            self.blobs.release(self.digest)
+
+    def _spill(self):
+        self.blobs.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=str(self.blobs.root))
+        self._tmp_path = Path(tmp_path)
+        self._file = os.fdopen(fd, "wb")
+        if is_compressible(self.mime):
+            self._compressor = zlib.compressobj(BLOB_COMPRESS_LEVEL)
+        if self._head:
+            # Everything written so far still fits in the head
+            head = bytes(self._head)
+            self._file.write(self._compressor.compress(head) if self._compressor else head)
+
+
+# --- Wayland Watch Pipeline ---
+# wl-paste --watch runs this once per clipboard change, with the payload on stdin and our
+# pipe as stdout. It lists the types the clip offers and writes a "<CLIPBOARD_STATE> <type>...\n"
+# header, then the payload as "<length>\n"-prefixed chunks ending with an empty one. A pipe's
+# size is never known up front, so each chunk is spooled to a private runtime directory to
+# learn its length; only one chunk is ever spooled, and a small clip is read in full before
+# the lock is taken. Sensitive clips (password managers) are never read. The lock keeps
+# overlapping runs from interleaving.
+WATCH_HELPER = (
+    's="${CLIPBOARD_STATE:-data}"; t=; n=0; c="$PCLINK_WATCH_CHUNK"; f="$PCLINK_WATCH_SPOOL/$$"; '
+    'if [ "$s" = data ]; then '
+    't=$(wl-paste --list-types 2> /dev/null); '
+    'dd bs=65536 count=$((c / 65536)) iflag=fullblock of="$f" 2> /dev/null; n=$(wc -c < "$f"); fi; '
+    'set -f; set -- $t; '
+    'exec 4>> "$PCLINK_WATCH_LOCK"; flock 4; '
+    'printf "%s %s\\n" "$s" "$*"; '
+    'while [ "$n" -gt 0 ]; do printf "%s\\n" "$n"; cat "$f"; [ "$n" -lt "$c" ] && break; '
+    'dd bs=65536 count=$((c / 65536)) iflag=fullblock of="$f" 2> /dev/null; n=$(wc -c < "$f"); done; '
+    'rm -f "$f"; printf "0\\n"'
+)
+# Room for the longest type lists (office suites offer dozens)
+MAX_WATCH_HEADER = 8192
+
+# Types wl-paste treats as text besides text/*; it outputs plain text when offered, then any
+# other text type, then the first type offered
+X11_TEXT_TARGETS = {"UTF8_STRING", "STRING", "TEXT", "COMPOUND_TEXT"}
+PLAIN_TEXT_TYPES = ("text/plain;charset=utf-8", "text/plain", "UTF8_STRING", "STRING", "TEXT")
+TEXTUAL_TYPES = {"application/json", "application/xml", "application/javascript",
+                 "application/x-sh", "application/x-shellscript"}
+
+# Leading bytes that identify an image payload; anything else is text when it decodes as UTF-8
+IMAGE_MAGIC = ((b"\x89PNG\r\n\x1a\n", "image/png"), (b"\xff\xd8\xff", "image/jpeg"),
+               (b"GIF87a", "image/gif"), (b"GIF89a", "image/gif"),
+               (b"II*\x00", "image/tiff"), (b"MM\x00*", "image/tiff"))
+
+
+def is_text_type(mime: str) -> bool:
+    return (mime.startswith("text/") or mime in X11_TEXT_TARGETS or mime in TEXTUAL_TYPES
+            or mime.endswith(("+xml", "+json")))
+
+
+def pick_mime(types: List[str]) -> Optional[str]:
+    """The type wl-paste outputs for a clip offering ``types`` when asked for none."""
+    if not types:
+        return None
+    for mime in PLAIN_TEXT_TYPES:
+        if mime in types:
+            return "text/plain"
+    for mime in types:
+        if is_text_type(mime):
+            mime = mime.split(";")[0].strip()
+            return "text/plain" if mime in X11_TEXT_TARGETS else mime
+    return types[0].split(";")[0].strip()
+
+
+def sniff_mime(head: bytes) -> str:
+    """Guesses the type wl-paste picked from the payload's first bytes, when no types were listed."""
+    for magic, mime in IMAGE_MAGIC:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if b"\x00" not in head:
+        try:
+            # A cut-off multi-byte character at the end is fine
+            codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+            return "text/plain"
+        except UnicodeDecodeError:
+            pass
+    if head[:2] == b"BM":
+        return "image/bmp"
+    return "application/octet-stream"
+
+
+class FrameReader:
+    """Reads the helper's frames, a header then length-prefixed chunks, from an unbuffered pipe.
+
+    Reads go into one reusable buffer with ``readinto`` and a frame's body is
+    handed out as memoryview slices of it, piece by piece as it arrives, so a
+    clip is never held whole and nothing is allocated per read. Slices are
+    only valid until the sink returns.
+    """
+
+    def __init__(self, stream, size: int = WATCH_READ_BUFFER):
+        self.stream = stream
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def read_header(self) -> Optional[Tuple[str, List[str]]]:
+        """The next frame's state and offered types, or None at end of stream."""
+        header = self._read_line()
+        if not header:
+            if header is not None:
+                raise ValueError("malformed watch helper header")
+            return None
+        return header[0], header[1:]
+
+    def read_body(self, sink: Callable[[memoryview], None]):
+        """Hands the frame's chunks to ``sink`` up to the empty one that ends it."""
+        while True:
+            line = self._read_line()
+            if line is None:
+                raise EOFError("watch helper output ends inside a clip")
+            if len(line) != 1 or not line[0].isdigit():
+                raise ValueError(f"malformed watch helper chunk length {line!r}")
+            length = int(line[0])
+            if not length:
+                return
+            self._read_exact(length, sink)
+
+    def _read_line(self) -> Optional[List[str]]:
+        while True:
+            newline = self.buf.find(b"\n", self.start, min(self.end, self.start + MAX_WATCH_HEADER))
+            if newline >= 0:
+                break
+            if self.end - self.start >= MAX_WATCH_HEADER:
+                raise ValueError("malformed watch helper header")
+            if not self._fill():
+                if self.end > self.start:
+                    raise EOFError("watch helper output ends inside a header")
+                return None
+        line = bytes(self.view[self.start:newline]).decode("ascii", "replace").split()
+        self.start = newline + 1
+        return line
+
+    def _read_exact(self, length: int, sink: Callable[[memoryview], None]):
+        while length:
+            if self.start == self.end and not self._fill():
+                raise EOFError("watch helper output ends inside a clip")
+            n = min(length, self.end - self.start)
+            sink(self.view[self.start:self.start + n])
+            self.start += n
+            length -= n
+
+    def _fill(self) -> bool:
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            # Only part of a header can be left over; move it to the front
+            left = bytes(self.view[self.start:self.end])
+            self.buf[:len(left)] = left
+            self.start, self.end = 0, len(left)
+        n = self.stream.readinto(self.view[self.end:])
+        if not n:
+            return False
+        self.end += n
+        return True
+
+
+class WatchedClip:
+    """Feeds one framed payload to a blob writer, of the given type or one sniffed from the first bytes."""
+
+    def __init__(self, blobs: BlobStore, mime: Optional[str] = None):
+        self.blobs = blobs
+        self.writer: Optional[BlobWriter] = blobs.writer(mime) if mime else None
+        self._head = bytearray()
+
+    def write(self, data: memoryview):
+        if self.writer is None:
+            take = SNIFF_BYTES - len(self._head)
+            self._head += data[:take]
+            if len(self._head) < SNIFF_BYTES:
+                return
+            self._open()
+            data = data[take:]
+        self.writer.write(data)
+
+    def finish(self) -> BlobWriter:
+        if self.writer is None:
+            self._open()
+        return self.writer
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.discard()
+
+    def _open(self):
+        self.writer = self.blobs.writer(sniff_mime(bytes(self._head)))
+        self.writer.write(self._head)
+        self._head = bytearray()
+
+
+# --- History Storage ---
+class HistoryStore:
+    """Budgeted in-memory history persisted as a snapshot plus an append-only log.
+
+    ``history.json`` is a compact snapshot (newest first, the format older
+    versions wrote) and ``history.log`` holds JSON-lines operations made since.
+    Changes are queued for a writer thread that appends them in batches, and
+    the snapshot is only rewritten when the log has grown well past the
+    history itself. Operations carry the seq they were made at, so replaying
+    a log the snapshot already covers is a no-op and a crash between the two
+    steps of a compaction loses nothing.
+
+    Every change takes the next sequence number. Entries carry the ``seq`` they
+    were added at, evictions and pin changes leave bounded trails and a clear
+    raises the floor, so clients can ask for only what changed since a seq.
+
+    Entries carry the hash of their payload and a hash appears only once:
+    copying something already in the history moves it to the front as a new
+    entry (ids and seqs only ever grow) with its copy count bumped. Large and
+    non-text payloads live in ``blobs``, deleted once evicted.
+
+    Retention is by entry count, total payload bytes and age. Pinned entries
+    are never evicted but count toward the budget, so pinning is refused when
+    it would leave no room. Over the byte budget, ``eviction`` picks the
+    oldest or the largest unpinned entry; the newest entry is never the one.
+    """
+
+    def __init__(self, snapshot_path: Path, log_path: Path, blobs: BlobStore, max_entries: int = HISTORY_LIMIT,
+                 max_bytes: int = RETENTION_MAX_BYTES, max_age: float = 0, eviction: str = "oldest"):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.blobs = blobs
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age  # seconds, 0 = keep forever
+        self.eviction = eviction
+        self.blobs.max_payload = max_bytes
+        self.entries: "OrderedDict[int, Dict]" = OrderedDict()  # oldest first
+        self.by_hash: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.pinned_bytes = 0
+        self.pinned_count = 0
+        self.index = SearchIndex()
+        self._largest: List[Tuple[int, int]] = []  # heap of (-size, id); entries gone since are skipped
+        self._dead: List[str] = []  # blob hashes to delete once the log is written
+        self.seq = 0
+        self.listener: Optional[Callable[[], None]] = None  # called after every change, from any thread
+        self._floor = 0  # deltas from before this seq cannot be reconstructed
+        self._tombstones: Deque[Tuple[int, int]] = deque()  # (seq, removed entry id), oldest first
+        self._updates: Deque[Tuple[int, int]] = deque()  # (seq, id of an entry changed in place)
+        self._lock = threading.Lock()
+        self._pending: List[Dict] = []
+        self._last_id = 0
+        self._log_lines = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self):
+        entries: List[Dict] = []
+        if self.snapshot_path.exists():
+            try:
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            except Exception as e:
+                logging.error(f"Failed to load clipboard history snapshot: {e}")
+        self.entries.clear()
+        self.by_hash.clear()
+        self.index.clear()
+        self._largest.clear()
+        self.total_bytes = self.pinned_bytes = self.pinned_count = 0
+        migrated = False
+        for entry in reversed(entries):
+            if "hash" not in entry:
+                self._insert(entry, self._migrate(entry))
+                migrated = True
+            else:
+                self._insert(entry, self._indexed_text(entry))
+        covered = max((entry.get("seq", 0) for entry in entries), default=0)
+        seq = covered
+
+        lines = 0
+        if self.log_path.exists():
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        continue  # torn append from a crash
+                    kind = op.get("op")
+                    op_seq = op["entry"].get("seq", 0) if kind == "add" else op.get("seq", 0)
+                    seq = max(seq, op_seq)
+                    if op_seq and op_seq <= covered:
+                        continue  # already in the snapshot
+                    if kind == "add" and op["entry"]["id"] not in self.entries:
+                        entry = op["entry"]
+                        if "hash" not in entry:
+                            text = self._migrate(entry)
+                            migrated = True
+                        else:
+                            text = self._indexed_text(entry)
+                        self._insert(entry, text)
+                    elif kind == "del" and op["id"] in self.entries:
+                        self._remove(op["id"])
+                    elif kind == "pin" and op["id"] in self.entries:
+                        self._set_pinned(self.entries[op["id"]], op["pinned"])
+                    elif kind == "clear":
+                        for entry_id in [i for i, e in self.entries.items() if not e["pinned"]]:
+                            self._remove(entry_id)
+        self._log_lines = lines
+        self._last_id = max(self.entries, default=0)
+        # Entries saved before sequence numbers existed get them oldest first, after the highest one
+        # ever issued; seq never goes backwards, or a client's cursor would skip the next changes
+        for entry in self.entries.values():
+            if not entry.get("seq"):
+                seq += 1
+                entry["seq"] = seq
+        self.seq = self._floor = seq
+        self._tombstones.clear()
+        self._updates.clear()
+
+        # A budget lowered while the server was down applies right away
+        self._enforce(time.time())
+        self._dead.clear()
+        self.blobs.sweep({entry["hash"] for entry in self.entries.values() if entry.get("blob")})
+        if migrated:
+            self.compact()
+
+    def _migrate(self, entry: Dict) -> str:
+        """Gives an entry from before blob storage its hash and metadata; moves large text out."""
+        text = entry.get("content") or ""
+        writer = self.blobs.writer("text/plain")
+        writer.write(text.encode("utf-8", errors="replace"))
+        writer.finish()
+        entry.update({"type": "text", "mime": "text/plain", "size": writer.size, "hash": writer.digest})
+        if writer.stored:
+            writer.discard()  # nothing else runs during load, so the claim is not needed
+            entry["content"] = text[:PREVIEW_CHARS]
+            entry["blob"] = True
+        return text
+
+    def _indexed_text(self, entry: Dict) -> Optional[str]:
+        if entry.get("blob") and entry.get("type") == "text":
+            return self.blobs.read_text(entry["hash"], INDEX_MAX_CHARS)
+        return None
+
+    def configure(self, max_entries: int, max_bytes: int, max_age: float, eviction: str):
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = self.blobs.max_payload = max_bytes
+            self.max_age = max_age
+            self.eviction = eviction
+            evicted = self._enforce(time.time())
+        self._wake.set()  # the writer's expiry timer depends on max_age
+        if evicted:
+            self._changed()
+
+    def usage(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self.entries), "bytes": self.total_bytes,
+                    "pinned": self.pinned_count, "pinned_bytes": self.pinned_bytes}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def head(self) -> Optional[Dict]:
+        with self._lock:
+            return next(reversed(self.entries.values()), None)
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return list(reversed(self.entries.values()))
+
+    def get(self, entry_id: int) -> Optional[Dict]:
+        with self._lock:
+            return self.entries.get(entry_id)
+
+    def add(self, entry: Dict, text: Optional[str] = None) -> bool:
+        """Adds ``entry`` as the newest; False when its payload alone cannot fit the budget."""
+        with self._lock:
+            existing = self.entries.get(self.by_hash.get(entry["hash"]))
+            room = self.max_bytes - self.pinned_bytes
+            if existing is not None and existing["pinned"]:
+                room += existing["size"]
+            if entry["size"] > room:
+                if entry.get("blob"):
+                    self._dead.append(entry["hash"])
+                added = False
+            else:
+                # Ids are millisecond timestamps; keep them unique when copies land in the same millisecond
+                entry["id"] = self._last_id = max(entry["id"], self._last_id + 1)
+                self.seq += 1
+                entry["seq"] = self.seq
+                replaced = self._insert(entry, text)
+                if replaced is not None:
+                    self._remember(self._tombstones, replaced["id"])
+                self._pending.append({"op": "add", "entry": entry})
+                self._enforce(entry["timestamp"])
+                added = True
+        if entry.get("blob"):
+            self.blobs.release(entry["hash"])  # referenced now, or queued for deletion
+        self._wake.set()
+        if added:
+            self._changed()
+        return added
+
+    def pin(self, entry_id: int, pinned: bool) -> Optional[str]:
+        """Pins or unpins an entry; returns why not when that is impossible."""
+        with self._lock:
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                return "Entry not found"
+            if entry["pinned"] == pinned:
+                return None
+            if pinned and (self.pinned_count + 1 >= self.max_entries
+                           or self.pinned_bytes + entry["size"] > self.max_bytes):
+                return "Pinning this would leave no room in the history budget"
+            self._set_pinned(entry, pinned)
+            self.seq += 1
+            self._remember(self._updates, entry_id)
+            self._pending.append({"op": "pin", "id": entry_id, "pinned": pinned, "seq": self.seq})
+        self._wake.set()
+        self._changed()
+        return None
+
+    def expire(self):
+        with self._lock:
+            evicted = self._enforce(time.time())
+        if evicted:
+            self._wake.set()
+            self._changed()
+
+    def page(self, offset: int, limit: int) -> List[Dict]:
+        with self._lock:
+            return list(itertools.islice(reversed(self.entries.values()), offset, offset + limit))
+
+    def search(self, query: str, offset: int, limit: int, fuzzy: bool, sort: str) -> Tuple[int, List[Dict]]:
+        with self._lock:
+            return self.index.search(query, offset, limit, fuzzy, sort)
+
+    def clear(self):
+        """Removes every entry that is not pinned."""
+        with self._lock:
+            for entry_id in [i for i, e in self.entries.items() if not e["pinned"]]:
+                entry = self._remove(entry_id)
+                if entry.get("blob"):
+                    self._dead.append(entry["hash"])
+            self.seq += 1
+            self._floor = self.seq
+            self._tombstones.clear()
+            self._updates.clear()
+            self._pending.append({"op": "clear", "seq": self.seq})
+        self._wake.set()
+        self._changed()
+
+    def changes_since(self, since: int) -> Tuple[int, Optional[List[Dict]], List[int]]:
+        """Returns (seq, entries added or changed after ``since``, removed ids).
+
+        Added entries come first, newest first. Entries is None when ``since``
+        is too old (or from before a clear or restart) to be caught up with a
+        delta; the client should reload.
+        """
+        with self._lock:
+            if since < self._floor or since > self.seq:
+                return self.seq, None, []
+            changed = list(itertools.takewhile(lambda entry: entry["seq"] > since, reversed(self.entries.values())))
+            seen = {entry["id"] for entry in changed}
+            for _, entry_id in itertools.takewhile(lambda t: t[0] > since, reversed(self._updates)):
+                if entry_id in self.entries and entry_id not in seen:
+                    changed.append(self.entries[entry_id])
+                    seen.add(entry_id)
+            deleted = [entry_id for _, entry_id in itertools.takewhile(lambda t: t[0] > since,
+                                                                       reversed(self._tombstones))]
+            return self.seq, changed, deleted
+
+    # The methods below expect the lock to be held (or to run during load)
+    def _insert(self, entry: Dict, text: Optional[str]) -> Optional[Dict]:
+        """Appends ``entry`` as the newest; returns the entry it replaces if its payload was already here."""
+        replaced = None
+        if entry["hash"] in self.by_hash:
+            replaced = self._remove(self.by_hash[entry["hash"]])
+            entry["count"] = replaced.get("count", 1) + 1
+            entry["pinned"] = replaced["pinned"]
+        # Always present, so pinning later never resizes a dict another thread may be serializing
+        entry.setdefault("pinned", False)
+        self.entries[entry["id"]] = entry
+        self.by_hash[entry["hash"]] = entry["id"]
+        self.index.add(entry, text)
+        self.total_bytes += entry["size"]
+        if entry["pinned"]:
+            self.pinned_bytes += entry["size"]
+            self.pinned_count += 1
+        else:
+            self._push_largest(entry)
+        return replaced
+
+    def _remove(self, entry_id: int) -> Dict:
+        entry = self.entries.pop(entry_id)
+        del self.by_hash[entry["hash"]]
+        self.index.remove(entry)
+        self.total_bytes -= entry["size"]
+        if entry["pinned"]:
+            self.pinned_bytes -= entry["size"]
+            self.pinned_count -= 1
+        return entry
+
+    def _set_pinned(self, entry: Dict, pinned: bool):
+        if entry["pinned"] == pinned:
+            return
+        entry["pinned"] = pinned
+        sign = 1 if pinned else -1
+        self.pinned_bytes += sign * entry["size"]
+        self.pinned_count += sign
+        if not pinned:
+            self._push_largest(entry)
+
+    def _push_largest(self, entry: Dict):
+        heapq.heappush(self._largest, (-entry["size"], entry["id"]))
+        if len(self._largest) > 2 * len(self.entries) + 64:
+            self._largest = [(-e["size"], i) for i, e in self.entries.items() if not e["pinned"]]
+            heapq.heapify(self._largest)
+
+    def _enforce(self, now: float) -> int:
+        """Evicts until count, age and byte limits hold; returns how many entries went."""
+        newest = next(reversed(self.entries), None)
+        victims = []
+        overflow = len(self.entries) - self.max_entries
+        cutoff = now - self.max_age if self.max_age else None
+        if overflow > 0 or cutoff is not None:
+            for entry_id, entry in self.entries.items():
+                if entry_id == newest:
+                    break
+                if entry["pinned"]:
+                    continue
+                if len(victims) < overflow or (cutoff is not None and entry["timestamp"] < cutoff):
+                    victims.append(entry_id)
+                else:
+                    break
+        for entry_id in victims:
+            self._evict(entry_id)
+
+        evicted = len(victims)
+        while self.total_bytes > self.max_bytes:
+            victim = self._largest_victim(newest) if self.eviction == "largest" else self._oldest_victim(newest)
+            if victim is None:
+                break
+            self._evict(victim)
+            evicted += 1
+        return evicted
+
+    def _oldest_victim(self, newest: Optional[int]) -> Optional[int]:
+        for entry_id, entry in self.entries.items():
+            if entry_id == newest:
+                return None
+            if not entry["pinned"]:
+                return entry_id
+        return None
+
+    def _largest_victim(self, newest: Optional[int]) -> Optional[int]:
+        skipped = None
+        victim = None
+        while self._largest:
+            _, entry_id = heapq.heappop(self._largest)
+            entry = self.entries.get(entry_id)
+            if entry is None or entry["pinned"]:
+                continue  # gone, or pinned (unpinning pushes it again)
+            if entry_id == newest:
+                skipped = entry
+                continue
+            victim = entry_id
+            break
+        if skipped is not None:
+            self._push_largest(skipped)
+        return victim
+
+    def _evict(self, entry_id: int):
+        entry = self._remove(entry_id)
+        self.seq += 1
+        self._remember(self._tombstones, entry_id)
+        self._pending.append({"op": "del", "id": entry_id, "seq": self.seq})
+        if entry.get("blob"):
+            self._dead.append(entry["hash"])
+
+    def _remember(self, trail: Deque[Tuple[int, int]], entry_id: int):
+        trail.append((self.seq, entry_id))
+        if len(trail) > MAX_TOMBSTONES:
+            self._floor = max(self._floor, trail.popleft()[0])
+
+    def _changed(self):
+        if self.listener:
+            self.listener()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            dead, self._dead = self._dead, []
+            self._wake.clear()
+        if pending:
+            try:
+                self.log_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(op, separators=(",", ":")) + "\n" for op in pending))
+                self._log_lines += len(pending)
+            except Exception as e:
+                logging.error(f"Failed to append to clipboard history log: {e}")
+                return
+        # Only once the log no longer brings their entries back on replay
+        if dead:
+            self.blobs.delete(dead, self.by_hash.__contains__)
+        if self._log_lines > max(COMPACT_MIN_LINES, 2 * self.max_entries):
+            self.compact()
+
+    def compact(self):
+        with self._lock:
+            entries = list(reversed(self.entries.values()))
+            seq = self.seq
+            self._pending = []  # already part of the snapshot
+        tmp_path = self.snapshot_path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, separators=(",", ":"))
+            os.replace(tmp_path, self.snapshot_path)
+            # The fresh log starts with the current seq so it never goes backwards across restarts
+            with open(self.log_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"op": "seq", "seq": seq}) + "\n")
+            self._log_lines = 1
+        except Exception as e:
+            logging.error(f"Failed to compact clipboard history: {e}")
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            # An age limit needs a periodic sweep even while nothing is copied
+            if not self._wake.wait(EXPIRE_INTERVAL if self.max_age else None):
+                self.expire()
+                continue
+            self._stop.wait(FLUSH_INTERVAL)
+            self.flush()
+
+
 class Extension(ExtensionBase):
     def __init__(self, metadata, extension_path, config: dict):
         super().__init__(metadata, extension_path, config)
-        self.history_file = self.extension_path / "history.json"
         self.clipboard = Clipboard()
+        self.clipboard_io = ClipboardWorker(self.clipboard)
         
-        self.history: List[Dict] =[]
-        self._load_history()
+        self.settings_file = self.extension_path / "settings.json"
+        self.settings = self.load_settings()
+
+        self.blobs = BlobStore(self.extension_path / "blobs")
+        self.store = HistoryStore(self.extension_path / "history.json", self.extension_path / "history.log",
+                                  self.blobs, **self._retention())
+        self.store.load()
         
         self.running = False
         self.monitor_thread = None
         self._watch_proc = None
+        self._x11_watcher: Optional[X11SelectionWatcher] = None
+
+        # Sync waiters (long-poll and SSE) park on an event that is swapped out on every change
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        self.store.listener = self._on_history_change
         
         self.setup_routes()
 
+    def load_settings(self) -> Dict:
+        if self.settings_file.exists():
+            try:
+                with open(self.settings_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                    if isinstance(data, dict):
+                        return data
+            except Exception as e:
+                self.logger.error(f"Error loading settings file: {e}")
+        return {
+            "max_entries": HISTORY_LIMIT,
+            "max_bytes": RETENTION_MAX_BYTES,
+            "max_age_days": 0,
+            "eviction": "oldest"
+        }
+
+    def save_settings(self):
+        try:
+            self.settings_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.settings_file, "w", encoding="utf-8") as f:
+                json.dump(self.settings, f, indent=4)
+        except Exception as e:
+            self.logger.error(f"Error saving settings: {e}")
+
+    def _retention(self) -> Dict:
+        """HistoryStore budget arguments from the settings."""
+        eviction = self.settings.get("eviction", "oldest")
+        return {
+            "max_entries": max(1, int(self.settings.get("max_entries", HISTORY_LIMIT))),
+            "max_bytes": max(1, int(self.settings.get("max_bytes", RETENTION_MAX_BYTES))),
+            "max_age": max(0.0, float(self.settings.get("max_age_days", 0))) * 86400,
+            "eviction": eviction if eviction in EVICTION_POLICIES else "oldest"
+        }
+
+    def _get_config(self) -> Dict:
+        return {
+            "max_entries": self.store.max_entries,
+            "max_bytes": self.store.max_bytes,
+            "max_age_days": self.store.max_age / 86400,
+            "eviction": self.store.eviction,
+            "usage": self.store.usage()
+        }
+
+    def _on_history_change(self):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake_waiters)
+
+    def _wake_waiters(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def _change_event(self) -> asyncio.Event:
+        """The event set on the next history change; must be called from the server loop."""
+        loop = asyncio.get_running_loop()
+        if self._changed is None or self._loop is not loop:
+            self._loop = loop
+            self._changed = asyncio.Event()
+        return self._changed
+
+    async def _wait_for_change(self, since: int, timeout: float) -> bool:
+        event = self._change_event()
+        if self.store.seq != since:
+            return True
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _delta(self, since: int) -> Dict:
+        seq, added, deleted = self.store.changes_since(since)
+        if added is None:
+            return {"seq": seq, "reset": True, "entries": self.store.snapshot(), "deleted": []}
+        return {"seq": seq, "reset": False, "entries": added, "deleted": deleted}
+
+    async def _event_stream(self, request: Request, since: Optional[int]):
+        """Yields an SSE snapshot (or the delta from ``since``), then one delta per change."""
+        if since is None:
+            payload = {"seq": self.store.seq, "reset": True, "entries": self.store.snapshot(), "deleted": []}
+        else:
+            payload = self._delta(since)
+        yield f"event: {'snapshot' if payload['reset'] else 'delta'}\ndata: {json.dumps(payload)}\n\n"
+        since = payload["seq"]
+
+        while not await request.is_disconnected():
+            if not await self._wait_for_change(since, EVENT_KEEPALIVE):
+                yield ": keep-alive\n\n"
+                continue
+            payload = self._delta(since)
+            if payload["reset"] or payload["entries"] or payload["deleted"]:
+                yield f"event: {'snapshot' if payload['reset'] else 'delta'}\ndata: {json.dumps(payload)}\n\n"
+            since = payload["seq"]
+
     def setup_routes(self):
         @self.router.get("/history")
-        async def get_history():
-            return self.history
+        async def get_history(request: Request, response: Response, since: Optional[int] = None,
+                              wait: float = 0):
+            """Full list, or with ``since`` a delta; ``wait`` long-polls for up to that many seconds."""
+            if since is not None and wait > 0 and self.store.seq == since:
+                await self._wait_for_change(since, min(wait, MAX_LONG_POLL))
+
+            # The seq changes with every add, eviction and clear, so it doubles as the ETag
+            etag = f'W/"{self.store.seq}"'
+            if request.headers.get("if-none-match") == etag:
+                return Response(status_code=304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
+            if since is None:
+                return self.store.snapshot()
+            return self._delta(since)
+
+        @self.router.get("/events")
+        async def history_events(request: Request, since: Optional[int] = None):
+            return StreamingResponse(
+                self._event_stream(request, since),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        @self.router.get("/search")
+        async def search_history(q: str = "", offset: int = 0, limit: int = SEARCH_PAGE_SIZE,
+                                 fuzzy: bool = False, sort: str = "relevance"):
+            offset = max(0, offset)
+            limit = max(1, min(limit, MAX_SEARCH_PAGE))
+            if q.strip():
+                total, items = self.store.search(q, offset, limit, fuzzy, sort)
+            else:
+                total, items = len(self.store), self.store.page(offset, limit)
+            return {"query": q, "total": total, "offset": offset, "limit": limit, "items": items}
+
+        @self.router.get("/content/{entry_id}")
+        async def get_content(entry_id: int):
+            """The full payload of an entry; large and non-text payloads are streamed from their blob."""
+            entry = self.store.get(entry_id)
+            if entry is None:
+                raise HTTPException(status_code=404, detail="Entry not found")
+            # Copied markup and SVG must never run as a page from this origin
+            mime = "text/plain" if entry.get("type", "text") == "text" else entry.get("mime")
+            headers = {"X-Content-Type-Options": "nosniff", "Content-Security-Policy": "sandbox",
+                       "Cache-Control": "private, max-age=31536000, immutable"}
+            if not entry.get("blob"):
+                return Response(entry.get("content", ""), media_type=mime, headers=headers)
+            if self.blobs.path(entry["hash"]) is None:
+                raise HTTPException(status_code=404, detail="Content is no longer stored")
+            headers["Content-Length"] = str(entry["size"])
+            headers["ETag"] = f'"{entry["hash"]}"'
+            return StreamingResponse(self.blobs.iter_chunks(entry["hash"]), media_type=mime, headers=headers)
 
         @self.router.post("/copy")
         async def copy_content(item: Dict = Body(...)):
+            if item.get("id") is not None:
+                # Puts an existing entry, of any type, back on the PC clipboard
+                entry = self.store.get(item["id"])
+                if entry is None:
+                    return {"status": "error", "message": "Entry not found"}
+                if entry.get("blob"):
+                    write = self.clipboard_io.set_stream(self.blobs.iter_chunks(entry["hash"]), entry["mime"],
+                                                         entry["hash"])
+                else:
+                    write = self.clipboard_io.set_text(entry["content"])
+                if await self._clipboard_result(write):
+                    return {"status": "success", "message": "Copied to PC clipboard"}
+                if write.cancelled():
+                    return {"status": "error", "message": "Clipboard is shutting down"}
+                return {"status": "error", "message": f"Cannot put {entry.get('mime')} on this clipboard"}
+
             content = item.get("content")
             if content:
-                self.clipboard.set_text(content)
-                self._add_to_history(content)
-                return {"status": "success", "message": "Copied to PC clipboard"}
+                # Into the history first: the write's echo from the monitor is skipped as our own.
+                # Compressing or spilling a large copy to a blob stays off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self._add_to_history, content)
+                write = self.clipboard_io.set_text(content)
+                if await self._clipboard_result(write):
+                    return {"status": "success", "message": "Copied to PC clipboard"}
+                if write.cancelled():
+                    return {"status": "error", "message": "Clipboard is shutting down"}
+                return {"status": "error", "message": "Cannot write to this clipboard"}
             return {"status": "error", "message": "No content provided"}
 
+        @self.router.post("/pin/{entry_id}")
+        async def pin_entry(entry_id: int, data: Dict = Body(default={})):
+            error = self.store.pin(entry_id, bool(data.get("pinned", True)))
+            if error:
+                return {"status": "error", "message": error}
+            return {"status": "success"}
+
         @self.router.post("/clear")
         async def clear_history():
-            self.history =[]
-            self._save_history()
+            self.store.clear()
             return {"status": "success"}
 
+        @self.router.get("/config")
+        async def get_config():
+            return self._get_config()
+
+        @self.router.post("/config")
+        async def update_config(data: Dict = Body(...)):
+            """Updates the retention budget; entries outside the new one are evicted at once."""
+            limits = {"max_entries": (int, 1), "max_bytes": (int, 1), "max_age_days": (float, 0)}
+            for key, (kind, minimum) in limits.items():
+                if key in data:
+                    try:
+                        value = kind(data[key])
+                    except (TypeError, ValueError):
+                        raise HTTPException(status_code=400, detail=f"{key} must be a number")
+                    if value < minimum:
+                        raise HTTPException(status_code=400, detail=f"{key} must be at least {minimum}")
+                    self.settings[key] = value
+            if "eviction" in data:
+                if data["eviction"] not in EVICTION_POLICIES:
+                    raise HTTPException(status_code=400, detail=f"eviction must be one of {', '.join(EVICTION_POLICIES)}")
+                self.settings["eviction"] = data["eviction"]
+            self.store.configure(**self._retention())
+            self.save_settings()
+            return {"status": "success", **self._get_config()}
+
     def initialize(self) -> bool:
         self.logger.info("Clipboard History Extension initialized.")
         self.running = True
+        self.store.start()
+        self.clipboard_io.start()
         
         # pick the right monitor strategy
         if self.clipboard.has_wl_paste_watch:
             self.logger.info("Using event-driven wl-paste --watch (no polling)")
             self.monitor_thread = threading.Thread(target=self._monitor_wayland_watch, daemon=True)
+        elif self.clipboard.os_name == "linux" and os.environ.get("DISPLAY"):
+            self.monitor_thread = threading.Thread(target=self._monitor_x11, daemon=True)
         else:
             self.logger.info("Using poll-based clipboard monitor")
             self.monitor_thread = threading.Thread(target=self._monitor_poll, daemon=True)
@@ -210,50 +1927,154 @@ class Extension(ExtensionBase):
         if self._watch_proc:
             try: self._watch_proc.terminate()
             except Exception: pass
+        if self._x11_watcher:
+            self._x11_watcher.stop()
         if self.monitor_thread:
             self.monitor_thread.join(timeout=2.0)
+        self.clipboard_io.stop()
+        self.store.stop()
 
     def _monitor_wayland_watch(self):
-        """Uses wl-paste --watch to get notified on clipboard change (event-driven)."""
-        SENTINEL = "\x00__PCLINK_CLIP_SEP__\x00"
-        
+        """Uses wl-paste --watch to get notified on clipboard change (event-driven).
+
+        wl-paste starts WATCH_HELPER for each change, which sends the payload
+        as length-prefixed chunks along with the types the clip offered;
+        payloads of any type are streamed into the blob store as they arrive,
+        stored as the type wl-paste picked from that list.
+        """
+        lock_path = self.extension_path / "watch.lock"
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        # Clips are spooled in memory (tmpfs) when the session has a runtime directory
+        spool = tempfile.mkdtemp(prefix="pclink-clipboard-", dir=os.environ.get("XDG_RUNTIME_DIR"))
+        env = dict(os.environ, PCLINK_WATCH_LOCK=str(lock_path), PCLINK_WATCH_SPOOL=spool,
+                   PCLINK_WATCH_CHUNK=str(WATCH_SPOOL_CHUNK))
+
         while self.running:
+            clip = None
             try:
                 self._watch_proc = subprocess.Popen(
-                    ["wl-paste", "--no-newline", "--type", "text/plain", "--watch",
-                     "sh", "-c", f'cat; printf "{SENTINEL}\n"'],
+                    ["wl-paste", "--no-newline", "--watch", "sh", "-c", WATCH_HELPER],
                     stdout=subprocess.PIPE,
-                    stderr=subprocess.DEVNULL
+                    stderr=subprocess.DEVNULL,
+                    bufsize=0,
+                    env=env
                 )
-                
-                buf = []
-                for raw_line in self._watch_proc.stdout:
-                    if not self.running:
+
+                frames = FrameReader(self._watch_proc.stdout)
+                while self.running:
+                    header = frames.read_header()
+                    if header is None:
                         break
-                    
-                    line = raw_line.decode("utf-8", errors="replace")
-                    
-                    if SENTINEL in line:
-                        content = "".join(buf).strip()
-                        buf.clear()
-                        if content:
-                            self._add_to_history(content)
+                    state, types = header
+                    clip = WatchedClip(self.blobs, pick_mime(types))
+                    frames.read_body(clip.write)
+                    if state == "data":
+                        self._add_payload(clip.finish())
                     else:
-                        buf.append(line)
-                
+                        clip.discard()
+                    clip = None
+
                 self._watch_proc.wait()
-                
+
             except Exception as e:
                 self.logger.error(f"wl-paste --watch error: {e}")
                 if self.running:
                     time.sleep(5)
+            finally:
+                if clip is not None:
+                    clip.discard()
+                self._stop_watch_proc()
+
+        shutil.rmtree(spool, ignore_errors=True)
+
+    def _stop_watch_proc(self):
+        """Stops a wl-paste --watch left running and closes its pipe.
+
+        A helper blocked writing to the pipe holds the watch lock; closing the
+        read end makes it exit, so the next watcher's helpers are not stuck.
+        """
+        proc = self._watch_proc
+        if proc is None:
+            return
+        if proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=2.0)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        if proc.stdout:
+            proc.stdout.close()
+
+    def _monitor_x11(self):
+        """Event-driven X11 monitor: XFixes owner-change events on one Xlib connection.
+
+        Falls back to a long-lived ``clipnotify -l`` helper, then to polling, when
+        the in-process connection cannot be made.
+        """
+        connected = False
+        while self.running:
+            watcher = X11SelectionWatcher(self.blobs.writer, self._add_payload)
+            if watcher.open():
+                if not connected:
+                    self.logger.info("Using event-driven X11 XFixes selection events (no polling)")
+                connected = True
+                self._x11_watcher = watcher
+                if self.running:
+                    watcher.run()
+                else:
+                    watcher.close()
+                if watcher.lost:
+                    self.logger.warning("Lost the X11 connection, reconnecting")
+            else:
+                watcher.close()
+                if not connected:
+                    break
+            if self.running:
+                time.sleep(X11_RECONNECT_DELAY)
+
+        if connected or not self.running:
+            return
+        if shutil.which("clipnotify"):
+            self.logger.info("XFixes unavailable in-process, using clipnotify helper (no polling)")
+            self._monitor_clipnotify()
+        else:
+            self.logger.info("Using poll-based clipboard monitor")
+            self._monitor_poll()
+
+    def _monitor_clipnotify(self):
+        """One ``clipnotify -l`` process prints a line per clipboard change; only then is it read."""
+        while self.running:
+            try:
+                self._watch_proc = subprocess.Popen(
+                    ["clipnotify", "-s", "clipboard", "-l"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
+                )
+                for _ in self._watch_proc.stdout:
+                    if not self.running:
+                        break
+                    self._on_clipboard_text(self.clipboard_io.get_text().result())
+                self._watch_proc.wait()
+            except Exception as e:
+                self.logger.error(f"clipnotify error: {e}")
+            if self.running:
+                time.sleep(X11_RECONNECT_DELAY)
+
+    def _on_clipboard_text(self, text: Optional[str]):
+        if text and text.strip():
+            self._add_to_history(text)
 
     def _monitor_poll(self):
-        last_text = self.clipboard.get_text()
+        last_text = None
+        try:
+            last_text = self.clipboard_io.get_text().result()
+        except Exception as e:
+            self.logger.error(f"Error in clipboard monitor: {e}")
         
         while self.running:
             try:
-                current_text = self.clipboard.get_text()
+                current_text = self.clipboard_io.get_text().result()
                 if current_text and current_text != last_text:
                     if current_text.strip():
                         self._add_to_history(current_text)
@@ -263,33 +2084,48 @@ class Extension(ExtensionBase):
             
             time.sleep(5.0)
 
+    @staticmethod
+    async def _clipboard_result(future: Future):
+        """Awaits a ClipboardWorker call; None when the worker stopped before running it."""
+        try:
+            # Shielded, so a request that goes away is told apart from a worker that stopped
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            if future.cancelled():
+                return None
+            raise
+
     def _add_to_history(self, content: str):
-        if self.history and self.history[0]["content"] == content:
+        writer = self.blobs.writer("text/plain")
+        writer.write(content.encode("utf-8", errors="replace"))
+        self._add_payload(writer)
+
+    def _add_payload(self, writer: BlobWriter):
+        """Turns a captured payload into the newest entry, unless it is empty or repeats the head."""
+        writer.finish()
+        if writer.oversized:
+            self.logger.info(f"Skipped a {writer.size}-byte clip that exceeds the history budget")
+            return
+        if self.clipboard_io.is_own(writer.digest):
+            writer.discard()  # the echo of a write from /copy
+            return
+        text = writer.text()
+        head = self.store.head()
+        if not writer.size or (writer.is_text and not text.strip()) or (head and head["hash"] == writer.digest):
+            writer.discard()
             return
 
         entry = {
             "id": int(time.time() * 1000),
-            "content": content,
+            "content": text[:PREVIEW_CHARS] if writer.stored else text,
             "timestamp": time.time(),
-            "type": "text" 
+            "type": entry_type(writer.mime),
+            "mime": writer.mime,
+            "size": writer.size,
+            "hash": writer.digest
         }
-        
-        self.history.insert(0, entry)
-        if len(self.history) > 50:
-            self.history = self.history[:50]
-        self._save_history()
+        if writer.stored:
+            entry["blob"] = True
 
-    def _load_history(self):
-        if self.history_file.exists():
-            try:
-                with open(self.history_file, "r") as f:
-                    self.history = json.load(f)
-            except:
-                self.history =[]
-
-    def _save_history(self):
-        try:
-            with open(self.history_file, "w") as f:
-                json.dump(self.history, f)
-        except Exception as e:
-            self.logger.error(f"Failed to save clipboard history: {e}")
\ No newline at end of file
+        if not self.store.add(entry, text):
+            self.logger.info(f"Skipped a {writer.size}-byte clip that does not fit next to the pinned entries")
@@ -1,41 +1,815 @@
 import asyncio
+import bisect
+import contextlib
+import hashlib
+import heapq
+import itertools
 import os
+import random
 import uuid
 import time
 import logging
 import re
 import json
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
-from fastapi import APIRouter, Body, HTTPException
+from urllib.parse import urlsplit
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi import APIRouter, Body, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pclink.core.extension_base import ExtensionBase, ExtensionMetadata
 from pclink.core.extension_context import ExtensionContext
 import httpx
 
+try:
+    import h2  # noqa: F401 -- lets httpx negotiate HTTP/2 (pip install "httpx[http2]")
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
 logger = logging.getLogger("pclink.downloader")
 
+# Files smaller than this are never split into ranged segments.
+MIN_SEGMENT_SIZE = 1024 * 1024
+MAX_SEGMENTS = 16
+
+# Journal flush cadence and the point at which stale lines trigger a compaction
+JOURNAL_FLUSH_INTERVAL = 1.0
+JOURNAL_MIN_COMPACT_LINES = 1000
+
+# Connection pool defaults; a per-host cap of 0 leaves only the pool-wide limit
+POOL_MAX_CONNECTIONS = 100
+POOL_MAX_KEEPALIVE = 20
+POOL_KEEPALIVE_EXPIRY = 30.0
+
+POOL_KEYS = ("max_connections", "max_keepalive", "keepalive_expiry", "max_connections_per_host", "http2")
+
+# Completed tasks kept in the live registry; older ones move to the on-disk archive
+KEEP_FINISHED = 50
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE = 500
+
+# Received chunks are batched into buffers of this size, flushed at aligned file offsets
+WRITE_BUFFER_SIZE = 512 * 1024
+# Progress, rate limiting and yielding happen once per read batch. The batch adapts
+# between these bounds so one takes about READ_BATCH_INTERVAL at the measured rate,
+# and halves while the event loop lags by more than READ_LAG_LIMIT
+MIN_READ_SIZE = 16 * 1024
+MAX_READ_SIZE = 1024 * 1024
+READ_BATCH_INTERVAL = 0.01
+READ_LAG_LIMIT = 0.02
+# Fast links rarely suspend inside the read loop, so it yields to the server this often
+LOOP_YIELD_INTERVAL = 0.005
+# Progress notifications (journal, change feed) are coalesced to this interval per task
+PROGRESS_NOTIFY_INTERVAL = 0.25
+
+# How many seconds of traffic a rate-limited bucket may accumulate as burst
+RATE_BURST_SECONDS = 0.5
+
+# Progress event stream: default coalescing tick, and idle keep-alive interval
+EVENT_TICK = 0.5
+EVENT_KEEPALIVE = 15.0
+MAX_TOMBSTONES = 1024
+# Status changes remembered per task, so filtered deltas know what a client was shown
+MAX_STATUS_HISTORY = 16
+
+# Transient failures are retried with jittered exponential backoff from the durable offset
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BACKOFF = 1.0
+RETRY_MAX_DELAY = 60.0
+RETRY_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+# Digests computed while streaming; a mismatch against the expected checksum retries this often
+DEFAULT_HASH_ALGORITHMS = ["sha256"]
+CHECKSUM_RETRIES = 2
+HASH_READ_SIZE = 1024 * 1024
+
+# A stream on a task with spare mirrors is abandoned when it averages less than
+# this many bytes/sec over a window, or stalls for a whole window
+MIRROR_MIN_SPEED = 64 * 1024
+MIRROR_SLOW_WINDOW = 5.0
+# Weight of the newest sample in the per-host throughput and latency averages
+MIRROR_STATS_ALPHA = 0.3
+
+# HEAD probes made when adding downloads: concurrency bound, timeout and result cache
+PROBE_CONCURRENCY = 16
+PROBE_TIMEOUT = 5.0
+PROBE_CACHE_TTL = 300.0
+PROBE_CACHE_SIZE = 4096
+
+# Metrics: histogram bucket bounds (seconds, bytes/sec) and event-loop lag sampling period
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+THROUGHPUT_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KiB/s .. 1 GiB/s
+LAG_SAMPLE_INTERVAL = 0.5
+
+
+class TokenBucket:
+    """Byte-rate token bucket; a rate of 0 means unlimited.
+
+    Consumers may overdraw the bucket and are told how long to wait for the
+    debt to refill, which keeps concurrent streams close to a fair share.
+    """
+
+    def __init__(self, rate: float = 0):
+        self.rate = 0.0
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        self.rate = max(0.0, float(rate or 0))
+        self.capacity = self.rate * RATE_BURST_SECONDS
+        self.tokens = min(self.tokens, self.capacity)
+
+    def reserve(self, amount: int, now: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class BandwidthLimiter:
+    """Global, per-host and per-task caps applied to every received chunk."""
+
+    def __init__(self):
+        self.global_bucket = TokenBucket()
+        self.host_buckets: Dict[str, TokenBucket] = {}
+
+    def configure(self, global_limit: Optional[float] = None, host_limits: Optional[Dict[str, float]] = None):
+        if global_limit is not None:
+            self.global_bucket.set_rate(global_limit)
+        if host_limits is not None:
+            for host, rate in host_limits.items():
+                host = host.strip().lower()
+                if not rate:
+                    self.host_buckets.pop(host, None)
+                elif host in self.host_buckets:
+                    self.host_buckets[host].set_rate(rate)
+                else:
+                    self.host_buckets[host] = TokenBucket(rate)
+
+    def host_limits(self) -> Dict[str, float]:
+        return {host: bucket.rate for host, bucket in self.host_buckets.items()}
+
+    def effective_limit(self, task: "DownloadTask") -> float:
+        buckets = (self.global_bucket, self.host_buckets.get(task.host), task.bucket)
+        rates = [b.rate for b in buckets if b and b.rate > 0]
+        return min(rates) if rates else 0.0
+
+    def reserve(self, task: "DownloadTask", amount: int, host: Optional[str] = None) -> float:
+        """Draws ``amount`` bytes from every applicable bucket; returns seconds to wait."""
+        host_bucket = self.host_buckets.get(host or task.host)
+        if self.global_bucket.rate <= 0 and task.bucket.rate <= 0 and host_bucket is None:
+            return 0.0
+        now = time.monotonic()
+        return max(
+            self.global_bucket.reserve(amount, now),
+            task.bucket.reserve(amount, now),
+            host_bucket.reserve(amount, now) if host_bucket else 0.0
+        )
+
+
+class ConnectionLimiter:
+    """Caps concurrent requests per host on top of the client's pool limits.
+
+    With keep-alive, a host that is only ever given a few connections at a
+    time serves many small files over the same few sockets.
+    """
+
+    def __init__(self, per_host: int = 0):
+        self.per_host = per_host
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+
+    def configure(self, per_host: int):
+        if per_host != self.per_host:
+            self.per_host = per_host
+            self._slots = {}  # current holders release into the semaphores they took
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url: str):
+        if self.per_host <= 0:
+            yield
+            return
+        host = (urlsplit(url).hostname or "").lower()
+        semaphore = self._slots.get(host)
+        if semaphore is None:
+            semaphore = self._slots[host] = asyncio.Semaphore(self.per_host)
+        async with semaphore:
+            yield
+
+
+class Histogram:
+    """Fixed-bucket histogram, cumulative in the Prometheus style when exported."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99)
+        }
+
+    def prometheus(self, name: str, labels: str = "") -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+class DownloadMetrics:
+    """Engine-wide counters and latency/throughput histograms.
+
+    Chunk and progress counters are bumped from the event loop; write
+    latency is observed on the DiskWriter thread, which is its only writer.
+    """
+
+    COUNTERS = ("tasks_started", "tasks_completed", "tasks_failed", "bytes_received", "retries", "mirror_switches",
+                "revalidations", "revalidated_unchanged")
+    HISTOGRAMS = {
+        "ttfb_seconds": "Time from sending a request to its response headers",
+        "chunk_latency_seconds": "Gap between consecutive read batches of one stream",
+        "write_latency_seconds": "Duration of one buffered disk write",
+        "task_throughput_bytes_per_second": "Average rate of each finished download run",
+        "loop_lag_seconds": "How late the event loop wakes a sleeping coroutine"
+    }
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {name: 0 for name in self.COUNTERS}
+        self.ttfb = Histogram(LATENCY_BUCKETS)
+        self.chunk_latency = Histogram(LATENCY_BUCKETS)
+        self.write_latency = Histogram(LATENCY_BUCKETS)
+        self.throughput = Histogram(THROUGHPUT_BUCKETS)
+        self.loop_lag = Histogram(LATENCY_BUCKETS)
+        self.last_lag = 0.0
+        self._lag_task: Optional[asyncio.Task] = None
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def histograms(self) -> Dict[str, Histogram]:
+        return {
+            "ttfb_seconds": self.ttfb,
+            "chunk_latency_seconds": self.chunk_latency,
+            "write_latency_seconds": self.write_latency,
+            "task_throughput_bytes_per_second": self.throughput,
+            "loop_lag_seconds": self.loop_lag
+        }
+
+    def ensure_lag_monitor(self):
+        if self._lag_task is None or self._lag_task.done():
+            try:
+                self._lag_task = asyncio.get_running_loop().create_task(self._sample_lag())
+            except RuntimeError:
+                pass  # no loop yet; the next call from inside the server starts it
+
+    def stop(self):
+        if self._lag_task and not self._lag_task.done():
+            self._lag_task.cancel()
+        self._lag_task = None
+
+    async def _sample_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            self.last_lag = max(0.0, loop.time() - before - LAG_SAMPLE_INTERVAL)
+            self.loop_lag.observe(self.last_lag)
+
+    def to_dict(self) -> Dict:
+        return {**self.counters, **{name: h.to_dict() for name, h in self.histograms().items()}}
+
+    def prometheus(self, tasks: List["DownloadTask"]) -> str:
+        lines = []
+        for name in self.COUNTERS:
+            metric = f"pclink_downloader_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {self.counters[name]}"]
+        for name, histogram in self.histograms().items():
+            metric = f"pclink_downloader_{name}"
+            lines += [f"# HELP {metric} {self.HISTOGRAMS[name]}", f"# TYPE {metric} histogram"]
+            lines += histogram.prometheus(metric)
+
+        states: Dict[str, int] = {}
+        for task in tasks:
+            states[task.status] = states.get(task.status, 0) + 1
+        lines.append("# TYPE pclink_downloader_tasks gauge")
+        lines += [f'pclink_downloader_tasks{{status="{status}"}} {n}' for status, n in sorted(states.items())]
+
+        # Per-task series only for running tasks, to keep label cardinality bounded
+        running = [t for t in tasks if t.status == "downloading"]
+        for metric, kind, value in (
+            ("pclink_downloader_task_bytes", "gauge", lambda t: t.bytes_downloaded),
+            ("pclink_downloader_task_speed_bytes_per_second", "gauge", lambda t: t.get_current_speed()),
+            ("pclink_downloader_task_ttfb_seconds", "gauge", lambda t: t.ttfb),
+            ("pclink_downloader_task_retries", "gauge", lambda t: t.retries)
+        ):
+            lines.append(f"# TYPE {metric} {kind}")
+            lines += [f'{metric}{{task="{t.id}"}} {value(t)}' for t in running]
+        return "\n".join(lines) + "\n"
+
+
+class DiskWriter:
+    """One background thread that owns every file handle the downloader writes to.
+
+    Writes are ``(path, offset, data)`` jobs executed in submission order, so
+    the event loop never blocks on disk I/O and each stream's buffers land
+    sequentially.
+    """
+
+    def __init__(self, metrics: Optional[DownloadMetrics] = None):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pclink-dl-writer")
+        self._files: Dict[Path, "object"] = {}  # only touched from the writer thread
+        self.metrics = metrics
+
+    def _submit(self, fn, *args) -> "asyncio.Future":
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def prepare(self, path: Path, size: int = 0, truncate: bool = False) -> "asyncio.Future":
+        """Creates (or truncates) the file and preallocates it to ``size`` bytes."""
+        return self._submit(self._prepare, path, size, truncate)
+
+    def write(self, path: Path, offset: int, data: bytes, hasher: Optional["StreamHasher"] = None) -> "asyncio.Future":
+        return self._submit(self._write, path, offset, data, hasher)
+
+    def catch_up(self, path: Path, hasher: "StreamHasher") -> "asyncio.Future":
+        """Hashes bytes already on disk that the hasher was seeded with."""
+        return self._submit(self._catch_up, path, hasher)
+
+    def digest(self, path: Path, hasher: "StreamHasher", size: int) -> "asyncio.Future":
+        """Resolves to the hex digests of the first ``size`` bytes of the file."""
+        return self._submit(self._digest, path, hasher, size)
+
+    def close(self, path: Path) -> "asyncio.Future":
+        return self._submit(self._close, path)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def _open(self, path: Path):
+        f = self._files.get(path)
+        if f is None:
+            f = self._files[path] = open(path, "r+b", buffering=0)
+        return f
+
+    def _prepare(self, path: Path, size: int, truncate: bool):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if truncate or not path.exists():
+            self._close(path)
+            open(path, "wb").close()
+        if size:
+            f = self._open(path)
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+
+    def _write(self, path: Path, offset: int, data: bytes, hasher: Optional["StreamHasher"]) -> int:
+        started = time.perf_counter()
+        f = self._open(path)
+        f.seek(offset)
+        view = memoryview(data)
+        while view:
+            view = view[f.write(view):]
+        if hasher is not None:
+            # The buffer is still ours until this job returns, so hash it in place
+            hasher.update(f, offset, data)
+        if self.metrics:
+            self.metrics.write_latency.observe(time.perf_counter() - started)
+        return len(data)
+
+    def _catch_up(self, path: Path, hasher: "StreamHasher"):
+        if path.exists():
+            hasher.update(self._open(path), hasher.offset, b"")
+
+    def _digest(self, path: Path, hasher: "StreamHasher", size: int) -> Dict[str, str]:
+        f = self._open(path)
+        if hasher.offset != size:
+            # Something was written behind the hasher's back; fall back to a full pass
+            hasher = StreamHasher(hasher.algorithms)
+            hasher.read_through(f, size)
+        return hasher.hexdigests()
+
+    def _close(self, path: Path):
+        f = self._files.pop(path, None)
+        if f is not None:
+            f.close()
+
+
+class FileSink:
+    """Copies one stream's chunks into two reusable buffers for the DiskWriter.
+
+    While one buffer is being written on the writer thread the other fills;
+    a full buffer waits for the in-flight one, which bounds memory per stream
+    and slows the network reader when the disk falls behind. The first flush
+    is cut short so later ones start on ``WRITE_BUFFER_SIZE`` boundaries.
+    ``on_flushed`` is told how many bytes reached the file.
+    """
+
+    def __init__(self, writer: DiskWriter, path: Path, offset: int, on_flushed: Callable[[int], None],
+                 hasher: Optional["StreamHasher"] = None):
+        self.writer = writer
+        self.path = path
+        self.offset = offset
+        self.on_flushed = on_flushed
+        self.hasher = hasher
+        self._views = [memoryview(bytearray(WRITE_BUFFER_SIZE))]
+        self._current = 0
+        self._fill = 0
+        self._limit = WRITE_BUFFER_SIZE - offset % WRITE_BUFFER_SIZE
+        self._pending: Optional[asyncio.Future] = None
+
+    async def write(self, chunk: bytes):
+        data = memoryview(chunk)
+        while data:
+            n = min(len(data), self._limit - self._fill)
+            self._views[self._current][self._fill:self._fill + n] = data[:n]
+            self._fill += n
+            data = data[n:]
+            if self._fill == self._limit:
+                await self._flush()
+
+    async def close(self):
+        if self._fill:
+            await self._flush()
+        await self._drain()
+
+    async def _flush(self):
+        # The other buffer is only reusable once its write has landed
+        await self._drain()
+        self._pending = self.writer.write(self.path, self.offset, self._views[self._current][:self._fill], self.hasher)
+        self._pending.add_done_callback(self._flushed)
+        self.offset += self._fill
+        self._fill = 0
+        self._limit = WRITE_BUFFER_SIZE
+        if len(self._views) == 1:
+            self._views.append(memoryview(bytearray(WRITE_BUFFER_SIZE)))
+        self._current ^= 1
+
+    def _flushed(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            self.on_flushed(future.result())
+
+    async def _drain(self):
+        if self._pending is not None:
+            # Shielded so a cancelled task can still wait for its last write in close()
+            await asyncio.shield(self._pending)
+            self._pending = None
+
+
+class StreamHasher:
+    """Incremental digests of a file that is written in arbitrary-offset pieces.
+
+    Bytes landing at the hash frontier are hashed straight from the write
+    buffer. Pieces written further ahead (later segments) are only recorded
+    as extents; once the frontier reaches one it is read back from the file,
+    which the writer just filled, so the page cache usually serves it. Only
+    touched from the DiskWriter thread once created.
+    """
+
+    def __init__(self, algorithms: List[str], extents: Optional[List[Tuple[int, int]]] = None):
+        self.algorithms = list(algorithms)
+        self._hashes = [hashlib.new(name) for name in self.algorithms]
+        self.offset = 0
+        self._ahead: Dict[int, int] = {}   # extent start -> end (exclusive)
+        self._ends: Dict[int, int] = {}    # extent end -> start
+        for start, end in extents or []:
+            self._add_extent(start, end)
+
+    def update(self, f, offset: int, data) -> None:
+        if offset > self.offset:
+            self._add_extent(offset, offset + len(data))
+            return
+        skip = self.offset - offset
+        if skip < len(data):
+            for h in self._hashes:
+                h.update(data[skip:])
+            self.offset += len(data) - skip
+        # Absorb extents written before the frontier reached them
+        while self.offset in self._ahead:
+            end = self._ahead.pop(self.offset)
+            self._ends.pop(end, None)
+            self.read_through(f, end)
+
+    def read_through(self, f, end: int):
+        f.seek(self.offset)
+        while self.offset < end:
+            block = f.read(min(HASH_READ_SIZE, end - self.offset))
+            if not block:
+                break
+            for h in self._hashes:
+                h.update(block)
+            self.offset += len(block)
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {name: h.hexdigest() for name, h in zip(self.algorithms, self._hashes)}
+
+    def _add_extent(self, start: int, end: int):
+        if end <= start:
+            return
+        if start in self._ends:
+            start = self._ends.pop(start)
+            del self._ahead[start]
+        if end in self._ahead:
+            following = self._ahead.pop(end)
+            del self._ends[following]
+            end = following
+        previous = self._ahead.get(start)
+        if previous is not None:
+            # Re-written piece of a known extent; keep the longer one
+            del self._ends[previous]
+            end = max(end, previous)
+        self._ahead[start] = end
+        self._ends[end] = start
+
+
+class MirrorError(Exception):
+    """A mirror is too slow, or serves something other than the file being fetched."""
+
+
+class StreamInterrupted(RuntimeError):
+    """The server closed a response before all requested bytes arrived."""
+
+
+class MirrorStats:
+    """Per-host throughput, latency and error history used to rank mirrors.
+
+    Kept across tasks (and restarts) so a host that was slow or failing for
+    one download starts lower in the list for the next one.
+    """
+
+    def __init__(self):
+        self.hosts: Dict[str, Dict[str, float]] = {}
+
+    @staticmethod
+    def _host(url: str) -> str:
+        return (urlsplit(url).hostname or "").lower()
+
+    def _entry(self, url: str) -> Dict[str, float]:
+        return self.hosts.setdefault(self._host(url), {"speed": 0.0, "latency": 0.0, "errors": 0.0, "samples": 0})
+
+    def record(self, url: str, nbytes: int, seconds: float, error: bool = False):
+        entry = self._entry(url)
+        if error:
+            entry["errors"] += 1
+        elif nbytes > 0:
+            entry["errors"] *= 0.5
+        if nbytes > 0 and seconds > 0:
+            speed = nbytes / seconds
+            entry["speed"] = speed if not entry["samples"] else \
+                entry["speed"] + MIRROR_STATS_ALPHA * (speed - entry["speed"])
+            entry["samples"] += 1
+
+    def record_latency(self, url: str, seconds: float):
+        entry = self._entry(url)
+        entry["latency"] = seconds if not entry["latency"] else \
+            entry["latency"] + MIRROR_STATS_ALPHA * (seconds - entry["latency"])
+
+    def rank(self, urls: List[str]) -> List[str]:
+        """Best first; hosts without history rank as an average known host, ties keep input order."""
+        known = [e["speed"] for e in self.hosts.values() if e["samples"]]
+        neutral = sum(known) / len(known) if known else 0.0
+
+        def score(url: str) -> float:
+            entry = self.hosts.get(self._host(url))
+            if entry is None:
+                return neutral
+            speed = entry["speed"] if entry["samples"] else neutral
+            return speed / (1.0 + entry["errors"])
+
+        return sorted(urls, key=score, reverse=True)
+
+    def load(self, data: Dict):
+        self.hosts = {host: dict(entry) for host, entry in (data or {}).items() if isinstance(entry, dict)}
+
+    def to_dict(self) -> Dict:
+        return {host: dict(entry) for host, entry in self.hosts.items()}
+
+
 class DownloadTask:
-    def __init__(self, task_id: str, url: str, filename: str, save_path: Path):
+    # Slots keep each live task compact and catch typos in attribute names
+    __slots__ = (
+        "id", "url", "filename", "path", "bytes_downloaded", "total_size", "status", "error", "priority",
+        "queue_seq", "last_updated", "max_segments", "segments", "speed", "_last_bytes", "_last_speed_time",
+        "_task", "_stopping", "listener", "bucket", "limiter", "host", "mirrors", "mirror_stats", "min_mirror_speed",
+        "_bad_mirrors", "metrics", "ttfb", "retries", "mirror_switches", "_run_started", "_run_bytes",
+        "max_retries", "retry_backoff", "retry_attempt", "next_retry_at", "fixed_read_size", "read_size",
+        "writer", "_last_notify", "algorithms", "expected", "checksums", "etag", "hasher",
+        "connections", "last_modified", "refresh", "last_checked",
+    )
+
+    def __init__(self, task_id: str, url: str, filename: str, save_path: Path, segments: int = 1, rate_limit: float = 0):
         self.id = task_id
         self.url = url
         self.filename = filename
         self.path = save_path
         self.bytes_downloaded = 0
         self.total_size = 0
-        self.status = "paused"  # downloading, paused, completed, error
+        self.status = "paused"  # queued, downloading, paused, completed, error
         self.error = None
+        self.priority = 0
+        self.queue_seq = 0  # tie-breaker inside a priority, assigned by the scheduler
         self.last_updated = time.time()
+
+        # Segmented mode: each segment is {"start", "end", "done"} with an inclusive end.
+        # An empty list means the task runs (or will probe for) a single stream.
+        self.max_segments = max(1, min(int(segments or 1), MAX_SEGMENTS))
+        self.segments: List[Dict[str, int]] = []
         
         # Speed measurement
         self.speed = 0.0  # bytes/sec
         self._last_bytes = 0
         self._last_speed_time = time.time()
         
-        # Async task reference
+        # Async task reference, and the cancelled loop a restart must wait for
         self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Task] = None
+
+        # Invoked whenever persisted state changes (status, progress, url)
+        self.listener: Optional[Callable[["DownloadTask"], None]] = None
+
+        # Bandwidth: own cap plus the shared limiter assigned by the extension
+        self.bucket = TokenBucket(rate_limit)
+        self.limiter: Optional[BandwidthLimiter] = None
+        self.connections = ConnectionLimiter()
+        self.host = (urlsplit(url).hostname or "").lower()
+
+        # Alternative URLs for the same file; `url` is the one currently preferred
+        self.mirrors: List[str] = [url]
+        self.mirror_stats: Optional[MirrorStats] = None
+        self.min_mirror_speed = MIRROR_MIN_SPEED
+        self._bad_mirrors: set = set()
+
+        # Observability for the current run; not persisted
+        self.metrics: Optional[DownloadMetrics] = None
+        self.ttfb = 0.0
+        self.retries = 0
+        self.mirror_switches = 0
+        self._run_started = 0.0
+        self._run_bytes = 0
+
+        # Retry policy and read batching; `fixed_read_size` of 0 lets the batch adapt
+        self.max_retries = DEFAULT_MAX_RETRIES
+        self.retry_backoff = DEFAULT_RETRY_BACKOFF
+        self.retry_attempt = 0
+        self.next_retry_at = 0.0
+        self.fixed_read_size = 0
+        self.read_size = MIN_READ_SIZE
+        self.writer: Optional[DiskWriter] = None
+        self._last_notify = 0.0
+
+        # Integrity: digests computed while streaming, checked against `expected` when given
+        self.algorithms = list(DEFAULT_HASH_ALGORITHMS)
+        self.expected: Dict[str, str] = {}
+        self.checksums: Dict[str, str] = {}
+        self.etag: Optional[str] = None
+        self.hasher: Optional[StreamHasher] = None
+
+        # Revalidation: a refresh asks the server whether the finished file changed
+        self.last_modified: Optional[str] = None
+        self.refresh = False
+        self.last_checked = 0.0
+
+    def to_record(self) -> Dict:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "mirrors": self.mirrors,
+            "filename": self.filename,
+            "path": str(self.path),
+            "status": self.status,
+            "error": self.error,
+            "total_size": self.total_size,
+            "bytes_downloaded": self.bytes_downloaded,
+            "max_segments": self.max_segments,
+            "segments": [dict(seg) for seg in self.segments],
+            "rate_limit": self.bucket.rate,
+            "priority": self.priority,
+            "algorithms": self.algorithms,
+            "expected": self.expected,
+            "checksums": self.checksums,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "refresh": self.refresh,
+            "last_checked": self.last_checked,
+            "max_retries": self.max_retries,
+            "retry_backoff": self.retry_backoff,
+            "read_size": self.fixed_read_size,
+            "last_updated": self.last_updated
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict) -> "DownloadTask":
+        task = cls(record["id"], record["url"], record["filename"], Path(record["path"]),
+                   segments=record.get("max_segments", 1), rate_limit=record.get("rate_limit", 0))
+        task.status = record.get("status", "paused")
+        task.error = record.get("error")
+        task.mirrors = record.get("mirrors") or [task.url]
+        task.priority = record.get("priority", 0)
+        task.total_size = record.get("total_size", 0)
+        task.segments = record.get("segments") or []
+        task.algorithms = record.get("algorithms") or list(DEFAULT_HASH_ALGORITHMS)
+        task.expected = record.get("expected") or {}
+        task.checksums = record.get("checksums") or {}
+        task.etag = record.get("etag")
+        task.last_modified = record.get("last_modified")
+        task.refresh = record.get("refresh", False)
+        task.last_checked = record.get("last_checked", 0.0)
+        task.max_retries = record.get("max_retries", DEFAULT_MAX_RETRIES)
+        task.retry_backoff = record.get("retry_backoff", DEFAULT_RETRY_BACKOFF)
+        task.set_read_size(record.get("read_size", 0))
+        task.last_updated = record.get("last_updated", task.last_updated)
+
+        # Trust the disk over the journal for how far a single stream got
+        if task.segments:
+            task.bytes_downloaded = sum(seg["done"] for seg in task.segments)
+        elif task.path.exists():
+            task.bytes_downloaded = task.path.stat().st_size
+        elif task.status != "completed":
+            task.bytes_downloaded = 0
+        else:
+            task.bytes_downloaded = record.get("bytes_downloaded", 0)
+        task._last_bytes = task.bytes_downloaded
+        return task
+
+    def set_read_size(self, size: int):
+        """Pins the read batch to ``size`` bytes; 0 makes it adaptive again."""
+        self.fixed_read_size = max(0, int(size or 0))
+        self.read_size = max(MIN_READ_SIZE, self.fixed_read_size) if self.fixed_read_size else MIN_READ_SIZE
+
+    def notify(self):
+        if self.listener:
+            self.listener(self)
 
-    def update_speed(self):
+    def set_url(self, url: str):
+        """Replaces the current URL (and its mirror entry) with ``url``."""
+        self.mirrors = [url] + [m for m in self.mirrors if m not in (url, self.url)]
+        self._prefer(url)
+        self.notify()
+
+    def set_mirrors(self, urls: List[str]):
+        self.mirrors = list(dict.fromkeys(urls))
+        self._prefer(self.mirrors[0])
+
+    def _prefer(self, url: str):
+        self.url = url
+        self.host = (urlsplit(url).hostname or "").lower()
+
+    def _ranked_mirrors(self) -> List[str]:
+        """Usable mirrors, best first; the current URL leads when stats cannot tell them apart."""
+        usable = [m for m in self.mirrors if m not in self._bad_mirrors]
+        usable.sort(key=lambda m: m != self.url)
+        return self.mirror_stats.rank(usable) if self.mirror_stats else usable
+
+    def _record_progress(self, count: int) -> float:
         now = time.time()
+        self.bytes_downloaded += count
+        if self.metrics:
+            self.metrics.counters["bytes_received"] += count
+        self.update_speed(now)
+        self.last_updated = now
+        if now - self._last_notify >= PROGRESS_NOTIFY_INTERVAL:
+            self._last_notify = now
+            self.notify()
+        return now
+
+    def update_speed(self, now: Optional[float] = None):
+        now = now or time.time()
         dt = now - self._last_speed_time
         if dt >= 0.5:
             bytes_diff = max(0, self.bytes_downloaded - self._last_bytes)
@@ -52,97 +826,1199 @@ class DownloadTask:
             self._last_speed_time = now
         return self.speed
 
-    def cancel(self):
+    def _stop_loop(self):
         if self._task and not self._task.done():
             self._task.cancel()
-            self._task = None
-        if self.status == "downloading":
+            self._stopping = self._task
+        self._task = None
+
+    def cancel(self) -> Optional[asyncio.Task]:
+        """Stops the download; returns the loop being cancelled so callers can await it."""
+        loop_task = self._task
+        self._stop_loop()
+        if self.status in ("downloading", "queued"):
             self.status = "paused"
+            self.notify()
+        return loop_task if loop_task and not loop_task.done() else None
 
     def start(self, client: httpx.AsyncClient):
-        self.cancel()
+        self._stop_loop()
+        previous, self._stopping = self._stopping, None
+        if previous is not None and previous.done():
+            previous = None
         self.status = "downloading"
         self.error = None
         self._last_bytes = self.bytes_downloaded
         self._last_speed_time = time.time()
-        self._task = asyncio.create_task(self._download_loop(client))
+        self._run_started = time.monotonic()
+        self._run_bytes = self.bytes_downloaded
+        self.retry_attempt = 0
+        self.next_retry_at = 0.0
+        if self.metrics:
+            self.metrics.count("tasks_started")
+            self.metrics.ensure_lag_monitor()
+        self._task = asyncio.create_task(self._download_loop(client, previous))
+        self.notify()
 
-    async def _download_loop(self, client: httpx.AsyncClient):
+    async def _download_loop(self, client: httpx.AsyncClient, previous: Optional[asyncio.Task] = None):
         try:
-            headers = {}
-            file_exists = self.path.exists()
-            current_file_size = self.path.stat().st_size if file_exists else 0
-            
-            if file_exists:
-                self.bytes_downloaded = current_file_size
+            if previous is not None:
+                # A quick pause/resume: the old loop may still be flushing bytes and segment offsets
+                await asyncio.wait([previous])
+            while True:
+                progress = self.bytes_downloaded
+                try:
+                    await self._attempt(client)
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(e, self.bytes_downloaded > progress)
+                    if delay is None:
+                        raise
+                    logger.warning(f"Download task {self.id} interrupted ({e}); "
+                                   f"retry {self.retry_attempt}/{self.max_retries} in {delay:.1f}s")
+                    self._count_retry()
+                    self.error = f"{e} (retry {self.retry_attempt}/{self.max_retries})"
+                    self.next_retry_at = time.time() + delay
+                    self.speed = 0.0
+                    self.notify()
+                    await asyncio.sleep(delay)
+                    self.next_retry_at = 0.0
+                    self.error = None
+
+            self.status = "completed"
+            self.error = None
+            self.speed = 0.0
+            if self.metrics:
+                self.metrics.count("tasks_completed")
+                elapsed = time.monotonic() - self._run_started
+                if elapsed > 0 and self.bytes_downloaded > self._run_bytes:
+                    self.metrics.throughput.observe((self.bytes_downloaded - self._run_bytes) / elapsed)
+            self.notify()
+
+        except asyncio.CancelledError:
+            # A restart may already have replaced this loop; only the current one owns the status
+            if self._task is asyncio.current_task():
+                self.status = "paused"
+                self.next_retry_at = 0.0
+                self.notify()
+            self.speed = 0.0
+            raise
+        except Exception as e:
+            logger.error(f"Download task {self.id} failed: {e}", exc_info=True)
+            if self.metrics:
+                self.metrics.count("tasks_failed")
+            self.status = "error"
+            self.error = str(e)
+            self.speed = 0.0
+            self.notify()
+        finally:
+            await self.writer.close(self.path)
+
+    async def _attempt(self, client: httpx.AsyncClient):
+        """One pass from the durable offset to a verified file."""
+        if self.refresh:
+            if await self._revalidate(client):
+                return
+            # Changed upstream: the old digest and validators describe the old file
+            await self._discard()
+            self.expected = {}
+            self.etag = self.last_modified = None
+            self.refresh = False
+
+        for attempt in range(CHECKSUM_RETRIES + 1):
+            if not self.path.exists():
+                # Nothing to resume from (new task, or the file vanished while paused)
+                self.segments = []
+                self.hasher = None
+            self._bad_mirrors = set()
+            # With spare mirrors even one segment is worth planning: ranged streams can fail over
+            if not self.segments and (self.max_segments > 1 or len(self.mirrors) > 1) and not self.path.exists():
+                await self._plan_segments(client)
+            await self._prepare_hasher()
+
+            if self.segments:
+                await self._download_segmented(client)
             else:
+                await self._download_single(client)
+
+            if await self._verify():
+                return
+            if attempt == CHECKSUM_RETRIES:
+                raise RuntimeError(f"Checksum mismatch after {attempt + 1} attempts")
+            logger.warning(f"Download task {self.id} failed verification, retrying from scratch")
+            self._count_retry()
+            await self._discard()
+
+    async def _revalidate(self, client: httpx.AsyncClient) -> bool:
+        """Sends the stored validators; True when the server says the file is unchanged."""
+        self.last_checked = time.time()
+        if not self.path.exists() or not (self.etag or self.last_modified):
+            return False
+        # A one-byte range keeps a "changed" answer cheap when the server ignores the validators
+        headers = {"Range": "bytes=0-0"}
+        if self.metrics:
+            self.metrics.count("revalidations")
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        async with self._connection(self.url), \
+                client.stream("GET", self.url, headers=headers, follow_redirects=True) as response:
+            if response.status_code != 304:
+                response.raise_for_status()
+                if response.status_code == 206:
+                    await response.aread()  # one byte; keeps the connection reusable
+                return False
+            await response.aread()
+        self.refresh = False
+        if self.metrics:
+            self.metrics.count("revalidated_unchanged")
+        return True
+
+    def _connection(self, url: str):
+        return self.connections.slot(url)
+
+    def _remember_validators(self, headers: httpx.Headers):
+        self.etag = headers.get("ETag") or self.etag
+        self.last_modified = headers.get("Last-Modified") or self.last_modified
+
+    def _retry_delay(self, error: Exception, progressed: bool) -> Optional[float]:
+        """Seconds to back off before retrying, or None when ``error`` is final."""
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code not in RETRY_STATUS_CODES:
+                return None
+        elif not isinstance(error, (httpx.TransportError, MirrorError, StreamInterrupted)):
+            return None
+        if progressed:
+            self.retry_attempt = 0  # only consecutive fruitless attempts count against the budget
+        if self.retry_attempt >= self.max_retries:
+            return None
+        self.retry_attempt += 1
+
+        # Equal jitter: half the exponential step, plus up to as much again at random
+        step = min(RETRY_MAX_DELAY, self.retry_backoff * 2 ** (self.retry_attempt - 1))
+        delay = step / 2 + random.uniform(0, step / 2)
+        if isinstance(error, httpx.HTTPStatusError):
+            retry_after = error.response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, min(float(retry_after), RETRY_MAX_DELAY))
+        return delay
+
+    def _count_retry(self, mirror_switch: bool = False):
+        self.retries += 1
+        if mirror_switch:
+            self.mirror_switches += 1
+        if self.metrics:
+            self.metrics.count("retries")
+            if mirror_switch:
+                self.metrics.count("mirror_switches")
+
+    def _observe_ttfb(self, started: float):
+        self.ttfb = time.monotonic() - started
+        if self.metrics:
+            self.metrics.ttfb.observe(self.ttfb)
+
+    def metrics_snapshot(self) -> Dict:
+        elapsed = time.monotonic() - self._run_started if self.status == "downloading" else 0.0
+        return {
+            "status": self.status,
+            "bytes_downloaded": self.bytes_downloaded,
+            "speed": self.get_current_speed(),
+            "average_speed": (self.bytes_downloaded - self._run_bytes) / elapsed if elapsed > 0 else 0.0,
+            "ttfb": self.ttfb,
+            "retries": self.retries,
+            "mirror_switches": self.mirror_switches
+        }
+
+    def _durable_extents(self) -> List[Tuple[int, int]]:
+        if self.segments:
+            return [(seg["start"], seg["start"] + seg["done"]) for seg in self.segments]
+        if self.path.exists():
+            return [(0, self.path.stat().st_size)]
+        return []
+
+    async def _prepare_hasher(self):
+        """Continues the in-memory digest, or rebuilds it from disk after a restart."""
+        if not self.algorithms:
+            self.hasher = None
+            return
+        if self.hasher is None:
+            # hashlib state cannot be persisted, so a restored task rehashes its prefix once
+            self.hasher = StreamHasher(self.algorithms, self._durable_extents())
+            await self.writer.catch_up(self.path, self.hasher)
+
+    def _restart_hash(self):
+        if self.algorithms:
+            self.hasher = StreamHasher(self.algorithms)
+
+    async def _verify(self) -> bool:
+        """Records the final digests; False when they contradict an expected checksum."""
+        if self.hasher is None:
+            return True
+        size = self.segments[-1]["end"] + 1 if self.segments else self.bytes_downloaded
+        self.checksums = await self.writer.digest(self.path, self.hasher, size)
+        for name, expected in self.expected.items():
+            if self.checksums.get(name) != expected:
+                logger.warning(f"Download task {self.id}: {name} {self.checksums.get(name)} != {expected}")
+                return False
+        return True
+
+    async def _discard(self):
+        await self.writer.close(self.path)
+        if self.path.exists():
+            self.path.unlink()
+        self.segments = []
+        self.bytes_downloaded = 0
+        self.checksums = {}
+        self.hasher = None
+        self.notify()
+
+    async def _plan_segments(self, client: httpx.AsyncClient):
+        """Races a range probe across mirrors and splits the file into segments.
+
+        The first mirror to answer with a 206 becomes the preferred URL.
+        Leaves ``self.segments`` empty when no mirror honours ranges or the
+        file is too small, so the caller falls back to a single stream.
+        """
+        probes = {asyncio.create_task(self._probe(client, url)): url for url in self._ranked_mirrors()}
+        total = 0
+        try:
+            for probe in asyncio.as_completed(list(probes)):
+                try:
+                    url, total, headers = await probe
+                except (httpx.HTTPError, MirrorError, ValueError, IndexError):
+                    continue
+                self._prefer(url)
+                self._remember_validators(headers)
+                break
+        finally:
+            for probe, url in probes.items():
+                if not probe.done():
+                    probe.cancel()
+                elif not probe.cancelled() and probe.exception() is not None:
+                    self._bad_mirrors.add(url)
+        if not total:
+            return
+
+        self.total_size = total
+        count = min(self.max_segments, total // MIN_SEGMENT_SIZE)
+        if count < 2 and len(self.mirrors) == 1:
+            return
+        count = max(1, count)
+
+        size = total // count
+        segments = []
+        for i in range(count):
+            start = i * size
+            end = total - 1 if i == count - 1 else start + size - 1
+            segments.append({"start": start, "end": end, "done": 0})
+
+        # Preallocate so every segment can write at its own offset
+        await self.writer.prepare(self.path, total, truncate=True)
+        self.segments = segments
+        self.bytes_downloaded = 0
+        self._restart_hash()
+        self.notify()
+
+    async def _probe(self, client: httpx.AsyncClient, url: str) -> Tuple[str, int, httpx.Headers]:
+        """Fetches the first byte of ``url``; returns it with the total size and response headers."""
+        started = time.monotonic()
+        try:
+            async with self._connection(url), \
+                    client.stream("GET", url, headers={"Range": "bytes=0-0"}, follow_redirects=True) as response:
+                if response.status_code != 206:
+                    raise MirrorError(f"{url} does not honour range requests")
+                total = int(response.headers.get("Content-Range", "").split("/")[-1])
+                headers = response.headers
+                await response.aread()  # drain the single byte so the connection goes back to the pool
+        except httpx.HTTPError:
+            if self.mirror_stats:
+                self.mirror_stats.record(url, 0, 0, error=True)
+            raise
+        if self.mirror_stats:
+            self.mirror_stats.record_latency(url, time.monotonic() - started)
+        return url, total, headers
+
+    async def _download_segmented(self, client: httpx.AsyncClient):
+        self.bytes_downloaded = sum(seg["done"] for seg in self.segments)
+        pending = [seg for seg in self.segments if seg["start"] + seg["done"] <= seg["end"]]
+        # Spread segments over the ranked mirrors so their bandwidth adds up
+        mirrors = self._ranked_mirrors() or [self.url]
+        workers = [
+            asyncio.create_task(self._fetch_segment(client, seg, mirrors[i % len(mirrors)]))
+            for i, seg in enumerate(pending)
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                if not worker.done():
+                    worker.cancel()
+            # Cancelled workers still flush their sinks; let them finish before the file is closed
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _fetch_segment(self, client: httpx.AsyncClient, seg: Dict[str, int], mirror: str):
+        """Fetches one segment, moving to the next-best mirror when the current one fails or crawls."""
+        tried = set()
+        while True:
+            done = seg["done"]
+            started = time.monotonic()
+            try:
+                await self._fetch_range(client, seg, mirror)
+                if self.mirror_stats:
+                    self.mirror_stats.record(mirror, seg["done"] - done, time.monotonic() - started)
+                return
+            except (httpx.HTTPError, MirrorError, RuntimeError) as e:
+                if self.mirror_stats:
+                    self.mirror_stats.record(mirror, seg["done"] - done, time.monotonic() - started, error=True)
+                tried.add(mirror)
+                if not isinstance(e, (MirrorError, httpx.TimeoutException)):
+                    self._bad_mirrors.add(mirror)
+                alternatives = [m for m in self._ranked_mirrors() if m not in tried]
+                if not alternatives:
+                    raise
+                logger.info(f"Download task {self.id}: leaving {mirror} at byte {seg['start'] + seg['done']} ({e})")
+                self._count_retry(mirror_switch=True)
+                mirror = alternatives[0]
+
+    async def _fetch_range(self, client: httpx.AsyncClient, seg: Dict[str, int], url: str):
+        offset = seg["start"] + seg["done"]
+        headers = {"Range": f"bytes={offset}-{seg['end']}"}
+        min_speed = 0.0
+        timeout = httpx.USE_CLIENT_DEFAULT
+        if len(self.mirrors) > 1:
+            # Only worth policing a stream when there is somewhere else to go
+            min_speed = self.min_mirror_speed
+            limit = self.limiter.effective_limit(self) if self.limiter else 0.0
+            if limit:
+                min_speed = min(min_speed, limit / (2 * len(self.segments)))
+            timeout = httpx.Timeout(10.0, read=MIRROR_SLOW_WINDOW)
+
+        started = time.monotonic()
+        async with self._connection(url), \
+                client.stream("GET", url, headers=headers, follow_redirects=True, timeout=timeout) as response:
+            self._observe_ttfb(started)
+            if response.status_code == 200 and len(self.segments) == 1:
+                # A single-stream plan whose server now ignores ranges: restart from zero
+                seg["done"] = 0
                 self.bytes_downloaded = 0
+                self._restart_hash()
+            elif response.status_code != 206:
+                response.raise_for_status()
+                raise RuntimeError("Server stopped honouring range requests")
+            else:
+                content_range = response.headers.get("Content-Range", "")
+                if self.total_size and not content_range.endswith(f"/{self.total_size}"):
+                    raise MirrorError(f"{url} serves a different file ({content_range})")
 
-            if self.bytes_downloaded > 0:
-                headers["Range"] = f"bytes={self.bytes_downloaded}-"
-
-            async with client.stream("GET", self.url, headers=headers, follow_redirects=True) as response:
-                if response.status_code == 200:
-                    self.bytes_downloaded = 0
-                    mode = "wb"
-                elif response.status_code == 206:
-                    mode = "ab"
-                elif response.status_code == 416:
-                    self.bytes_downloaded = 0
-                    mode = "wb"
-                    async with client.stream("GET", self.url, follow_redirects=True) as r2:
-                        response = r2
-                else:
-                    response.raise_for_status()
+            def flushed(count: int):
+                seg["done"] += count
+
+            remaining = await self._stream_to_disk(response, seg["start"] + seg["done"], seg["end"], flushed,
+                                                   min_speed, urlsplit(url).hostname)
+
+        if remaining:
+            raise StreamInterrupted(f"Segment {seg['start']}-{seg['end']} ended early")
+
+    async def _download_single(self, client: httpx.AsyncClient):
+        headers = {}
+        offset = self.path.stat().st_size if self.path.exists() else 0
+        if offset > 0:
+            headers["Range"] = f"bytes={offset}-"
+
+        started = time.monotonic()
+        async with self._connection(self.url), \
+                client.stream("GET", self.url, headers=headers, follow_redirects=True) as response:
+            self._observe_ttfb(started)
+            restart = response.status_code == 416 and offset > 0
+            if not restart:
+                await self._receive_single(response, offset)
+
+        if restart:
+            # Local file is not a prefix of the remote one; start over
+            self.path.unlink()
+            await self._download_single(client)
+
+    async def _receive_single(self, response: httpx.Response, offset: int):
+        if response.status_code == 200:
+            offset = 0
+        elif response.status_code != 206:
+            response.raise_for_status()
+        if offset == 0:
+            self._restart_hash()
+        self._remember_validators(response.headers)
+
+        content_range = response.headers.get("Content-Range")
+        content_length = response.headers.get("Content-Length")
+        total = 0
+        if content_range:
+            try:
+                total = int(content_range.split('/')[-1])
+            except (ValueError, IndexError):
+                pass
+        elif content_length:
+            total = offset + int(content_length)
+
+        self.bytes_downloaded = offset
+        if total:
+            # Known size: preallocate and track the stream as one segment so
+            # resume uses the journaled offset rather than the file length
+            self.total_size = total
+            await self.writer.prepare(self.path, total, truncate=(offset == 0))
+            seg = {"start": 0, "end": total - 1, "done": offset}
+            self.segments = [seg]
+            self.notify()
+
+            def flushed(count: int):
+                seg["done"] += count
+
+            remaining = await self._stream_to_disk(response, offset, seg["end"], flushed)
+            if remaining:
+                raise StreamInterrupted("Server closed the stream before the file was complete")
+        else:
+            await self.writer.prepare(self.path, truncate=(offset == 0))
+            await self._stream_to_disk(response, offset, None, lambda count: None)
+
+    async def _stream_to_disk(self, response: httpx.Response, offset: int, end: Optional[int],
+                              on_flushed: Callable[[int], None], min_speed: float = 0.0,
+                              host: Optional[str] = None) -> int:
+        """Writes the response body from ``offset``; returns bytes still missing before ``end``.
+
+        Network reads go straight into the sink; bookkeeping runs once per
+        ``read_size`` batch. With ``min_speed`` set, raises MirrorError once a
+        ``MIRROR_SLOW_WINDOW`` averages less than that.
+        """
+        remaining = end - offset + 1 if end is not None else -1
+        sink = FileSink(self.writer, self.path, offset, on_flushed, self.hasher)
+        last_yield = last_batch = time.time()
+        window_start, window_bytes = last_yield, 0
+        chunk_latency = self.metrics.chunk_latency if self.metrics else None
+        pending = 0
+        try:
+            async for chunk in response.aiter_bytes():
+                if end is not None:
+                    if remaining == 0:
+                        break  # more than was asked for; dropping the connection discards it
+                    if len(chunk) > remaining:
+                        chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                await sink.write(chunk)
+                pending += len(chunk)
+                if pending < self.read_size and remaining != 0:
+                    continue
+
+                now = self._record_progress(pending)
+                if chunk_latency is not None:
+                    chunk_latency.observe(now - last_batch)
+                self._adapt_read_size(pending, now - last_batch)
+                last_batch = now
+                delay = self.limiter.reserve(self, pending, host) if self.limiter else 0.0
+                if min_speed:
+                    window_bytes += pending
+                pending = 0
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    last_yield = now
+                elif now - last_yield >= LOOP_YIELD_INTERVAL:
+                    await asyncio.sleep(0)
+                    last_yield = now
+                if remaining == 0:
+                    # Keep reading so httpx sees the end of the body and can reuse the connection
+                    continue
+                if min_speed and now - window_start >= MIRROR_SLOW_WINDOW:
+                    if window_bytes / (now - window_start) < min_speed:
+                        raise MirrorError(f"throughput fell below {int(min_speed)} B/s")
+                    window_start, window_bytes = now, 0
+        finally:
+            if pending:
+                self._record_progress(pending)
+            await sink.close()
+        return max(0, remaining)
+
+    def _adapt_read_size(self, nbytes: int, elapsed: float):
+        if self.fixed_read_size:
+            return
+        if self.metrics and self.metrics.last_lag > READ_LAG_LIMIT:
+            self.read_size = max(MIN_READ_SIZE, self.read_size // 2)
+            return
+        if elapsed <= 0 or nbytes / elapsed * READ_BATCH_INTERVAL >= self.read_size * 2:
+            self.read_size = min(MAX_READ_SIZE, self.read_size * 2)
+        elif nbytes / elapsed * READ_BATCH_INTERVAL < self.read_size / 2:
+            self.read_size = max(MIN_READ_SIZE, self.read_size // 2)
+
+
+class DownloadScheduler:
+    """Priority queue of ``queued`` tasks started within global and per-host slot limits.
+
+    Heap entries are ``(-priority, queue_seq, task)``; reprioritizing or
+    pausing a task simply leaves its old entry stale, and stale entries are
+    dropped when popped.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, max_active: int = 4, max_per_host: int = 2):
+        self.client = client
+        self.max_active = max_active
+        self.max_per_host = max_per_host
+        self.active: Dict[str, str] = {}  # task id -> host it was started against
+        self._loops: Dict[asyncio.Task, httpx.AsyncClient] = {}  # download loop -> client it runs on
+        self._host_active: Dict[str, int] = {}
+        self._heap: List[Tuple[int, int, DownloadTask]] = []
+        self._seq = itertools.count(1)
+        self._top_seq = itertools.count(-1, -1)
+
+    def enqueue(self, task: DownloadTask, to_top: bool = False):
+        task.cancel()
+        task.status = "queued"
+        task.error = None
+        self._push(task, to_top)
+        task.notify()
+        self.pump()
+
+    def reprioritize(self, task: DownloadTask, priority: int):
+        task.priority = priority
+        if task.status == "queued":
+            self._push(task, False)
+        task.notify()
+        self.pump()
+
+    def move_to_top(self, task: DownloadTask):
+        queued = [entry[2].priority for entry in self._heap if self._is_current(entry)]
+        task.priority = max(queued + [task.priority])
+        if task.status == "queued":
+            self._push(task, True)
+        task.notify()
+        self.pump()
+
+    def queued(self) -> List[DownloadTask]:
+        return [entry[2] for entry in sorted(self._heap, key=lambda e: e[:2]) if self._is_current(entry)]
+
+    def observe(self, task: DownloadTask):
+        """Frees the slot of a task that left ``downloading`` and refills it."""
+        if task.id in self.active and task.status != "downloading":
+            self._release(task.id)
+            self.pump()
+
+    def forget(self, task_id: str):
+        if task_id in self.active:
+            self._release(task_id)
+            self.pump()
+
+    def pump(self):
+        if not self._heap:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Queued tasks wait for the next pump from inside the server loop
+
+        skipped = []
+        while self._heap and (self.max_active <= 0 or len(self.active) < self.max_active):
+            entry = heapq.heappop(self._heap)
+            if not self._is_current(entry):
+                continue
+            task = entry[2]
+            if self.max_per_host > 0 and self._host_active.get(task.host, 0) >= self.max_per_host:
+                skipped.append(entry)
+                continue
+            self.active[task.id] = task.host
+            self._host_active[task.host] = self._host_active.get(task.host, 0) + 1
+            task.start(self.client)
+            self._loops[task._task] = self.client
+            task._task.add_done_callback(lambda loop: self._loops.pop(loop, None))
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+    def users(self, client: httpx.AsyncClient) -> List[asyncio.Task]:
+        """Download loops still running on ``client``."""
+        return [loop for loop, used in self._loops.items() if used is client]
+
+    def _push(self, task: DownloadTask, to_top: bool):
+        task.queue_seq = next(self._top_seq) if to_top else next(self._seq)
+        heapq.heappush(self._heap, (-task.priority, task.queue_seq, task))
 
-                content_range = response.headers.get("Content-Range")
-                content_length = response.headers.get("Content-Length")
+    @staticmethod
+    def _is_current(entry: Tuple[int, int, DownloadTask]) -> bool:
+        task = entry[2]
+        return task.status == "queued" and task.queue_seq == entry[1] and -task.priority == entry[0]
 
-                if content_range:
+    def _release(self, task_id: str):
+        host = self.active.pop(task_id)
+        remaining = self._host_active.get(host, 1) - 1
+        if remaining > 0:
+            self._host_active[host] = remaining
+        else:
+            self._host_active.pop(host, None)
+
+
+class ChangeLog:
+    """Monotonic revision counter tracking the latest revision of each task.
+
+    Lets clients ask for "everything since revision N" by walking only the
+    tail of an ordered dict instead of serializing every task ever added.
+    Each task's recent status changes are kept too (a deletion counts as
+    one), so a delta filtered by status can tell which tasks the client was
+    shown at revision N.
+    """
+
+    def __init__(self):
+        self.revision = 0
+        self._changes: "OrderedDict[str, int]" = OrderedDict()
+        self._deleted: "OrderedDict[str, int]" = OrderedDict()
+        self._statuses: Dict[str, List[Tuple[int, Optional[str]]]] = {}
+        self._floor = 0  # deletions at or before this revision were forgotten
+
+    def touch(self, task_id: str, status: str):
+        self.revision += 1
+        self._changes[task_id] = self.revision
+        self._changes.move_to_end(task_id)
+        self._record_status(task_id, status)
+
+    def delete(self, task_id: str):
+        self.revision += 1
+        self._changes.pop(task_id, None)
+        self._deleted[task_id] = self.revision
+        self._deleted.move_to_end(task_id)
+        self._record_status(task_id, None)
+        if len(self._deleted) > MAX_TOMBSTONES:
+            forgotten, self._floor = self._deleted.popitem(last=False)
+            history = self._statuses.get(forgotten)
+            if history and history[-1][1] is None:
+                del self._statuses[forgotten]
+
+    def matched_at(self, task_id: str, revision: int, statuses: set) -> bool:
+        """Whether a client at ``revision`` was shown the task under a status filter.
+
+        True as well when its status back then is no longer known.
+        """
+        for rev, status in reversed(self._statuses.get(task_id, ())):
+            if rev <= revision:
+                return status == "" or status in statuses
+        return task_id not in self._statuses
+
+    def _record_status(self, task_id: str, status: Optional[str]):
+        history = self._statuses.setdefault(task_id, [])
+        if history and history[-1][1] == status:
+            return
+        history.append((self.revision, status))
+        if len(history) > MAX_STATUS_HISTORY:
+            # Older changes are forgotten: before the oldest one kept, the status is unknown ("")
+            history[:len(history) - MAX_STATUS_HISTORY + 1] = [(0, "")]
+
+    def is_stale(self, revision: int) -> bool:
+        """True when a client at ``revision`` cannot be caught up with a delta."""
+        return revision < self._floor or revision > self.revision
+
+    def changed_since(self, revision: int) -> List[str]:
+        return self._tail(self._changes, revision)
+
+    def deleted_since(self, revision: int) -> List[str]:
+        return self._tail(self._deleted, revision)
+
+    @staticmethod
+    def _tail(entries: "OrderedDict[str, int]", revision: int) -> List[str]:
+        ids = []
+        for task_id, rev in reversed(entries.items()):
+            if rev <= revision:
+                break
+            ids.append(task_id)
+        return ids
+
+
+class DownloadJournal:
+    """Append-only JSON-lines log of task records.
+
+    Each line is either a full task record or ``{"op": "del", "id": ...}``; the
+    last line for an id wins. Dirty tasks are batched and flushed from a
+    background thread, and the file is rewritten from live state only once
+    stale lines outnumber live tasks, so both replay and append cost track the
+    live task count rather than the task history.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lines = 0
+        self._dirty: Dict[str, DownloadTask] = {}
+        self._deleted: set = set()
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._before_flush: Optional[Callable[[], None]] = None
+
+    def load(self) -> Dict[str, Dict]:
+        records: Dict[str, Dict] = {}
+        lines = 0
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
                     try:
-                        self.total_size = int(content_range.split('/')[-1])
-                    except (ValueError, IndexError):
-                        pass
-                elif content_length:
-                    cl_val = int(content_length)
-                    if response.status_code == 206:
-                        self.total_size = self.bytes_downloaded + cl_val
-                    else:
-                        self.total_size = cl_val
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn write from a crash
+                    if record.get("op") == "del":
+                        records.pop(record.get("id"), None)
+                    elif "id" in record:
+                        records[record["id"]] = record
+        self._lines = lines
+        return records
+
+    def mark(self, task: DownloadTask):
+        with self._lock:
+            self._dirty[task.id] = task
+            self._deleted.discard(task.id)
 
+    def mark_deleted(self, task_id: str):
+        with self._lock:
+            self._dirty.pop(task_id, None)
+            self._deleted.add(task_id)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            deleted, self._deleted = self._deleted, set()
+        if not dirty and not deleted:
+            return
+
+        lines = [json.dumps(task.to_record()) for task in dirty.values()]
+        lines.extend(json.dumps({"op": "del", "id": tid}) for tid in deleted)
+        with self._io_lock:
+            try:
                 self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                self._lines += len(lines)
+            except Exception as e:
+                logger.error(f"Failed to append to download journal: {e}")
 
-                with open(self.path, mode) as f:
-                    async for chunk in response.aiter_bytes(chunk_size=16384):
-                        f.write(chunk)
-                        self.bytes_downloaded += len(chunk)
-                        self.update_speed()
-                        self.last_updated = time.time()
-                        await asyncio.sleep(0)
+    def needs_compaction(self, live_count: int) -> bool:
+        return self._lines > max(JOURNAL_MIN_COMPACT_LINES, live_count * 4)
 
-                self.status = "completed"
-                self.speed = 0.0
+    def compact(self, tasks: List[DownloadTask]):
+        with self._io_lock:
+            tmp_path = self.path.with_suffix(".tmp")
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for task in tasks:
+                        f.write(json.dumps(task.to_record()) + "\n")
+                os.replace(tmp_path, self.path)
+                self._lines = len(tasks)
+            except Exception as e:
+                logger.error(f"Failed to compact download journal: {e}")
 
-        except asyncio.CancelledError:
-            self.status = "paused"
-            self.speed = 0.0
-            raise
+    def start(self, get_tasks: Callable[[], List[DownloadTask]], before_flush: Optional[Callable[[], None]] = None):
+        """Starts the flush thread; ``before_flush`` runs on it ahead of every flush, for other state to save."""
+        self._before_flush = before_flush
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._flush_loop, args=(get_tasks,), daemon=True)
+        self._thread.start()
+
+    def stop(self, get_tasks: Callable[[], List[DownloadTask]]):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._before_flush:
+            self._before_flush()
+        self.flush()
+        tasks = get_tasks()
+        if self.needs_compaction(len(tasks)):
+            self.compact(tasks)
+
+    def _flush_loop(self, get_tasks: Callable[[], List[DownloadTask]]):
+        while not self._stop.wait(JOURNAL_FLUSH_INTERVAL):
+            if self._before_flush:
+                self._before_flush()
+            self.flush()
+            tasks = get_tasks()
+            if self.needs_compaction(len(tasks)):
+                self.compact(tasks)
+
+
+class DownloadArchive:
+    """Append-only JSON-lines history of finished downloads.
+
+    Each line is a short summary rather than a full task record. Only the byte
+    offset of every line is held in memory, packed in an ``array``, so a page
+    of history is one seek and one read however long the history grows.
+    New summaries are queued in memory, where pages already include them, and
+    written by ``flush`` from the journal thread.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.total_bytes = 0
+        self._offsets = array("Q")
+        self._end = 0
+        self._pending: List[Dict] = []
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self._pending)
+
+    @staticmethod
+    def summarize(task: DownloadTask) -> Dict:
+        return {
+            "id": task.id,
+            "url": task.url,
+            "filename": task.filename,
+            "save_path": str(task.path),
+            "total_size": task.total_size or task.bytes_downloaded,
+            "checksums": task.checksums,
+            "verified": bool(task.expected),
+            "finished": task.last_updated,
+            # Lets a refresh revalidate the file after it left the registry
+            "etag": task.etag,
+            "last_modified": task.last_modified
+        }
+
+    def load(self):
+        offsets = array("Q")
+        total = 0
+        end = 0
+        if self.path.exists():
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # torn append from a crash
+                    try:
+                        total += json.loads(line).get("total_size", 0)
+                    except ValueError:
+                        end += len(line)
+                        continue
+                    offsets.append(end)
+                    end += len(line)
+            if end != self.path.stat().st_size:
+                os.truncate(self.path, end)
+        with self._lock:
+            self._offsets, self._end, self.total_bytes = offsets, end, total
+
+    def append(self, summaries: List[Dict]):
+        with self._lock:
+            self._pending.extend(summaries)
+            self.total_bytes += sum(summary.get("total_size", 0) for summary in summaries)
+
+    def flush(self, on_written: Callable[[List[str]], None]):
+        """Writes the queued summaries, then passes their task ids to ``on_written``.
+
+        On a failed write they stay queued for the next flush.
+        """
+        with self._io_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return
+            lines = [json.dumps(summary, separators=(",", ":")).encode("utf-8") + b"\n" for summary in batch]
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "ab") as f:
+                    f.write(b"".join(lines))
+            except Exception as e:
+                logger.error(f"Failed to append to download archive: {e}")
+                return
+            with self._lock:
+                del self._pending[:len(batch)]
+                for line in lines:
+                    self._offsets.append(self._end)
+                    self._end += len(line)
+        on_written([summary["id"] for summary in batch])
+
+    def page(self, offset: int, limit: int) -> List[Dict]:
+        """Returns up to ``limit`` entries, newest first, skipping the ``offset`` newest."""
+        with self._lock:
+            # Queued summaries are the newest
+            pending = self._pending[::-1][offset:offset + limit]
+            offset = max(0, offset - len(self._pending))
+            stop = max(0, len(self._offsets) - offset)
+            start = max(0, stop - (limit - len(pending)))
+            if start == stop:
+                return pending
+            begin = self._offsets[start]
+            end = self._offsets[stop] if stop < len(self._offsets) else self._end
+            with open(self.path, "rb") as f:
+                f.seek(begin)
+                data = f.read(end - begin)
+        entries = pending
+        for line in reversed(data.splitlines()):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue  # unreadable line already skipped by load()
+        return entries
+
+    def find(self, urls: List[str]) -> Dict[str, Dict]:
+        """The newest entry for each of ``urls``, reading back from the newest page until all are found."""
+        wanted = set(urls)
+        found: Dict[str, Dict] = {}
+        offset = 0
+        while wanted and offset < len(self):
+            for summary in self.page(offset, MAX_HISTORY_PAGE):
+                if summary.get("url") in wanted:
+                    wanted.discard(summary["url"])
+                    found[summary["url"]] = summary
+            offset += MAX_HISTORY_PAGE
+        return found
+
+    def clear(self) -> List[str]:
+        """Empties the history; returns the task ids of queued summaries that were never written."""
+        with self._io_lock, self._lock:
+            try:
+                if self.path.exists():
+                    self.path.unlink()
+            except Exception as e:
+                logger.error(f"Failed to clear download archive: {e}")
+                return []
+            dropped = [summary["id"] for summary in self._pending]
+            self._offsets = array("Q")
+            self._end = 0
+            self._pending = []
+            self.total_bytes = 0
+        return dropped
+
+
+class ContentIndex:
+    """Opt-in index of finished downloads, keyed by digest and by URL + ETag.
+
+    Entries remember the file's size and mtime and are dropped on lookup once
+    the file is gone or has changed, so a hit always points at the same bytes
+    that were verified. Changes only mark the index dirty; the journal thread
+    saves it, so the event loop never writes the file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.by_digest: Dict[str, Dict] = {}  # "sha256:<hex>" -> {"path", "size", "mtime", "task_id"}
+        self.by_source: Dict[str, str] = {}   # "<etag> <url>" -> digest key
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.by_digest = data.get("by_digest", {})
+            self.by_source = data.get("by_source", {})
         except Exception as e:
-            logger.error(f"Download task {self.id} failed: {e}", exc_info=True)
-            self.status = "error"
-            self.error = str(e)
-            self.speed = 0.0
+            logger.error(f"Failed to load content index: {e}")
+
+    def save(self):
+        """Rewrites the index file if it changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"by_digest": dict(self.by_digest), "by_source": dict(self.by_source)}
+            self._dirty = False
+        tmp_path = self.path.with_suffix(".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Failed to save content index: {e}")
+            self._dirty = True
+
+    def add(self, task: DownloadTask) -> bool:
+        """Indexes a verified download; returns False if it was already known."""
+        if not task.checksums or not task.path.exists():
+            return False
+        stat = task.path.stat()
+        entry = {"path": str(task.path), "size": stat.st_size, "mtime": stat.st_mtime, "task_id": task.id}
+        keys = [f"{name}:{value}" for name, value in sorted(task.checksums.items())]
+        if all(self.by_digest.get(key) == entry for key in keys):
+            return False
+        with self._lock:
+            for key in keys:
+                self.by_digest[key] = entry
+            if task.etag:
+                self.by_source[f"{task.etag} {task.url}"] = keys[0]
+            self._dirty = True
+        return True
+
+    def find(self, checksums: Optional[Dict[str, str]] = None, url: Optional[str] = None,
+             etag: Optional[str] = None) -> Optional[Dict]:
+        keys = [f"{name}:{value}" for name, value in (checksums or {}).items()]
+        if url and etag and f"{etag} {url}" in self.by_source:
+            keys.append(self.by_source[f"{etag} {url}"])
+        for key in keys:
+            entry = self.by_digest.get(key)
+            if entry is None:
+                continue
+            try:
+                stat = os.stat(entry["path"])
+                if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+                    return entry
+            except OSError:
+                pass
+            with self._lock:
+                del self.by_digest[key]  # stale; the next save drops it from disk too
+                self._dirty = True
+        return None
+
+
+class FilenameIndex:
+    """Names claimed in one download directory, with a next-counter per stem.
+
+    Seeded from a single directory scan plus the known tasks; afterwards a
+    reservation is a set lookup and at most a couple of ``exists()`` checks
+    (for files created behind our back), instead of a rescan per candidate.
+    """
+
+    def __init__(self, directory: Path, paths: List[Path]):
+        self.directory = directory
+        self._claimed: set = set()
+        self._counters: Dict[Tuple[str, str], int] = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    self._claimed.add(os.path.normcase(entry.name))
+        except OSError:
+            pass
+        for path in paths:
+            self.claim(path)
+
+    def claim(self, path: Path):
+        if path.parent == self.directory:
+            self._claimed.add(os.path.normcase(path.name))
+
+    def release(self, path: Path):
+        if path.parent == self.directory:
+            self._claimed.discard(os.path.normcase(path.name))
+
+    def reserve(self, filename: str) -> str:
+        """Claims ``filename``, or the first free ``stem (n).suffix`` after it."""
+        if self._take(filename):
+            return filename
+        path = Path(filename)
+        key = (path.stem, path.suffix)
+        counter = self._counters.get(key, 1)
+        while not self._take(f"{path.stem} ({counter}){path.suffix}"):
+            counter += 1
+        self._counters[key] = counter + 1
+        return f"{path.stem} ({counter}){path.suffix}"
+
+    def _take(self, name: str) -> bool:
+        key = os.path.normcase(name)
+        if key in self._claimed:
+            return False
+        self._claimed.add(key)
+        return not (self.directory / name).exists()
+
+
+class MetadataProbe:
+    """Concurrent, cached HEAD requests on the shared client.
+
+    Results (filename, size, ETag, range support) are cached per URL for
+    ``PROBE_CACHE_TTL`` seconds; concurrent probes of one URL share a single
+    request, and at most ``PROBE_CONCURRENCY`` run at once. A probe keeps the
+    client it started with when ``client`` is swapped.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, ttl: float = PROBE_CACHE_TTL, max_size: int = PROBE_CACHE_SIZE):
+        self.client = client
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def probe(self, url: str) -> Optional[Dict]:
+        """Returns the cached or freshly probed metadata, or None if the HEAD failed."""
+        now = time.monotonic()
+        cached = self._cache.get(url)
+        if cached and now - cached[0] < self.ttl:
+            return cached[1]
+
+        future = self._inflight.get(url)
+        if future is None:
+            future = self._inflight[url] = asyncio.ensure_future(self._head(url, self.client))
+            future.add_done_callback(lambda _: self._inflight.pop(url, None))
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            return None  # callers fall back to guessing from the URL
+
+    async def probe_many(self, urls: List[str]) -> List[Optional[Dict]]:
+        return await asyncio.gather(*(self.probe(url) for url in urls))
+
+    def _store(self, url: str, info: Dict):
+        now = time.monotonic()
+        self._cache[url] = (now, info)
+        self._cache.move_to_end(url)
+        # Oldest entries sit at the front: drop the expired ones, then any overflow
+        while self._cache:
+            stamp, _ = next(iter(self._cache.values()))
+            if now - stamp < self.ttl and len(self._cache) <= self.max_size:
+                break
+            self._cache.popitem(last=False)
+
+    def pending(self) -> List[asyncio.Future]:
+        return list(self._inflight.values())
+
+    async def _head(self, url: str, client: httpx.AsyncClient) -> Dict:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+        async with self._semaphore:
+            response = await client.head(url, follow_redirects=True, timeout=PROBE_TIMEOUT)
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        info = {
+            "filename": self._filename(response),
+            "size": int(length) if length and length.isdigit() else 0,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "accept_ranges": response.headers.get("Accept-Ranges", "").strip().lower(),
+            "final_url": str(response.url)
+        }
+        self._store(url, info)
+        return info
+
+    @staticmethod
+    def _filename(response: httpx.Response) -> Optional[str]:
+        cd = response.headers.get("Content-Disposition")
+        if cd and "filename=" in cd:
+            match = re.search(r'filename="?([^";\n]+)"?', cd)
+            if match:
+                return match.group(1).strip()
+        return response.url.path.split("/")[-1] or None
 
 
 class Extension(ExtensionBase):
     def __init__(self, metadata: ExtensionMetadata, extension_path: Path, config: Dict, context: ExtensionContext):
         super().__init__(metadata, extension_path, config, context)
         self.downloads: Dict[str, DownloadTask] = {}
-        self.client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None))
+        self.filenames: Optional[FilenameIndex] = None
+        self._downloads_dir: Optional[Tuple[str, Path]] = None
         
         # Local settings initialization
         self.settings_file = self.extension_path / "settings.json"
         self.settings = self.load_settings()
+
+        self.client = self._make_client()
+        self._retired_clients: List[httpx.AsyncClient] = []
+        self.connections = ConnectionLimiter(self.settings.get("max_connections_per_host", 0))
+
+        self.archive = DownloadArchive(self.extension_path / "downloads.archive")
+        self.journal = DownloadJournal(self.extension_path / "downloads.journal")
+        self._finished: "OrderedDict[str, None]" = OrderedDict()  # live completed tasks, oldest first
+        self.changes = ChangeLog()
+        self.metrics = DownloadMetrics()
+        self.writer = DiskWriter(self.metrics)
+        self.content_index = ContentIndex(self.extension_path / "content_index.json")
+        self.probe = MetadataProbe(self.client)
+        self.mirror_stats = MirrorStats()
+        self.mirror_stats_file = self.extension_path / "mirror_stats.json"
+        self.limiter = BandwidthLimiter()
+        self.limiter.configure(self.settings.get("global_limit", 0), self.settings.get("host_limits", {}))
+        self.scheduler = DownloadScheduler(
+            self.client,
+            max_active=self._get_int(self.settings, "max_active", 4),
+            max_per_host=self._get_int(self.settings, "max_per_host", 2)
+        )
         
         self.setup_routes()
 
@@ -158,7 +2034,24 @@ class Extension(ExtensionBase):
         
         # Strict default folder detection
         return {
-            "download_dir": str(Path.home() / "Downloads")
+            "download_dir": str(Path.home() / "Downloads"),
+            "segments": 4,
+            "global_limit": 0,
+            "host_limits": {},
+            "max_active": 4,
+            "max_per_host": 2,
+            "hash_algorithms": list(DEFAULT_HASH_ALGORITHMS),
+            "dedup": False,
+            "mirror_min_speed": MIRROR_MIN_SPEED,
+            "max_retries": DEFAULT_MAX_RETRIES,
+            "retry_backoff": DEFAULT_RETRY_BACKOFF,
+            "read_size": 0,
+            "keep_finished": KEEP_FINISHED,
+            "max_connections": POOL_MAX_CONNECTIONS,
+            "max_keepalive": POOL_MAX_KEEPALIVE,
+            "keepalive_expiry": POOL_KEEPALIVE_EXPIRY,
+            "max_connections_per_host": 0,
+            "http2": False
         }
 
     def save_settings(self):
@@ -169,12 +2062,43 @@ class Extension(ExtensionBase):
         except Exception as e:
             self.logger.error(f"Error saving settings: {e}")
 
+    def _make_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.settings.get("max_connections", POOL_MAX_CONNECTIONS) or None,
+            max_keepalive_connections=self.settings.get("max_keepalive", POOL_MAX_KEEPALIVE),
+            keepalive_expiry=self.settings.get("keepalive_expiry", POOL_KEEPALIVE_EXPIRY)
+        )
+        http2 = bool(self.settings.get("http2")) and HAS_HTTP2
+        if self.settings.get("http2") and not HAS_HTTP2:
+            self.logger.warning("HTTP/2 requested but the h2 package is missing; using HTTP/1.1")
+        return httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None), limits=limits, http2=http2)
+
+    def _replace_client(self):
+        """Swaps in a client built from the current pool settings.
+
+        Running tasks and probes keep the client they started with; the old one
+        is closed once the last of them finishes.
+        """
+        old, self.client = self.client, self._make_client()
+        self.scheduler.client = self.probe.client = self.client
+        self._retired_clients.append(old)
+        asyncio.ensure_future(self._retire_client(old, self.scheduler.users(old) + self.probe.pending()))
+
+    async def _retire_client(self, client: httpx.AsyncClient, users: List[asyncio.Future]):
+        if users:
+            await asyncio.wait(users)
+        await client.aclose()
+        if client in self._retired_clients:
+            self._retired_clients.remove(client)
+
     def _get_downloads_dir(self) -> Path:
         val = self.settings.get("download_dir")
         if not val:
             val = str(Path.home() / "Downloads")
             self.settings["download_dir"] = val
             self.save_settings()
+        if self._downloads_dir and self._downloads_dir[0] == val:
+            return self._downloads_dir[1]
             
         downloads_dir = Path(val)
         try:
@@ -182,130 +2106,620 @@ class Extension(ExtensionBase):
         except Exception as e:
             self.logger.warning(f"Could not create path {downloads_dir}, falling back to Home: {e}")
             downloads_dir = Path.home()
+        self._downloads_dir = (val, downloads_dir)
         return downloads_dir
 
+    def _on_task_change(self, task: DownloadTask):
+        self.journal.mark(task)
+        self.changes.touch(task.id, task.status)
+        self.scheduler.observe(task)
+        if task.status != "completed":
+            self._finished.pop(task.id, None)  # being refreshed; re-enters as newest when done
+        if task.status == "completed" and task.checksums and self.settings.get("dedup"):
+            self.content_index.add(task)
+        if task.status == "completed" and task.id not in self._finished:
+            self._finished[task.id] = None
+            self._trim_finished()
+
+    def _register(self, task: DownloadTask, persist: bool = True):
+        task.listener = self._on_task_change
+        task.limiter = self.limiter
+        task.connections = self.connections
+        task.writer = self.writer
+        task.mirror_stats = self.mirror_stats
+        task.metrics = self.metrics
+        task.min_mirror_speed = self.settings.get("mirror_min_speed", MIRROR_MIN_SPEED)
+        self.downloads[task.id] = task
+        if self.filenames:
+            self.filenames.claim(task.path)
+        self.changes.touch(task.id, task.status)
+        if task.status == "completed":
+            self._finished[task.id] = None
+        if persist:
+            self.journal.mark(task)
+
+    def _unregister(self, task_id: str, persist: bool = True):
+        task = self.downloads.pop(task_id, None)
+        self._finished.pop(task_id, None)
+        if task:
+            task.listener = None
+        self.scheduler.forget(task_id)
+        if persist:
+            self.journal.mark_deleted(task_id)
+        self.changes.delete(task_id)
+
+    def _trim_finished(self, keep: Optional[int] = None) -> int:
+        """Moves the oldest completed tasks beyond ``keep`` from the registry to the archive.
+
+        The archive queues their summaries and the journal thread writes them
+        (see ``_before_journal_flush``); each task's journal record is only
+        deleted once its summary is on disk, so a task is always readable from
+        one of the two, and a failed write leaves it in the journal until the
+        next one succeeds. Returns how many were archived.
+        """
+        keep = self.settings.get("keep_finished", KEEP_FINISHED) if keep is None else keep
+        excess = len(self._finished) - max(0, keep)
+        if excess <= 0:
+            return 0
+        tasks = [self.downloads[task_id] for task_id in itertools.islice(self._finished, excess)]
+        self.archive.append([DownloadArchive.summarize(task) for task in tasks])
+        for task in tasks:
+            self._unregister(task.id, persist=False)
+        return len(tasks)
+
+    def _drop_archived(self, task_ids: List[str]):
+        """Deletes the journal records of archived tasks, unless one was revived meanwhile."""
+        for task_id in task_ids:
+            if task_id not in self.downloads:
+                self.journal.mark_deleted(task_id)
+
+    def _before_journal_flush(self):
+        """Runs on the journal thread: archived summaries reach disk before their tasks' delete lines."""
+        self.archive.flush(self._drop_archived)
+        self.content_index.save()
+
+    def _restore_downloads(self):
+        interrupted = []
+        for record in self.journal.load().values():
+            try:
+                task = DownloadTask.from_record(record)
+            except Exception as e:
+                self.logger.warning(f"Skipping unreadable journal record: {e}")
+                continue
+            if task.status in ("downloading", "queued"):
+                task.status = "paused"
+                interrupted.append(task)
+            self._register(task, persist=False)
+
+        # Journals from before the archive existed may hold every task ever finished
+        finished = sorted(self._finished, key=lambda tid: self.downloads[tid].last_updated)
+        self._finished = OrderedDict.fromkeys(finished)
+        self._trim_finished()
+
+        # Requeue in their previous order; they start once the server loop pumps the queue
+        interrupted.sort(key=lambda t: (-t.priority, t.last_updated))
+        for task in interrupted:
+            self.scheduler.enqueue(task)
+
+    @staticmethod
+    def _get_int(data: Dict, key: str, default: int) -> int:
+        try:
+            return int(data.get(key, default))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"{key} must be an integer")
+
+    @staticmethod
+    def _get_float(data: Dict, key: str, default: float) -> float:
+        try:
+            return max(0.0, float(data.get(key, default)))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"{key} must be a number")
+
+    def _get_segments(self, data: Dict) -> int:
+        value = data.get("segments", self.settings.get("segments", 4))
+        try:
+            return max(1, min(int(value), MAX_SEGMENTS))
+        except (TypeError, ValueError):
+            return 1
+
+    @staticmethod
+    def _parse_algorithms(value) -> List[str]:
+        if not isinstance(value, list):
+            raise HTTPException(status_code=400, detail="hash_algorithms must be a list")
+        names = []
+        for name in value:
+            name = str(name).strip().lower()
+            try:
+                hashlib.new(name)
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400, detail=f"Unsupported hash algorithm: {name}")
+            if name not in names:
+                names.append(name)
+        return names
+
+    @classmethod
+    def _parse_checksum(cls, value) -> Dict[str, str]:
+        """Accepts ``{"sha256": "<hex>"}``, ``"sha256:<hex>"`` or a bare SHA-256 hex digest."""
+        if not value:
+            return {}
+        if isinstance(value, str):
+            name, _, digest = value.strip().rpartition(":")
+            value = {name or "sha256": digest}
+        if not isinstance(value, dict):
+            raise HTTPException(status_code=400, detail="checksum must be 'algorithm:hex' or a mapping")
+        expected = {}
+        for name, digest in value.items():
+            name = cls._parse_algorithms([name])[0]
+            digest = str(digest).strip().lower()
+            if len(digest) != hashlib.new(name).digest_size * 2 or not re.fullmatch(r"[0-9a-f]+", digest):
+                raise HTTPException(status_code=400, detail=f"Malformed {name} checksum")
+            expected[name] = digest
+        return expected
+
+    @staticmethod
+    def _get_mirrors(data: Dict) -> List[str]:
+        mirrors = data.get("mirrors") or []
+        if not isinstance(mirrors, list) or not all(isinstance(m, str) for m in mirrors):
+            raise HTTPException(status_code=400, detail="mirrors must be a list of URLs")
+        urls = [data["url"]] if data.get("url") else []
+        return list(dict.fromkeys(u.strip() for u in urls + mirrors if u.strip()))
+
+    def _load_mirror_stats(self):
+        if self.mirror_stats_file.exists():
+            try:
+                with open(self.mirror_stats_file, "r", encoding="utf-8") as f:
+                    self.mirror_stats.load(json.load(f))
+            except Exception as e:
+                self.logger.error(f"Error loading mirror stats: {e}")
+
+    def _save_mirror_stats(self):
+        try:
+            self.mirror_stats_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.mirror_stats_file, "w", encoding="utf-8") as f:
+                json.dump(self.mirror_stats.to_dict(), f, indent=4)
+        except Exception as e:
+            self.logger.error(f"Error saving mirror stats: {e}")
+
+    @staticmethod
+    def _resolve_filename(url: str, info: Optional[Dict], filename: Optional[str] = None) -> str:
+        if not filename and info:
+            filename = info["filename"]
+        if not filename:
+            filename = url.split("/")[-1].split("?")[0] or "downloaded_file"
+        return os.path.basename(filename) or "downloaded_file"
+
+    def _new_task(self, url: str, filename: str, data: Dict, expected: Dict[str, str],
+                  info: Optional[Dict] = None) -> DownloadTask:
+        task = DownloadTask(str(uuid.uuid4()), url, filename, self._get_downloads_dir() / filename,
+                            segments=self._get_segments(data), rate_limit=self._get_rate(data.get("rate_limit")))
+        task.priority = self._get_int(data, "priority", 0)
+        if info:
+            # Known up front: lets the UI show sizes for queued tasks and skips
+            # the range probe for servers that say they cannot serve ranges
+            task.total_size = info["size"]
+            task.etag = info["etag"]
+            task.last_modified = info["last_modified"]
+            if info["accept_ranges"] == "none":
+                task.max_segments = 1
+        task.expected = expected
+        task.max_retries = max(0, self._get_int(data, "max_retries", self.settings.get("max_retries", DEFAULT_MAX_RETRIES)))
+        task.retry_backoff = self._get_float(data, "retry_backoff", self.settings.get("retry_backoff", DEFAULT_RETRY_BACKOFF))
+        task.set_read_size(self._get_int(data, "read_size", self.settings.get("read_size", 0)))
+        task.algorithms = list(self.settings.get("hash_algorithms", DEFAULT_HASH_ALGORITHMS))
+        task.algorithms.extend(name for name in expected if name not in task.algorithms)
+        return task
+
+    def _refresh(self, task: DownloadTask) -> str:
+        """Revalidates a finished task against the server; unfinished ones simply resume."""
+        if task.status not in ("downloading", "queued"):
+            task.refresh = task.status == "completed"
+            self.scheduler.enqueue(task)
+        return task.status
+
+    def _find_refreshable(self, urls: List[str]) -> Dict[str, DownloadTask]:
+        """Finished tasks for ``urls``; archived ones are brought back into the registry."""
+        wanted = set(urls)
+        found = {t.url: t for t in self.downloads.values() if t.status == "completed" and t.url in wanted}
+        missing = [url for url in urls if url not in found]
+        if missing:
+            for url, summary in self.archive.find(missing).items():
+                found[url] = self._revive(summary)
+        return found
+
+    def _revive(self, summary: Dict) -> DownloadTask:
+        """A completed task rebuilt from its archive entry; its history line stays."""
+        task = DownloadTask.from_record({
+            **summary,
+            "path": summary["save_path"],
+            "status": "completed",
+            "last_updated": summary.get("finished", time.time())
+        })
+        task.algorithms = list(self.settings.get("hash_algorithms", DEFAULT_HASH_ALGORITHMS))
+        self._register(task)
+        return task
+
+    def _find_duplicate(self, expected: Dict[str, str], url: Optional[str] = None,
+                        etag: Optional[str] = None) -> Optional[Dict]:
+        if not self.settings.get("dedup"):
+            return None
+        entry = self.content_index.find(expected, url, etag)
+        if entry is None:
+            return None
+        task_id = entry.get("task_id")
+        return {
+            "id": task_id if task_id in self.downloads else None,
+            "status": "duplicate",
+            "filename": Path(entry["path"]).name,
+            "save_path": entry["path"]
+        }
+
+    @staticmethod
+    def _get_rate(value) -> float:
+        """Parses a bytes/sec limit; missing or zero means unlimited."""
+        try:
+            return max(0.0, float(value or 0))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Invalid rate limit: {value}")
+
+    def _get_limits_config(self) -> Dict:
+        return {
+            "global_limit": self.limiter.global_bucket.rate,
+            "host_limits": self.limiter.host_limits()
+        }
+
+    def _get_config(self) -> Dict:
+        return {
+            "download_dir": str(self._get_downloads_dir()),
+            "segments": self._get_segments({}),
+            "max_active": self.scheduler.max_active,
+            "max_per_host": self.scheduler.max_per_host,
+            "event_tick": self.settings.get("event_tick", EVENT_TICK),
+            "mirror_min_speed": self.settings.get("mirror_min_speed", MIRROR_MIN_SPEED),
+            "max_retries": self.settings.get("max_retries", DEFAULT_MAX_RETRIES),
+            "retry_backoff": self.settings.get("retry_backoff", DEFAULT_RETRY_BACKOFF),
+            "read_size": self.settings.get("read_size", 0),
+            "keep_finished": self.settings.get("keep_finished", KEEP_FINISHED),
+            "hash_algorithms": self.settings.get("hash_algorithms", DEFAULT_HASH_ALGORITHMS),
+            "dedup": bool(self.settings.get("dedup", False)),
+            "max_connections": self.settings.get("max_connections", POOL_MAX_CONNECTIONS),
+            "max_keepalive": self.settings.get("max_keepalive", POOL_MAX_KEEPALIVE),
+            "keepalive_expiry": self.settings.get("keepalive_expiry", POOL_KEEPALIVE_EXPIRY),
+            "max_connections_per_host": self.connections.per_host,
+            "http2": bool(self.settings.get("http2")) and HAS_HTTP2,
+            "http2_available": HAS_HTTP2,
+            **self._get_limits_config()
+        }
+
+    @staticmethod
+    def _parse_statuses(status: Optional[str]) -> Optional[set]:
+        if not status:
+            return None
+        return {s.strip() for s in status.split(",") if s.strip()}
+
+    def _serialize_task(self, t: DownloadTask) -> Dict:
+        return {
+            "id": t.id,
+            "url": t.url,
+            "mirrors": t.mirrors,
+            "filename": t.filename,
+            "bytes_downloaded": t.bytes_downloaded,
+            "total_size": t.total_size,
+            "status": t.status,
+            "error": t.error,
+            "progress": min(100.0, (t.bytes_downloaded / t.total_size * 100)) if t.total_size > 0 else 0,
+            "speed": t.get_current_speed(),
+            "limit": self.limiter.effective_limit(t),
+            "priority": t.priority,
+            "last_updated": t.last_updated,
+            "save_path": str(t.path),
+            "segments": len(t.segments),
+            "segments_done": sum(1 for seg in t.segments if seg["start"] + seg["done"] > seg["end"]),
+            "checksums": t.checksums,
+            "verified": bool(t.expected) and t.status == "completed",
+            "retries": t.retries,
+            "retry_attempt": t.retry_attempt,
+            "max_retries": t.max_retries,
+            "next_retry_at": t.next_retry_at or None,
+            "read_size": t.read_size,
+            "adaptive_read": not t.fixed_read_size,
+            "etag": t.etag,
+            "last_modified": t.last_modified,
+            "last_checked": t.last_checked or None
+        }
+
+    async def _event_stream(self, request: Request, interval: float, statuses: Optional[set]):
+        """Yields an SSE snapshot, then per-tick deltas carrying only changed fields."""
+        sent: Dict[str, Dict] = {}
+        revision = None
+        last_write = time.monotonic()
+
+        while not await request.is_disconnected():
+            self.scheduler.pump()
+            current = self.changes.revision
+            if revision is None:
+                ids, deleted = list(self.downloads), []
+            else:
+                # Running tasks are always re-checked so their speed can decay to zero
+                ids = set(self.changes.changed_since(revision)) | set(self.scheduler.active)
+                deleted = self.changes.deleted_since(revision)
+
+            tasks = {}
+            for tid in ids:
+                task = self.downloads.get(tid)
+                if task is None:
+                    continue
+                if statuses and task.status not in statuses:
+                    if tid in sent:
+                        deleted.append(tid)  # Left the filtered view
+                    continue
+                fields = self._serialize_task(task)
+                previous = sent.get(tid)
+                diff = fields if previous is None else {k: v for k, v in fields.items() if previous[k] != v}
+                if diff:
+                    diff["id"] = tid
+                    tasks[tid] = diff
+                    sent[tid] = fields
+            deleted = [tid for tid in deleted if sent.pop(tid, None) is not None]
+
+            if revision is None or tasks or deleted:
+                event = "snapshot" if revision is None else "delta"
+                payload = {"revision": current, "tasks": tasks, "deleted": deleted}
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+                last_write = time.monotonic()
+            elif time.monotonic() - last_write >= EVENT_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_write = time.monotonic()
+
+            revision = current
+            await asyncio.sleep(interval)
+
     def _get_unique_filename(self, filename: str) -> str:
         downloads_dir = self._get_downloads_dir()
-        path = downloads_dir / filename
-        if not path.exists():
-            active_paths = {t.path for t in self.downloads.values()}
-            if path not in active_paths:
-                return filename
-
-        stem = path.stem
-        suffix = path.suffix
-        counter = 1
-        while True:
-            new_filename = f"{stem} ({counter}){suffix}"
-            new_path = downloads_dir / new_filename
-            if not new_path.exists() and new_path not in {t.path for t in self.downloads.values()}:
-                return new_filename
-            counter += 1
+        if self.filenames is None or self.filenames.directory != downloads_dir:
+            self.filenames = FilenameIndex(downloads_dir, [t.path for t in self.downloads.values()])
+        return self.filenames.reserve(filename)
 
     def setup_routes(self):
         @self.router.get("/downloads")
-        async def list_downloads():
-            return {
-                tid: {
-                    "id": t.id,
-                    "url": t.url,
-                    "filename": t.filename,
-                    "bytes_downloaded": t.bytes_downloaded,
-                    "total_size": t.total_size,
-                    "status": t.status,
-                    "error": t.error,
-                    "progress": min(100.0, (t.bytes_downloaded / t.total_size * 100)) if t.total_size > 0 else 0,
-                    "speed": t.get_current_speed(),
-                    "last_updated": t.last_updated,
-                    "save_path": str(t.path)
-                } for tid, t in self.downloads.items()
-            }
+        async def list_downloads(since: Optional[int] = None, status: Optional[str] = None):
+            statuses = self._parse_statuses(status)
+
+            if since is None:
+                return {
+                    tid: self._serialize_task(t) for tid, t in self.downloads.items()
+                    if not statuses or t.status in statuses
+                }
+
+            # Delta mode: only tasks touched after `since`, plus running ones whose speed moves.
+            # With a filter, only tasks shown at `since` are reported deleted (removed or left it)
+            reset = self.changes.is_stale(since)
+            if reset:
+                ids, deleted = list(self.downloads), []
+            else:
+                ids = set(self.changes.changed_since(since)) | set(self.scheduler.active)
+                deleted = self.changes.deleted_since(since)
+                if statuses:
+                    deleted = [tid for tid in deleted if self.changes.matched_at(tid, since, statuses)]
+            tasks = {}
+            for tid in ids:
+                task = self.downloads.get(tid)
+                if task is None:
+                    continue
+                if statuses and task.status not in statuses:
+                    if self.changes.matched_at(tid, since, statuses):
+                        deleted.append(tid)
+                    continue
+                tasks[tid] = self._serialize_task(task)
+            return {"revision": self.changes.revision, "reset": reset, "tasks": tasks, "deleted": deleted}
+
+        @self.router.get("/downloads/events")
+        async def download_events(request: Request, tick: Optional[float] = None, status: Optional[str] = None):
+            interval = tick if tick is not None else self.settings.get("event_tick", EVENT_TICK)
+            interval = max(0.1, min(float(interval), 10.0))
+            return StreamingResponse(
+                self._event_stream(request, interval, self._parse_statuses(status)),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
 
         @self.router.get("/downloads/config")
         async def get_config():
-            return {
-                "download_dir": str(self._get_downloads_dir())
-            }
+            return self._get_config()
 
         @self.router.post("/downloads/config")
         async def update_config(data: Dict = Body(...)):
             new_dir = data.get("download_dir")
-            if not new_dir:
+            option_keys = ("global_limit", "host_limits", "task_limits", "max_active", "max_per_host", "event_tick",
+                           "hash_algorithms", "dedup", "mirror_min_speed", "max_retries", "retry_backoff",
+                           "read_size", "task_options", "keep_finished") + POOL_KEYS
+            if not new_dir and "segments" not in data and not any(k in data for k in option_keys):
                 raise HTTPException(status_code=400, detail="Path is required")
+
+            host_limits = data.get("host_limits")
+            task_limits = data.get("task_limits")
+            if host_limits is not None and not isinstance(host_limits, dict):
+                raise HTTPException(status_code=400, detail="host_limits must map host to bytes/sec")
+            if task_limits is not None and not isinstance(task_limits, dict):
+                raise HTTPException(status_code=400, detail="task_limits must map task id to bytes/sec")
+            global_limit = self._get_rate(data["global_limit"]) if "global_limit" in data else None
+            host_limits = {h: self._get_rate(r) for h, r in host_limits.items()} if host_limits else None
+            task_limits = {tid: self._get_rate(r) for tid, r in (task_limits or {}).items()}
+            max_active = self._get_int(data, "max_active", self.scheduler.max_active)
+            max_per_host = self._get_int(data, "max_per_host", self.scheduler.max_per_host)
+            algorithms = self._parse_algorithms(data["hash_algorithms"]) if "hash_algorithms" in data else None
+            mirror_min_speed = self._get_rate(data["mirror_min_speed"]) if "mirror_min_speed" in data else None
+            task_options = data.get("task_options") or {}
+            if not isinstance(task_options, dict) or not all(isinstance(o, dict) for o in task_options.values()):
+                raise HTTPException(status_code=400, detail="task_options must map task id to options")
+            defaults = {
+                "max_retries": max(0, self._get_int(data, "max_retries", self.settings.get("max_retries", DEFAULT_MAX_RETRIES))),
+                "retry_backoff": self._get_float(data, "retry_backoff", self.settings.get("retry_backoff", DEFAULT_RETRY_BACKOFF)),
+                "read_size": max(0, self._get_int(data, "read_size", self.settings.get("read_size", 0)))
+            }
+            keep_finished = max(0, self._get_int(data, "keep_finished", self.settings.get("keep_finished", KEEP_FINISHED)))
+            pool = {
+                "max_connections": max(0, self._get_int(
+                    data, "max_connections", self.settings.get("max_connections", POOL_MAX_CONNECTIONS))),
+                "max_keepalive": max(0, self._get_int(
+                    data, "max_keepalive", self.settings.get("max_keepalive", POOL_MAX_KEEPALIVE))),
+                "keepalive_expiry": self._get_float(
+                    data, "keepalive_expiry", self.settings.get("keepalive_expiry", POOL_KEEPALIVE_EXPIRY)),
+                "http2": bool(data.get("http2", self.settings.get("http2", False)))
+            }
+            if pool["http2"] and not HAS_HTTP2:
+                raise HTTPException(status_code=400, detail='HTTP/2 needs the h2 package (pip install "httpx[http2]")')
+            per_host = max(0, self._get_int(data, "max_connections_per_host", self.connections.per_host))
+            for options in task_options.values():
+                self._get_int(options, "max_retries", 0)
+                self._get_int(options, "read_size", 0)
+                self._get_float(options, "retry_backoff", 0)
             
-            target_path = Path(new_dir.strip())
-            try:
-                target_path.mkdir(parents=True, exist_ok=True)
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Invalid or unwritable directory: {str(e)}")
-            
-            self.settings["download_dir"] = str(target_path.resolve())
+            if new_dir:
+                target_path = Path(new_dir.strip())
+                try:
+                    target_path.mkdir(parents=True, exist_ok=True)
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid or unwritable directory: {str(e)}")
+                self.settings["download_dir"] = str(target_path.resolve())
+
+            if "segments" in data:
+                self.settings["segments"] = self._get_segments(data)
+
+            if "event_tick" in data:
+                try:
+                    self.settings["event_tick"] = max(0.1, min(float(data["event_tick"]), 10.0))
+                except (TypeError, ValueError):
+                    raise HTTPException(status_code=400, detail="event_tick must be a number of seconds")
+
+            # Applies to tasks added from now on; running ones keep the digests they started with
+            if algorithms is not None:
+                self.settings["hash_algorithms"] = algorithms
+            # Retry and read-size defaults apply to new tasks; task_options retune existing ones
+            self.settings.update(defaults)
+            for tid, options in task_options.items():
+                task = self.downloads.get(tid)
+                if not task:
+                    continue
+                if "max_retries" in options:
+                    task.max_retries = max(0, self._get_int(options, "max_retries", 0))
+                if "retry_backoff" in options:
+                    task.retry_backoff = self._get_float(options, "retry_backoff", 0)
+                if "read_size" in options:
+                    task.set_read_size(self._get_int(options, "read_size", 0))
+                task.notify()
+
+            self.settings["keep_finished"] = keep_finished
+            self._trim_finished()
+
+            # New pool limits need a new client; the per-host cap applies to the next request
+            if any(self.settings.get(k) != v for k, v in pool.items()):
+                self.settings.update(pool)
+                self._replace_client()
+            self.connections.configure(per_host)
+            self.settings["max_connections_per_host"] = per_host
+
+            if mirror_min_speed is not None:
+                self.settings["mirror_min_speed"] = mirror_min_speed
+                for task in self.downloads.values():
+                    task.min_mirror_speed = mirror_min_speed
+            if "dedup" in data:
+                self.settings["dedup"] = bool(data["dedup"])
+                if self.settings["dedup"]:
+                    for task in self.downloads.values():
+                        if task.status == "completed":
+                            self.content_index.add(task)
+
+            # Limits are read on every chunk, so running tasks pick them up without a restart
+            self.limiter.configure(global_limit, host_limits)
+            for tid, rate in task_limits.items():
+                task = self.downloads.get(tid)
+                if task:
+                    task.bucket.set_rate(rate)
+                    task.notify()
+            self.settings.update(self._get_limits_config())
+
+            # Lowering the slot counts lets running tasks finish; raising them starts queued ones now
+            self.scheduler.max_active = self.settings["max_active"] = max(0, max_active)
+            self.scheduler.max_per_host = self.settings["max_per_host"] = max(0, max_per_host)
+            self.scheduler.pump()
+
             self.save_settings()
-            return {"status": "success", "download_dir": self.settings["download_dir"]}
+            return {"status": "success", **self._get_config()}
 
         @self.router.post("/downloads/add")
         async def add_download(data: Dict = Body(...)):
-            url = data.get("url")
-            if not url:
+            mirrors = self._get_mirrors(data)
+            if not mirrors:
                 raise HTTPException(status_code=400, detail="URL is required")
             
-            url = url.strip()
-            filename = data.get("filename")
-            
-            if not filename:
-                try:
-                    async with httpx.AsyncClient(timeout=2.0) as temp_client:
-                        head = await temp_client.head(url, follow_redirects=True)
-                        cd = head.headers.get("Content-Disposition")
-                        if cd and "filename=" in cd:
-                            match = re.search(r'filename="?([^";\n]+)"?', cd)
-                            if match:
-                                filename = match.group(1).strip()
-                        if not filename:
-                            filename = head.url.path.split("/")[-1]
-                except Exception:
-                    pass
-
-            if not filename:
-                filename = url.split("/")[-1].split("?")[0] or "downloaded_file"
-
-            filename = os.path.basename(filename)
+            url = mirrors[0]
+            if data.get("refresh"):
+                existing = self._find_refreshable([url]).get(url)
+                if existing:
+                    status = self._refresh(existing)
+                    return {"id": existing.id, "status": status, "filename": existing.filename, "refreshed": True}
+
+            expected = self._parse_checksum(data.get("checksum"))
+            duplicate = self._find_duplicate(expected)
+            if duplicate:
+                return duplicate
+
+            info = None
+            if not data.get("filename") or self.settings.get("dedup"):
+                info = await self.probe.probe(url)
+                duplicate = self._find_duplicate({}, url, info["etag"] if info else None)
+                if duplicate:
+                    return duplicate
+
+            filename = self._resolve_filename(url, info, data.get("filename"))
             filename = self._get_unique_filename(filename)
             
-            task_id = str(uuid.uuid4())
-            save_path = self._get_downloads_dir() / filename
+            task = self._new_task(url, filename, data, expected, info)
+            task.set_mirrors(mirrors)
+            self._register(task)
             
-            task = DownloadTask(task_id, url, filename, save_path)
-            self.downloads[task_id] = task
-            
-            task.start(self.client)
-            return {"id": task_id, "status": "started", "filename": filename}
+            self.scheduler.enqueue(task)
+            return {"id": task.id, "status": task.status, "filename": filename, "mirrors": task.mirrors}
 
         @self.router.post("/downloads/bulk-add")
         async def bulk_add_downloads(data: Dict = Body(...)):
             urls = data.get("urls")
             if not urls or not isinstance(urls, list):
                 raise HTTPException(status_code=400, detail="A list of URLs is required")
+            checksums = data.get("checksums") or {}
+            if not isinstance(checksums, dict):
+                raise HTTPException(status_code=400, detail="checksums must map URL to checksum")
+            # Validate everything up front so a bad entry does not leave a half-added batch
+            checksums = {u.strip(): self._parse_checksum(c) for u, c in checksums.items()}
+            self._get_rate(data.get("rate_limit"))
+            self._get_int(data, "priority", 0)
             
+            urls = [url.strip() for url in urls if isinstance(url, str) and url.strip()]
+            refreshed = []
+            if data.get("refresh"):
+                # Known finished URLs are revalidated in place instead of added again
+                existing = self._find_refreshable(urls)
+                for url in existing:
+                    refreshed.append({"id": existing[url].id, "status": self._refresh(existing[url])})
+                urls = [url for url in urls if url not in existing]
+            infos = await self.probe.probe_many(urls)
+
             added_tasks = []
-            for url in urls:
-                url = url.strip()
-                if not url:
+            duplicates = []
+            for url, info in zip(urls, infos):
+                expected = checksums.get(url, {})
+                duplicate = self._find_duplicate(expected, url, info["etag"] if info else None)
+                if duplicate:
+                    duplicates.append({"url": url, **duplicate})
                     continue
                 
-                filename = url.split("/")[-1].split("?")[0] or "downloaded_file"
-                filename = os.path.basename(filename)
-                filename = self._get_unique_filename(filename)
-                
-                task_id = str(uuid.uuid4())
-                save_path = self._get_downloads_dir() / filename
-                
-                task = DownloadTask(task_id, url, filename, save_path)
-                self.downloads[task_id] = task
-                task.start(self.client)
-                added_tasks.append({"id": task_id, "filename": filename})
+                filename = self._get_unique_filename(self._resolve_filename(url, info))
+                task = self._new_task(url, filename, data, expected, info)
+                self._register(task)
+                self.scheduler.enqueue(task)
+                added_tasks.append({"id": task.id, "filename": filename})
                 
-            return {"status": "bulk started", "tasks": added_tasks}
+            return {"status": "bulk queued", "tasks": added_tasks, "duplicates": duplicates, "refreshed": refreshed}
 
         @self.router.post("/downloads/pause/{task_id}")
         async def pause_download(task_id: str):
@@ -324,8 +2738,21 @@ class Extension(ExtensionBase):
             if task.status == "completed":
                 return {"status": "already completed"}
             
-            task.start(self.client)
-            return {"status": "resuming"}
+            self.scheduler.enqueue(task)
+            return {"status": "resuming" if task.status == "downloading" else "queued"}
+
+        @self.router.post("/downloads/refresh/{task_id}")
+        async def refresh_download(task_id: str):
+            if task_id not in self.downloads:
+                raise HTTPException(status_code=404, detail="Task not found")
+            return {"status": self._refresh(self.downloads[task_id])}
+
+        @self.router.post("/downloads/refresh-all")
+        async def refresh_all():
+            finished = [t for t in self.downloads.values() if t.status == "completed"]
+            for task in finished:
+                self._refresh(task)
+            return {"status": "refreshing", "count": len(finished)}
 
         @self.router.post("/downloads/update-link/{task_id}")
         async def update_link(task_id: str, data: Dict = Body(...)):
@@ -333,66 +2760,157 @@ class Extension(ExtensionBase):
                 raise HTTPException(status_code=404, detail="Task not found")
             
             new_url = data.get("url")
-            if not new_url:
+            if not new_url and not data.get("mirrors"):
                 raise HTTPException(status_code=400, detail="New URL is required")
             
             task = self.downloads[task_id]
             was_downloading = (task.status == "downloading")
             
             task.cancel()
-            task.url = new_url
+            if data.get("mirrors"):
+                # Replaces the whole mirror list, led by `url` when given
+                task.set_mirrors(self._get_mirrors(data))
+                task.notify()
+            else:
+                task.set_url(new_url.strip())
             
             if was_downloading:
-                task.start(self.client)
+                self.scheduler.enqueue(task, to_top=True)
                 
             return {"status": "link updated", "was_downloading": was_downloading}
 
+        # Declared ahead of DELETE /downloads/{task_id} so "history" is not read as a task id
+        @self.router.get("/downloads/history")
+        async def get_history(offset: int = 0, limit: int = HISTORY_PAGE_SIZE):
+            offset = max(0, offset)
+            limit = max(1, min(limit, MAX_HISTORY_PAGE))
+            return {
+                "total": len(self.archive),
+                "total_bytes": self.archive.total_bytes,
+                "offset": offset,
+                "limit": limit,
+                "items": self.archive.page(offset, limit)
+            }
+
+        @self.router.delete("/downloads/history")
+        async def clear_history():
+            count = len(self.archive)
+            self._drop_archived(self.archive.clear())
+            return {"status": "history cleared", "count": count}
+
         @self.router.delete("/downloads/{task_id}")
         async def delete_download(task_id: str):
             if task_id not in self.downloads:
                 raise HTTPException(status_code=404, detail="Task not found")
             
             task = self.downloads[task_id]
-            task.cancel()
+            stopping = task.cancel()
+            if stopping:
+                # Let the loop flush and release its file handle before unlinking
+                await asyncio.wait([stopping], timeout=5.0)
             
             try:
                 if task.path.exists():
                     task.path.unlink()
+                if self.filenames:
+                    self.filenames.release(task.path)
             except Exception:
                 pass
                 
-            del self.downloads[task_id]
+            self._unregister(task_id)
             return {"status": "deleted"}
 
         @self.router.post("/downloads/pause-all")
         async def pause_all():
-            for task in self.downloads.values():
-                if task.status == "downloading":
+            for task in list(self.downloads.values()):
+                if task.status in ("downloading", "queued"):
                     task.cancel()
             return {"status": "all paused"}
 
         @self.router.post("/downloads/resume-all")
         async def resume_all():
-            for task in self.downloads.values():
+            for task in list(self.downloads.values()):
                 if task.status in ("paused", "error"):
-                    task.start(self.client)
+                    self.scheduler.enqueue(task)
             return {"status": "all resumed"}
 
+        @self.router.get("/downloads/metrics")
+        async def get_metrics(format: str = "json"):
+            self.metrics.ensure_lag_monitor()
+            tasks = list(self.downloads.values())
+            if format == "prometheus":
+                return PlainTextResponse(self.metrics.prometheus(tasks), media_type="text/plain; version=0.0.4")
+            return {
+                "aggregate": self.metrics.to_dict(),
+                "tasks": {t.id: t.metrics_snapshot() for t in tasks if t.status in ("downloading", "queued", "error")}
+            }
+
+        @self.router.get("/downloads/mirrors")
+        async def get_mirror_stats():
+            return self.mirror_stats.to_dict()
+
+        @self.router.get("/downloads/queue")
+        async def get_queue():
+            return [{"id": t.id, "filename": t.filename, "priority": t.priority} for t in self.scheduler.queued()]
+
+        @self.router.post("/downloads/priority/{task_id}")
+        async def set_priority(task_id: str, data: Dict = Body(...)):
+            if task_id not in self.downloads:
+                raise HTTPException(status_code=404, detail="Task not found")
+            if "priority" not in data:
+                raise HTTPException(status_code=400, detail="Priority is required")
+
+            task = self.downloads[task_id]
+            self.scheduler.reprioritize(task, self._get_int(data, "priority", 0))
+            return {"status": task.status, "priority": task.priority}
+
+        @self.router.post("/downloads/move-to-top/{task_id}")
+        async def move_to_top(task_id: str):
+            if task_id not in self.downloads:
+                raise HTTPException(status_code=404, detail="Task not found")
+
+            task = self.downloads[task_id]
+            self.scheduler.move_to_top(task)
+            return {"status": task.status, "priority": task.priority}
+
         @self.router.post("/downloads/clear-completed")
         async def clear_completed():
-            completed_ids = [tid for tid, t in self.downloads.items() if t.status == "completed"]
-            for tid in completed_ids:
-                del self.downloads[tid]
-            return {"status": "completed cleared", "count": len(completed_ids)}
+            # Cleared tasks stay reachable through /downloads/history
+            count = self._trim_finished(keep=0)
+            return {"status": "completed cleared", "count": count}
 
     def initialize(self) -> bool:
-        self.logger.info("File Downloader Extension initialized.")
+        self._load_mirror_stats()
+        self.archive.load()
+        self._restore_downloads()
+        self.content_index.load()
+        self.journal.start(lambda: list(self.downloads.values()), self._before_journal_flush)
+        # Interrupted tasks were requeued before any loop ran; start them once the server's is up
+        try:
+            asyncio.get_running_loop().call_soon(self.scheduler.pump)
+        except RuntimeError:
+            self.router.add_event_handler("startup", self.scheduler.pump)
+        self.logger.info(f"File Downloader Extension initialized ({len(self.downloads)} tasks restored, "
+                         f"{len(self.archive)} archived).")
         return True
 
     async def cleanup(self):
         self.logger.info("Cleaning up File Downloader Extension...")
-        for task in self.downloads.values():
-            task.cancel()
+        # Stop every loop so buffered bytes reach disk, then journal the interrupted
+        # tasks as queued so the next start picks them up again
+        interrupted = [t for t in self.downloads.values() if t.status in ("downloading", "queued")]
+        stopping = [t for t in (task.cancel() for task in interrupted) if t]
+        if stopping:
+            await asyncio.wait(stopping, timeout=5.0)
+        for task in interrupted:
+            task.status = "queued"
+            self.journal.mark(task)
+        self.journal.stop(lambda: list(self.downloads.values()))
+        self._save_mirror_stats()
+        self.metrics.stop()
+        self.writer.shutdown()
+        for client in list(self._retired_clients):
+            await client.aclose()
         await self.client.aclose()
 
     def get_routes(self) -> APIRouter:
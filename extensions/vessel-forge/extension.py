@@ -1,10 +1,14 @@
+import asyncio
 import os
 import sys
 import threading
 import time
 import json
-from fastapi import APIRouter, Body, HTTPException
-from typing import Dict, List, Optional
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, Body, HTTPException, Response
+from typing import Callable, Dict, List, Optional
 from pclink.core.extension_base import ExtensionBase
 
 # Add Bundled Libs
@@ -14,106 +18,551 @@ if LIB_DIR not in sys.path:
 
 try:
     import docker
-    from docker.errors import DockerException
+    from docker.errors import DockerException, NotFound
     HAS_DOCKER = True
 except ImportError:
     HAS_DOCKER = False
 
+# The event stream is reopened, and everything listed again, this often (seconds); that bounds
+# how long a missed event can leave the cache wrong. A lost daemon is retried after RECONNECT_DELAY
+RECONCILE_INTERVAL = 60
+RECONNECT_DELAY = 5.0
+# Event actions that change what the lists show; exec_*, attach, top, health_status... do not
+CONTAINER_ACTIONS = {"create", "start", "restart", "stop", "die", "kill", "oom", "pause", "unpause",
+                     "rename", "update", "destroy"}
+IMAGE_ACTIONS = {"pull", "tag", "untag", "delete", "import", "load"}
+NETWORK_ACTIONS = {"create", "destroy", "remove", "connect", "disconnect"}
+VOLUME_ACTIONS = {"create", "destroy"}
+# Docker SDK calls run on a small pool so the event loop never waits on the daemon. At most
+# DOCKER_MAX_QUEUED calls wait for a worker; past that a route answers 503 straight away
+DOCKER_WORKERS = 8
+DOCKER_MAX_QUEUED = 64
+# Seconds a route waits for each kind of operation before answering 504
+OP_TIMEOUTS = {"connect": 10.0, "inspect": 10.0, "stats": 15.0, "logs": 20.0, "start": 30.0, "stop": 30.0,
+               "restart": 45.0, "remove": 30.0, "delete": 60.0, "prune": 300.0}
+DEFAULT_OP_TIMEOUT = 30.0
+# Stats come from one streaming connection per running container, a sample about every second;
+# the last STATS_HISTORY samples of each are kept. At most STATS_MAX_STREAMS streams are open
+STATS_HISTORY = 60
+STATS_MAX_STREAMS = 128
+
+# --- Summaries ---
+def container_summary(c) -> Dict:
+    attrs = c.attrs
+    state = attrs.get('State', {})
+    error = state.get('Error', '')
+    return {
+        "id": c.short_id,
+        "name": c.name,
+        "status": c.status,
+        "error": error,
+        "image": attrs.get('Config', {}).get('Image'),
+        "created": attrs.get('Created'),
+        "started_at": state.get('StartedAt'),
+        "command": " ".join(attrs.get('Config', {}).get('Cmd', []) or[]),
+        "ports": attrs.get('NetworkSettings', {}).get('Ports', {}),
+        "networks": list(attrs.get('NetworkSettings', {}).get('Networks', {}).keys()),
+        "mounts":[{"src": m.get('Source'), "dst": m.get('Destination')} for m in attrs.get('Mounts', [])],
+        "env":[e for e in attrs.get('Config', {}).get('Env', []) if not any(x in e.lower() for x in ['pass', 'key', 'secret', 'token'])]
+    }
+
+
+def stats_sample(st: Dict) -> Dict:
+    """CPU %, memory, and network and block I/O byte totals from one stats document."""
+    cpu, precpu = st.get("cpu_stats") or {}, st.get("precpu_stats") or {}
+    cpu_delta = cpu.get("cpu_usage", {}).get("total_usage", 0) - precpu.get("cpu_usage", {}).get("total_usage", 0)
+    sys_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    cpu_pct = 0.0
+    if sys_delta > 0.0 and cpu_delta > 0.0:
+        cpu_pct = (cpu_delta / sys_delta) * cpu.get("online_cpus", 1) * 100.0
+    memory = st.get("memory_stats") or {}
+    networks = list((st.get("networks") or {}).values())
+    # None rather than [] on some cgroup v2 hosts
+    blkio = (st.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+    return {
+        "cpu": round(cpu_pct, 2),
+        "mem": memory.get("usage", 0),
+        "mem_limit": memory.get("limit", 0),
+        "net_rx": sum(n.get("rx_bytes", 0) for n in networks),
+        "net_tx": sum(n.get("tx_bytes", 0) for n in networks),
+        "blk_read": sum(b.get("value", 0) for b in blkio if (b.get("op") or "").lower() == "read"),
+        "blk_write": sum(b.get("value", 0) for b in blkio if (b.get("op") or "").lower() == "write"),
+    }
+
+
+def image_summary(i) -> Dict:
+    return {"id": i.short_id, "tags": i.tags, "size": i.attrs.get('Size', 0)}
+
+
+def network_summary(n) -> Dict:
+    return {"id": n.short_id, "name": n.name, "driver": n.attrs.get('Driver')}
+
+
+def volume_summary(v) -> Dict:
+    return {"name": v.name, "driver": v.attrs.get('Driver'), "mountpoint": v.attrs.get('Mountpoint')}
+
+
+# --- Docker Executor ---
+class DockerExecutor:
+    """Bounded worker pool for blocking Docker SDK calls, with per-operation timeouts and metrics.
+
+    A call that times out, or whose request goes away, before a worker
+    picks it up never runs. One already running cannot be interrupted; the
+    route stops waiting and the call finishes in the background.
+    """
+
+    def __init__(self, workers: int = DOCKER_WORKERS, max_queued: int = DOCKER_MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.queued = 0
+        self.running = 0
+        self.rejected = 0
+        self.ops: Dict[str, Dict] = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vessel-forge-docker")
+        self._lock = threading.Lock()
+
+    async def run(self, op: str, fn, *args, **kwargs):
+        """Runs ``fn`` on a worker; 503 when the queue is full, 504 after the operation's timeout."""
+        with self._lock:
+            if self.queued >= self.max_queued:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Too many Docker operations queued")
+            self.queued += 1
+        future = self._pool.submit(self._call, op, time.monotonic(), fn, args, kwargs)
+        future.add_done_callback(lambda f: f.cancelled() and self._dequeued(op, "cancelled"))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), OP_TIMEOUTS.get(op, DEFAULT_OP_TIMEOUT))
+        except asyncio.TimeoutError:
+            self._count(op, "timeouts")
+            raise HTTPException(status_code=504, detail=f"Docker {op} timed out")
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            ops = {op: {"count": m["count"], "errors": m["errors"], "timeouts": m["timeouts"],
+                        "cancelled": m["cancelled"],
+                        "wait_avg_ms": round(m["wait"] / m["count"] * 1000, 2) if m["count"] else 0,
+                        "avg_ms": round(m["time"] / m["count"] * 1000, 2) if m["count"] else 0,
+                        "max_ms": round(m["max"] * 1000, 2)}
+                   for op, m in self.ops.items()}
+            return {"workers": self.workers, "running": self.running, "queued": self.queued,
+                    "max_queued": self.max_queued, "rejected": self.rejected, "ops": ops}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+    def _call(self, op: str, submitted: float, fn, args, kwargs):
+        started = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        error = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.running -= 1
+                m = self._op(op)
+                m["count"] += 1
+                m["errors"] += error
+                m["wait"] += started - submitted
+                m["time"] += elapsed
+                m["max"] = max(m["max"], elapsed)
+
+    def _dequeued(self, op: str, counter: str):
+        with self._lock:
+            self.queued -= 1
+            self._op(op)[counter] += 1
+
+    def _count(self, op: str, counter: str):
+        with self._lock:
+            self._op(op)[counter] += 1
+
+    def _op(self, op: str) -> Dict:
+        m = self.ops.get(op)
+        if m is None:
+            m = self.ops[op] = {"count": 0, "errors": 0, "timeouts": 0, "cancelled": 0,
+                                "wait": 0.0, "time": 0.0, "max": 0.0}
+        return m
+
+
+# --- Stats Collector ---
+class StatsCollector:
+    """Live resource usage of every running container, one stats stream each.
+
+    DockerState passes the container list to ``sync`` whenever it changes. A
+    stream thread is started for each running container and exits once the
+    container is no longer running. Every decoded sample is appended to that
+    container's ring buffer, so reads never touch the daemon. The streams use
+    a client of their own, sized so that each one can hold a pooled connection.
+    """
+
+    def __init__(self, history: int = STATS_HISTORY, max_streams: int = STATS_MAX_STREAMS):
+        self.history = history
+        self.max_streams = max_streams
+        self._samples: Dict[str, deque] = {}
+        self._running: set = set()
+        self._streams: Dict[str, threading.Thread] = {}
+        self._client: Optional['docker.DockerClient'] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._running = set()
+            self._samples.clear()
+            client, self._client = self._client, None
+        # Closing the client ends the streams still waiting for a sample
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def sync(self, containers: List[Dict]):
+        running = {c["id"] for c in containers if c["status"] == "running"}
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._running = running
+            for cid in [k for k in self._samples if k not in running]:
+                del self._samples[cid]
+            for cid in running:
+                if cid in self._streams or len(self._streams) >= self.max_streams:
+                    continue
+                thread = threading.Thread(target=self._stream, args=(cid,), name=f"vessel-forge-stats-{cid}",
+                                          daemon=True)
+                self._streams[cid] = thread
+                thread.start()
+
+    def latest(self, cid: str) -> Optional[Dict]:
+        with self._lock:
+            samples = self._samples.get(cid)
+            return samples[-1] if samples else None
+
+    def snapshot(self, history: int) -> Dict[str, Dict]:
+        """Each streamed container's latest sample, with up to ``history`` samples, oldest first."""
+        with self._lock:
+            return {cid: {**samples[-1], "history": list(samples)[-history:] if history > 0 else []}
+                    for cid, samples in self._samples.items() if samples}
+
+    def _get_client(self) -> Optional['docker.DockerClient']:
+        with self._lock:
+            if self._client is None and not self._stop.is_set():
+                try:
+                    self._client = docker.from_env(max_pool_size=self.max_streams)
+                except Exception as e:
+                    logging.debug(f"Stats client unavailable: {e}")
+            return self._client
+
+    def _stream(self, cid: str):
+        try:
+            while not self._stop.is_set() and cid in self._running:
+                client = self._get_client()
+                if client is None:
+                    break
+                try:
+                    for st in client.api.stats(cid, stream=True, decode=True):
+                        if self._stop.is_set() or cid not in self._running:
+                            break
+                        self._record(cid, st)
+                except Exception as e:
+                    # Gone, or the daemon went away; the next sync after a reconcile starts it again
+                    if not self._stop.is_set():
+                        logging.debug(f"Stats stream for {cid} failed: {e}")
+                    break
+                # The daemon ends the stream when the container stops. If it is restarting, the stream
+                # is reopened once the next event marks it running again
+                self._stop.wait(1.0)
+        finally:
+            with self._lock:
+                if self._streams.get(cid) is threading.current_thread():
+                    del self._streams[cid]
+
+    def _record(self, cid: str, st: Dict):
+        sample = stats_sample(st)
+        sample["t"] = time.time()
+        with self._lock:
+            if cid not in self._running:
+                return
+            samples = self._samples.get(cid)
+            if samples is None:
+                samples = self._samples[cid] = deque(maxlen=self.history)
+            samples.append(sample)
+
+
+# --- State Cache ---
+class DockerState:
+    """In-memory model of the daemon's containers, images, networks and volumes.
+
+    One thread owns the connection. It subscribes to the event stream, then
+    lists everything once; after that each relevant event re-inspects only
+    the object it names. The stream is opened with an ``until`` one
+    RECONCILE_INTERVAL ahead, so it ends on its own every interval and the
+    model is listed again from scratch, repairing anything a missed event
+    left wrong. Routes read the model without touching the daemon.
+    ``on_containers`` gets the container list after every change to it.
+    """
+
+    # kind -> (collection on the client, summary, cache key)
+    KINDS = {
+        "containers": ("containers", container_summary, lambda o: o.id),
+        "images": ("images", image_summary, lambda o: o.id),
+        "networks": ("networks", network_summary, lambda o: o.id),
+        "volumes": ("volumes", volume_summary, lambda o: o.name),
+    }
+
+    def __init__(self, on_containers: Optional[Callable[[List[Dict]], None]] = None):
+        self.client: Optional['docker.DockerClient'] = None
+        self.on_containers = on_containers
+        self.connected = False
+        self.synced_at: Optional[float] = None  # monotonic; the last time the daemon told us anything
+        self._objects: Dict[str, Dict[str, Dict]] = {kind: {} for kind in self.KINDS}
+        # kind -> ref -> change number of its last refresh, so a listing does not undo newer refreshes
+        self._refreshed: Dict[str, Dict[str, int]] = {kind: {} for kind in self.KINDS}
+        self._changes = 0
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._events = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not HAS_DOCKER:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._close_events()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self._disconnect()
+
+    def get_client(self) -> Optional['docker.DockerClient']:
+        """The shared client, connecting (and pinging once) only when there is none."""
+        with self._connect_lock:
+            if self.client is None and HAS_DOCKER:
+                try:
+                    client = docker.from_env()
+                    client.ping()
+                    self.client = client
+                except Exception:
+                    return None
+            return self.client
+
+    def list(self, kind: str) -> List[Dict]:
+        with self._lock:
+            return list(self._objects[kind].values())
+
+    def age(self) -> Optional[float]:
+        """Seconds since the model was last brought up to date, None before the first listing."""
+        synced_at = self.synced_at
+        return None if synced_at is None else time.monotonic() - synced_at
+
+    def refresh(self, kind: str, ref: str):
+        """Re-inspects one object by id or name; drops it from the model when it no longer exists."""
+        client = self.client
+        if client is None:
+            return
+        collection, summary, key = self.KINDS[kind]
+        try:
+            obj = getattr(client, collection).get(ref)
+        except NotFound:
+            with self._lock:
+                objects = self._objects[kind]
+                for cached in self._matching(kind, objects, ref):
+                    del objects[cached]
+                self._changes += 1
+                self._refreshed[kind][ref] = self._changes
+        except Exception as e:
+            logging.debug(f"Refreshing {kind} {ref} failed: {e}")
+            return
+        else:
+            with self._lock:
+                self._objects[kind][key(obj)] = summary(obj)
+                self._changes += 1
+                self._refreshed[kind][key(obj)] = self._changes
+        if kind == "containers":
+            self._containers_changed()
+
+    def reconcile(self, client: 'docker.DockerClient'):
+        with self._lock:
+            started = self._changes
+        listing = {}
+        for kind, (collection, summary, key) in self.KINDS.items():
+            objects = getattr(client, collection).list(all=True) if kind == "containers" else getattr(client, collection).list()
+            listing[kind] = {key(o): summary(o) for o in objects}
+        with self._lock:
+            # Refreshes that landed while listing are newer than what the listing saw
+            for kind, objects in listing.items():
+                current = self._objects[kind]
+                for ref, change in self._refreshed[kind].items():
+                    if change <= started:
+                        continue
+                    for listed in self._matching(kind, objects, ref):
+                        if listed not in current:
+                            del objects[listed]
+                    if ref in current:
+                        objects[ref] = current[ref]
+                self._refreshed[kind] = {}
+            self._objects = listing
+        self.synced_at = time.monotonic()
+        self._containers_changed()
+
+    @staticmethod
+    def _matching(kind: str, objects: Dict[str, Dict], ref: str) -> List[str]:
+        # Routes pass short ids; volumes only have names
+        return [k for k in objects if k == ref or (kind != "volumes" and k.startswith(ref))]
+
+    def _containers_changed(self):
+        if self.on_containers is not None:
+            self.on_containers(self.list("containers"))
+
+    def _apply(self, event: Dict):
+        kind = event.get("Type")
+        action = (event.get("Action") or "").split(":")[0]
+        actor = event.get("Actor") or {}
+        ref = actor.get("ID")
+        if not ref:
+            return
+        if kind == "container" and action in CONTAINER_ACTIONS:
+            self.refresh("containers", ref)
+        elif kind == "image" and action in IMAGE_ACTIONS:
+            self.refresh("images", ref)
+        elif kind == "network" and action in NETWORK_ACTIONS:
+            self.refresh("networks", ref)
+            container = (actor.get("Attributes") or {}).get("container")
+            if container:
+                self.refresh("containers", container)
+        elif kind == "volume" and action in VOLUME_ACTIONS:
+            self.refresh("volumes", ref)
+        self.synced_at = time.monotonic()
+
+    def _run(self):
+        while not self._stop.is_set():
+            client = self.get_client()
+            if client is None:
+                self._stop.wait(RECONNECT_DELAY)
+                continue
+            started = time.monotonic()
+            try:
+                # Subscribe before listing, so a change made during the listing still arrives
+                self._events = client.events(decode=True, until=int(time.time()) + RECONCILE_INTERVAL)
+                if self._stop.is_set():
+                    break
+                self.reconcile(client)
+                self.connected = True
+                for event in self._events:
+                    self._apply(event)
+            except Exception as e:
+                if not self._stop.is_set():
+                    logging.warning(f"Lost the Docker event stream: {e}")
+                self.connected = False
+                self._disconnect()
+            finally:
+                self._close_events()
+            # A stream that ends right away means the daemon is going away
+            if time.monotonic() - started < 1.0:
+                self.connected = False
+                self._stop.wait(RECONNECT_DELAY)
+
+    def _close_events(self):
+        events, self._events = self._events, None
+        if events is not None:
+            try:
+                events.close()
+            except Exception:
+                pass
+
+    def _disconnect(self):
+        with self._connect_lock:
+            client, self.client = self.client, None
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+
 class Extension(ExtensionBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.client: Optional['docker.DockerClient'] = None
+        self.stats = StatsCollector()
+        self.state = DockerState(on_containers=self.stats.sync)
+        self.executor = DockerExecutor()
         self._pulling = {} 
         self._deploying = {}
         self._lock = threading.Lock()
         self.setup_routes()
 
-    def _get_client(self):
-        if self.client:
-            try:
-                self.client.ping()
-                return self.client
-            except:
-                self.client = None
-        if not HAS_DOCKER: return None
-        try:
-            self.client = docker.from_env()
-            self.client.ping()
-            return self.client
-        except: return None
+    async def _client(self):
+        """The shared client; connecting, when there is none yet, happens on a worker."""
+        # The state thread notices a lost daemon through its event stream; no ping per request
+        client = self.state.client or await self.executor.run("connect", self.state.get_client)
+        if not client: raise HTTPException(status_code=503)
+        return client
+
+    def _cached(self, kind: str, response: Response) -> List[Dict]:
+        """A list from the state cache, with its age in seconds as X-Cache-Age."""
+        age = self.state.age()
+        if not self.state.connected or age is None: raise HTTPException(status_code=503)
+        response.headers["X-Cache-Age"] = f"{age:.3f}"
+        return self.state.list(kind)
 
     def setup_routes(self):
         @self.router.get("/status")
-        async def get_status():
-            client = self._get_client()
-            if not client: return {"connected": False}
-            try:
-                containers = client.containers.list(all=True)
-                with self._lock: 
-                    pulling = dict(self._pulling)
-                    deploying = dict(self._deploying)
-                return {
-                    "connected": True,
-                    "total": len(containers),
-                    "running": len([c for c in containers if c.status == 'running']),
-                    "pulling": pulling,
-                    "deploying": deploying
-                }
-            except: return {"connected": False}
+        async def get_status(response: Response):
+            if not self.state.connected: return {"connected": False}
+            containers = self._cached("containers", response)
+            with self._lock: 
+                pulling = dict(self._pulling)
+                deploying = dict(self._deploying)
+            return {
+                "connected": True,
+                "total": len(containers),
+                "running": len([c for c in containers if c["status"] == 'running']),
+                "pulling": pulling,
+                "deploying": deploying
+            }
 
         @self.router.get("/containers")
-        async def list_containers():
-            client = self._get_client()
-            if not client: raise HTTPException(status_code=503)
-            data =[]
-            for c in client.containers.list(all=True):
-                attrs = c.attrs
-                state = attrs.get('State', {})
-                error = state.get('Error', '')
-                
-                data.append({
-                    "id": c.short_id,
-                    "name": c.name,
-                    "status": c.status,
-                    "error": error,
-                    "image": attrs.get('Config', {}).get('Image'),
-                    "created": attrs.get('Created'),
-                    "started_at": state.get('StartedAt'),
-                    "command": " ".join(attrs.get('Config', {}).get('Cmd', []) or[]),
-                    "ports": attrs.get('NetworkSettings', {}).get('Ports', {}),
-                    "networks": list(attrs.get('NetworkSettings', {}).get('Networks', {}).keys()),
-                    "mounts":[{"src": m.get('Source'), "dst": m.get('Destination')} for m in attrs.get('Mounts', [])],
-                    "env":[e for e in attrs.get('Config', {}).get('Env', []) if not any(x in e.lower() for x in ['pass', 'key', 'secret', 'token'])] 
-                })
-            return data
+        async def list_containers(response: Response):
+            return self._cached("containers", response)
+
+        @self.router.get("/containers/stats")
+        async def get_all_stats(history: int = 30):
+            """Latest sample of every running container, keyed by id, with up to ``history`` earlier ones."""
+            if not self.state.connected: raise HTTPException(status_code=503)
+            return self.stats.snapshot(min(max(history, 0), STATS_HISTORY))
 
         @self.router.get("/containers/{id}/stats")
         async def get_stats(id: str):
-            client = self._get_client()
-            if not client: raise HTTPException(status_code=503)
-            c = client.containers.get(id)
+            cached = next((c for c in self.state.list("containers") if c["id"] == id[:12] or c["name"] == id), None)
+            if cached and cached["status"] != "running": return {"cpu": 0, "mem": 0, "mem_limit": 0}
+            sample = self.stats.latest(cached["id"]) if cached else None
+            if sample: return sample
+            # Not streamed (yet): ask the daemon once
+            client = await self._client()
+            c = await self.executor.run("inspect", client.containers.get, id)
             if c.status != "running": return {"cpu": 0, "mem": 0, "mem_limit": 0}
             try:
-                st = c.stats(stream=False)
-                mem_usage = st.get("memory_stats", {}).get("usage", 0)
-                mem_limit = st.get("memory_stats", {}).get("limit", 0)
-                
-                cpu_delta = st.get("cpu_stats", {}).get("cpu_usage", {}).get("total_usage", 0) - st.get("precpu_stats", {}).get("cpu_usage", {}).get("total_usage", 0)
-                sys_delta = st.get("cpu_stats", {}).get("system_cpu_usage", 0) - st.get("precpu_stats", {}).get("system_cpu_usage", 0)
-                online_cpus = st.get("cpu_stats", {}).get("online_cpus", 1)
-                
-                cpu_pct = 0.0
-                if sys_delta > 0.0 and cpu_delta > 0.0:
-                    cpu_pct = (cpu_delta / sys_delta) * online_cpus * 100.0
-                    
-                return {"cpu": round(cpu_pct, 2), "mem": mem_usage, "mem_limit": mem_limit}
+                return stats_sample(await self.executor.run("stats", c.stats, stream=False))
             except Exception as e:
                 return {"cpu": 0, "mem": 0, "mem_limit": 0, "error": str(e)}
 
         @self.router.post("/containers/run")
         async def run_container(payload: dict = Body(...)):
-            client = self._get_client()
-            if not client: raise HTTPException(status_code=503)
+            client = await self._client()
             try:
                 mode = payload.get("mode", "basic")
                 run_kwargs = {"detach": True}
@@ -138,7 +587,9 @@ class Extension(ExtensionBase):
 
                 def do_run(kwargs, task_id):
                     try:
-                        client.containers.run(**kwargs)
+                        container = client.containers.run(**kwargs)
+                        if hasattr(container, "id"):  # not detached: run returned the logs
+                            self.state.refresh("containers", container.id)
                     finally:
                         with self._lock: self._deploying.pop(task_id, None)
 
@@ -151,54 +602,65 @@ class Extension(ExtensionBase):
 
         @self.router.post("/containers/{id}/{action}")
         async def container_action(id: str, action: str):
-            client = self._get_client()
-            c = client.containers.get(id)
-            if action == "start": c.start()
-            elif action == "stop": c.stop()
-            elif action == "restart": c.restart()
-            elif action == "remove": c.remove(force=True)
+            if action not in ("start", "stop", "restart", "remove"):
+                raise HTTPException(status_code=400, detail=f"Unknown action: {action}")
+            client = await self._client()
+            def act():
+                c = client.containers.get(id)
+                if action == "start": c.start()
+                elif action == "stop": c.stop()
+                elif action == "restart": c.restart()
+                else: c.remove(force=True)
+                self.state.refresh("containers", c.id)
+            await self.executor.run(action, act)
             return {"success": True}
 
         @self.router.get("/containers/{id}/logs")
         async def get_logs(id: str, tail: int = 500):
-            client = self._get_client()
-            c = client.containers.get(id)
-            return {"logs": c.logs(tail=tail).decode('utf-8', errors='ignore')}
+            client = await self._client()
+            logs = await self.executor.run("logs", lambda: client.containers.get(id).logs(tail=tail))
+            return {"logs": logs.decode('utf-8', errors='ignore')}
 
         @self.router.get("/images")
-        async def list_images():
-            client = self._get_client()
-            return[{"id": i.short_id, "tags": i.tags, "size": i.attrs.get('Size', 0)} for i in client.images.list()]
+        async def list_images(response: Response):
+            return self._cached("images", response)
 
         @self.router.post("/containers/bulk/{action}")
         async def bulk_action(action: str):
-            client = self._get_client()
-            if not client: raise HTTPException(status_code=503)
-            containers = client.containers.list(all=True)
-            for c in containers:
-                try:
-                    if action == "start": c.start()
-                    elif action == "stop": c.stop()
-                    elif action == "restart": c.restart()
-                except: continue
+            client = await self._client()
+            if action not in ("start", "stop", "restart"): return {"success": True}
+            # Half the workers at most, so single actions and stats still get through
+            slots = asyncio.Semaphore(max(1, self.executor.workers // 2))
+            def act(container_id):
+                c = client.containers.get(container_id)
+                getattr(c, action)()
+                self.state.refresh("containers", c.id)
+            async def one(container_id):
+                async with slots:
+                    await self.executor.run(action, act, container_id)
+            await asyncio.gather(*(one(c["id"]) for c in self.state.list("containers")), return_exceptions=True)
             return {"success": True}
 
         @self.router.post("/system/prune")
         async def prune_system():
-            client = self._get_client()
-            if not client: raise HTTPException(status_code=503)
-            client.containers.prune()
-            client.images.prune()
-            client.networks.prune()
-            client.volumes.prune()
+            client = await self._client()
+            def prune():
+                client.containers.prune()
+                client.images.prune()
+                client.networks.prune()
+                client.volumes.prune()
+                self.state.reconcile(client)
+            await self.executor.run("prune", prune)
             return {"success": True}
 
         @self.router.post("/images/pull")
         async def pull_image(image: str = Body(..., embed=True)):
-            client = self._get_client()
+            client = await self._client()
             def do_pull(repo):
                 with self._lock: self._pulling[repo] = "Pulling..."
-                try: client.images.pull(repo)
+                try:
+                    client.images.pull(repo)
+                    self.state.refresh("images", repo)
                 finally:
                     with self._lock: self._pulling.pop(repo, None)
             threading.Thread(target=do_pull, args=(image,), daemon=True).start()
@@ -206,39 +668,59 @@ class Extension(ExtensionBase):
 
         @self.router.delete("/images/{id}")
         async def delete_image(id: str):
-            client = self._get_client()
-            client.images.remove(id, force=True)
+            client = await self._client()
+            def delete():
+                client.images.remove(id, force=True)
+                self.state.refresh("images", id)
+            await self.executor.run("delete", delete)
             return {"success": True}
 
         @self.router.get("/networks")
-        async def list_networks():
-            client = self._get_client()
-            return[{"id": n.short_id, "name": n.name, "driver": n.attrs.get('Driver')} for n in client.networks.list()]
+        async def list_networks(response: Response):
+            return self._cached("networks", response)
 
         @self.router.delete("/networks/{id}")
         async def delete_network(id: str):
-            client = self._get_client()
-            try:
+            client = await self._client()
+            def delete():
                 client.networks.get(id).remove()
+                self.state.refresh("networks", id)
+            try:
+                await self.executor.run("delete", delete)
                 return {"success": True}
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(status_code=400, detail=str(e))
 
         @self.router.get("/volumes")
-        async def list_volumes():
-            client = self._get_client()
-            return[{"name": v.name, "driver": v.attrs.get('Driver'), "mountpoint": v.attrs.get('Mountpoint')} for v in client.volumes.list()]
+        async def list_volumes(response: Response):
+            return self._cached("volumes", response)
 
         @self.router.delete("/volumes/{name}")
         async def delete_volume(name: str):
-            client = self._get_client()
-            try:
+            client = await self._client()
+            def delete():
                 client.volumes.get(name).remove(force=True)
+                self.state.refresh("volumes", name)
+            try:
+                await self.executor.run("delete", delete)
                 return {"success": True}
+            except HTTPException:
+                raise
             except Exception as e:
                 raise HTTPException(status_code=400, detail=str(e))
 
-    def initialize(self) -> bool: return True
+        @self.router.get("/system/executor")
+        async def executor_metrics():
+            return self.executor.metrics()
+
+    def initialize(self) -> bool:
+        self.stats.start()
+        self.state.start()
+        return True
     def cleanup(self): 
-        if self.client: self.client.close()
+        self.state.stop()
+        self.stats.stop()
+        self.executor.shutdown()
     def get_routes(self) -> APIRouter: return self.router
\ No newline at end of file
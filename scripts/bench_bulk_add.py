@@ -0,0 +1,76 @@
+"""Microbenchmark for the bookkeeping half of a file-downloader bulk add.
+
+Times filename reservation plus task registration for N URLs, which is
+what ``/downloads/bulk-add`` does per URL once metadata probing is done.
+Network and the scheduler are left out: downloads are never started.
+
+Usage:
+    python scripts/bench_bulk_add.py --count 10000
+    python scripts/bench_bulk_add.py --extension /path/to/old/extension.py --existing 2000
+
+Requires the PCLink runtime (``pclink.core``) and ``httpx`` to be importable.
+"""
+import argparse
+import importlib.util
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+DEFAULT_EXTENSION = Path(__file__).resolve().parent.parent / "extensions" / "file-downloader" / "extension.py"
+
+
+def load_extension(path: Path):
+    spec = importlib.util.spec_from_file_location("bench_bulk_add_ext", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_extension(module, root: Path, existing: int):
+    downloads = root / "downloads"
+    downloads.mkdir()
+    for i in range(existing):
+        (downloads / f"file ({i}).bin" if i else downloads / "file.bin").touch()
+    ext = module.Extension(None, root / "extension", {}, None)
+    ext.settings["download_dir"] = str(downloads)
+    return ext
+
+
+def bulk_add(module, ext, names):
+    for name in names:
+        filename = ext._get_unique_filename(name)
+        task = module.DownloadTask(str(uuid.uuid4()), f"http://example.invalid/{name}", filename,
+                                   ext._get_downloads_dir() / filename)
+        ext._register(task)
+
+
+def run(module, count: int, existing: int, scenario: str) -> float:
+    if scenario == "same":
+        names = ["file.bin"] * count
+    else:
+        names = [f"file-{i}.bin" for i in range(count)]
+    with tempfile.TemporaryDirectory() as tmp:
+        ext = make_extension(module, Path(tmp), existing)
+        started = time.perf_counter()
+        bulk_add(module, ext, names)
+        elapsed = time.perf_counter() - started
+        ext.writer.shutdown()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--extension", type=Path, default=DEFAULT_EXTENSION)
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--existing", type=int, default=0, help="same-named files already in the directory")
+    args = parser.parse_args()
+
+    module = load_extension(args.extension)
+    for scenario in ("distinct", "same"):
+        elapsed = run(module, args.count, args.existing, scenario)
+        print(f"{scenario:8s} {args.count} adds: {elapsed:8.3f} s  ({elapsed / args.count * 1e6:8.1f} us/add)")
+
+
+if __name__ == "__main__":
+    main()
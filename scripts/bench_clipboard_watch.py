@@ -0,0 +1,155 @@
+"""Benchmark the clipboard-history wl-paste --watch pipeline with a stand-in wl-paste.
+
+A fake ``wl-paste`` on PATH replays ``--count`` unique clips of each size
+through whatever ``--watch`` command the extension passes it, one process
+per clip like the real tool, and answers ``--list-types``. Every size runs
+in a fresh child process that reports clips/s, MiB/s and how far the
+child's peak RSS rose above its resident size before the monitor started.
+
+Usage:
+    python scripts/bench_clipboard_watch.py
+    python scripts/bench_clipboard_watch.py --sizes 1K 1M 100M --count 5 --kind text
+    python scripts/bench_clipboard_watch.py --extension /path/to/old/extension.py
+
+Requires the PCLink runtime (``pclink.core``) and FastAPI to be importable.
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import stat
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_EXTENSION = Path(__file__).resolve().parent.parent / "extensions" / "clipboard-history" / "extension.py"
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+# --list-types is answered by the shell, as cheaply as the real (C) wl-paste would
+FAKE_WL_PASTE = r'''#!/bin/sh
+if [ "$1" = "--list-types" ]; then
+    if [ "$BENCH_KIND" = text ]; then echo "text/plain;charset=utf-8"; else echo image/png; fi
+    exit 0
+fi
+exec "%(python)s" -c "$FAKE_WATCH" "$@"
+'''
+
+FAKE_WATCH = r'''
+import os, subprocess, sys, time
+size, count, kind = int(os.environ["BENCH_SIZE"]), int(os.environ["BENCH_COUNT"]), os.environ["BENCH_KIND"]
+command = sys.argv[sys.argv.index("--watch") + 1:]
+block = (b"clipboard benchmark line\n" * 43690) if kind == "text" else os.urandom(1024 * 1024)
+env = dict(os.environ, CLIPBOARD_STATE="data")
+for i in range(count):
+    helper = subprocess.Popen(command, stdin=subprocess.PIPE, env=env)
+    head = (b"%08d " % i) if kind == "text" else b"\x89PNG\r\n\x1a\n" + (b"%08d" % i)
+    helper.stdin.write(head)
+    left = size - len(head)
+    while left > 0:
+        n = min(left, len(block))
+        helper.stdin.write(block[:n])
+        left -= n
+    helper.stdin.close()
+    helper.wait()
+time.sleep(3600)
+'''
+
+
+def parse_size(text: str) -> int:
+    unit = UNITS.get(text[-1:].upper())
+    return int(float(text[:-1]) * unit) if unit else int(text)
+
+
+def load_extension(path: Path):
+    spec = importlib.util.spec_from_file_location("bench_clipboard_watch_ext", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def resident_kib() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def run_size(extension: Path, size: int, count: int, kind: str, results):
+    with tempfile.TemporaryDirectory() as tmp:
+        bindir = Path(tmp) / "bin"
+        bindir.mkdir()
+        fake = bindir / "wl-paste"
+        fake.write_text(FAKE_WL_PASTE % {"python": sys.executable})
+        fake.chmod(fake.stat().st_mode | stat.S_IXUSR)
+        os.environ["PATH"] = f"{bindir}{os.pathsep}{os.environ['PATH']}"
+        os.environ.update(BENCH_SIZE=str(size), BENCH_COUNT=str(count), BENCH_KIND=kind, FAKE_WATCH=FAKE_WATCH)
+
+        module = load_extension(extension)
+        ext = module.Extension(None, Path(tmp) / "extension", {})
+        ext.store.configure(max_entries=count + 1, max_bytes=max(size * 2, 1024 ** 2), max_age=0,
+                            eviction="oldest")
+        ext.blobs.max_payload = size * 2
+
+        done = threading.Event()
+        seen = []
+        add_payload = ext._add_payload
+
+        def counted(writer):
+            add_payload(writer)
+            seen.append(time.perf_counter())
+            if len(seen) == count:
+                done.set()
+
+        ext._add_payload = counted
+        baseline = resident_kib()
+        ext.running = True
+        ext.store.start()
+        started = time.perf_counter()
+        monitor = threading.Thread(target=ext._monitor_wayland_watch, daemon=True)
+        monitor.start()
+        finished = done.wait(timeout=max(60.0, size * count / (4 * 1024 ** 2)))
+        elapsed = (seen[-1] if seen else time.perf_counter()) - started
+        ext.cleanup()
+        results.put({
+            "size": size,
+            "clips": len(seen),
+            "complete": finished,
+            "clips_per_s": len(seen) / elapsed,
+            "mib_per_s": len(seen) * size / elapsed / 1024 ** 2,
+            "peak_rss_delta_mib": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024,
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--extension", type=Path, default=DEFAULT_EXTENSION)
+    parser.add_argument("--sizes", nargs="+", default=["1K", "64K", "1M", "16M", "100M"])
+    parser.add_argument("--count", type=int, default=0, help="clips per size, 0 = scaled to the size")
+    parser.add_argument("--kind", choices=("image", "text"), default="image",
+                        help="random PNG-tagged bytes (stored as-is) or repetitive text (compressed)")
+    parser.add_argument("--json", action="store_true", help="print results as a JSON list")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for text in args.sizes:
+        size = parse_size(text)
+        count = args.count or max(3, min(200, (256 * 1024 ** 2) // size))
+        queue = context.Queue()
+        child = context.Process(target=run_size, args=(args.extension, size, count, args.kind, queue))
+        child.start()
+        result = queue.get()
+        child.join()
+        results.append(result)
+        if not args.json:
+            print(f"{text:>6s} x {result['clips']:3d}{'' if result['complete'] else ' (timed out)'}: "
+                  f"{result['clips_per_s']:8.1f} clips/s  {result['mib_per_s']:8.1f} MiB/s  "
+                  f"peak RSS +{result['peak_rss_delta_mib']:7.1f} MiB", flush=True)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
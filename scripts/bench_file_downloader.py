@@ -0,0 +1,285 @@
+"""Benchmark the file-downloader engine against a local stand-in HTTP server.
+
+The server runs in a child process so the reported CPU time belongs to the
+download engine only. Its latency, per-connection bandwidth and range
+support are configurable. Event-loop lag is sampled by a coroutine that
+sleeps for a fixed interval and records how late it wakes up. ``--disk-rate``
+replaces the engine's ``open`` with files whose writes block for as long as
+a disk of that bandwidth would, to compare engines on slow storage.
+
+``--suite`` runs the preset scenarios in ``SUITE`` (single stream,
+segmented, throttled, no-range and high-latency servers) and prints one
+line per scenario; ``--json`` emits the same results machine-readably.
+Engines that expose ``DownloadMetrics`` also report TTFB and write latency.
+
+Usage:
+    python scripts/bench_file_downloader.py --size-mb 512 --segments 4
+    python scripts/bench_file_downloader.py --suite --size-mb 128 --json
+    python scripts/bench_file_downloader.py --extension /path/to/old/extension.py --disk-rate 100000000
+
+Requires the PCLink runtime (``pclink.core``) and ``httpx`` to be importable.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+DEFAULT_EXTENSION = Path(__file__).resolve().parent.parent / "extensions" / "file-downloader" / "extension.py"
+BLOCK = os.urandom(1024 * 1024)
+LAG_INTERVAL = 0.01
+
+# name -> options overriding the command line; rates are bytes/sec
+SUITE = {
+    "single": {"segments": 1},
+    "segmented": {"segments": 4},
+    "throttled": {"segments": 4, "task_limit": 32 * 1024 * 1024},
+    "server-bandwidth": {"segments": 4, "rate": 16 * 1024 * 1024},
+    "no-ranges": {"segments": 4, "no_ranges": True},
+    "latency": {"segments": 4, "latency": 0.1},
+}
+
+
+def make_handler(size: int, ranges: bool, rate: int, latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, head: bool):
+            start, end, status = 0, size - 1, 200
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if ranges and match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206
+
+            if latency:
+                time.sleep(latency)
+            self.send_response(status)
+            if ranges:
+                self.send_header("Accept-Ranges", "bytes")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            if head:
+                return
+
+            step = 256 * 1024
+            pos = start
+            began = time.monotonic()
+            while pos <= end:
+                offset = pos % len(BLOCK)
+                n = min(step, end - pos + 1, len(BLOCK) - offset)
+                try:
+                    self.wfile.write(BLOCK[offset:offset + n])
+                except OSError:
+                    return
+                pos += n
+                if rate:
+                    ahead = (pos - start) / rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+        def do_GET(self):
+            self._send(False)
+
+        def do_HEAD(self):
+            self._send(True)
+
+    return Handler
+
+
+def serve(port_queue, size: int, ranges: bool, rate: int, latency: float):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(size, ranges, rate, latency))
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+class SlowFile:
+    """File proxy whose writes take as long as they would on a ``rate`` bytes/sec disk."""
+
+    def __init__(self, f, rate: int):
+        self._f = f
+        self._rate = rate
+
+    def write(self, data):
+        time.sleep(len(data) / self._rate)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+def slow_open(rate: int):
+    def _open(*args, **kwargs):
+        return SlowFile(open(*args, **kwargs), rate)
+    return _open
+
+
+def load_extension(path: Path):
+    spec = importlib.util.spec_from_file_location("bench_file_downloader_ext", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def monitor_lag(samples, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        before = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(max(0.0, loop.time() - before - LAG_INTERVAL))
+
+
+def attach_engine(module, task):
+    """Gives the task whatever shared collaborators this version of the engine expects."""
+    metrics = module.DownloadMetrics() if hasattr(module, "DownloadMetrics") else None
+    if metrics is not None:
+        task.metrics = metrics
+    if hasattr(module, "DiskWriter"):
+        task.writer = module.DiskWriter(metrics) if metrics is not None else module.DiskWriter()
+    if hasattr(module, "BandwidthLimiter"):
+        task.limiter = module.BandwidthLimiter()
+    return task
+
+
+async def run_once(module, url: str, target: Path, segments: int, task_limit: int):
+    import httpx
+
+    task = module.DownloadTask("bench", url, target.name, target, segments=segments)
+    attach_engine(module, task)
+    if task_limit:
+        task.bucket.set_rate(task_limit)
+    samples = []
+    stop = asyncio.Event()
+    async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None)) as client:
+        lag = asyncio.create_task(monitor_lag(samples, stop))
+        cpu, wall = time.process_time(), time.perf_counter()
+        task.start(client)
+        await task._task
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        stop.set()
+        await lag
+    if getattr(task, "writer", None) is not None and hasattr(task.writer, "shutdown"):
+        task.writer.shutdown()
+    return task, cpu, wall, samples
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_scenario(module, name: str, options: dict, size: int, runs: int) -> list:
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve, args=(ports, size, not options["no_ranges"], options["rate"], options["latency"]), daemon=True
+    )
+    server.start()
+    url = f"http://127.0.0.1:{ports.get(timeout=10)}/payload.bin"
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for run in range(runs):
+                target = Path(tmp) / f"payload-{run}.bin"
+                task, cpu, wall, lag = asyncio.run(
+                    run_once(module, url, target, options["segments"], options["task_limit"])
+                )
+                if task.status != "completed" or target.stat().st_size != size:
+                    print(f"{name} run {run}: {task.status} {task.error}", file=sys.stderr)
+                    continue
+                result = {
+                    "scenario": name,
+                    "run": run,
+                    "mib_per_s": size / wall / 1024 ** 2,
+                    "cpu_s_per_gib": cpu / (size / 1024 ** 3),
+                    "lag_p50_ms": percentile(lag, 50) * 1000,
+                    "lag_p99_ms": percentile(lag, 99) * 1000,
+                    "lag_max_ms": max(lag or [0]) * 1000,
+                }
+                metrics = getattr(task, "metrics", None)
+                if metrics is not None:
+                    result["ttfb_p50_ms"] = metrics.ttfb.quantile(0.5) * 1000
+                    result["write_p99_ms"] = metrics.write_latency.quantile(0.99) * 1000
+                results.append(result)
+                target.unlink()
+    finally:
+        server.terminate()
+    return results
+
+
+def format_result(result: dict) -> str:
+    line = (
+        f"{result['scenario']:>16s} run {result['run']}: {result['mib_per_s']:8.1f} MiB/s  "
+        f"cpu {result['cpu_s_per_gib']:6.2f} s/GiB  "
+        f"loop lag p50 {result['lag_p50_ms']:6.2f} ms  p99 {result['lag_p99_ms']:6.2f} ms  "
+        f"max {result['lag_max_ms']:7.2f} ms"
+    )
+    if "ttfb_p50_ms" in result:
+        line += f"  ttfb p50 <={result['ttfb_p50_ms']:.1f} ms  write p99 <={result['write_p99_ms']:.1f} ms"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--extension", type=Path, default=DEFAULT_EXTENSION)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--segments", type=int, default=1)
+    parser.add_argument("--rate", type=int, default=0, help="server bytes/sec per connection, 0 = unlimited")
+    parser.add_argument("--latency", type=float, default=0.0, help="server delay before each response, seconds")
+    parser.add_argument("--no-ranges", action="store_true", help="server ignores Range headers")
+    parser.add_argument("--task-limit", type=int, default=0, help="engine-side bytes/sec cap on the task")
+    parser.add_argument("--disk-rate", type=int, default=0, help="simulated disk bytes/sec, 0 = real disk")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--suite", action="store_true", help="run every preset scenario in SUITE")
+    parser.add_argument("--json", action="store_true", help="print results as a JSON list")
+    args = parser.parse_args()
+
+    module = load_extension(args.extension)
+    if args.disk_rate:
+        module.open = slow_open(args.disk_rate)
+    size = args.size_mb * 1024 * 1024
+
+    base = {
+        "segments": args.segments, "rate": args.rate, "latency": args.latency,
+        "no_ranges": args.no_ranges, "task_limit": args.task_limit,
+    }
+    scenarios = {name: {**base, **preset} for name, preset in SUITE.items()} if args.suite else {"custom": base}
+
+    results = []
+    for name, options in scenarios.items():
+        for result in run_scenario(module, name, options, size, args.runs):
+            results.append(result)
+            if not args.json:
+                print(format_result(result), flush=True)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()